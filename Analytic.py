@@ -0,0 +1,246 @@
+import json
+
+import numpy as np
+from scipy import optimize, sparse
+from scipy.sparse import linalg
+
+TIE = -1
+# lead of the state where a published selfish block and an honest block race at the same height
+MAX_LEAD = 200
+# leads above are folded into MAX_LEAD, their stationary probability is below (alpha / (1 - alpha)) ** MAX_LEAD
+REWARDS = (("regular", "selfish"), ("regular", "honest"), ("uncle", "selfish"), ("uncle", "honest"),
+           ("nephew", "selfish"), ("nephew", "honest"))
+# (reward kind, miner class) of the columns of a reward vector
+SELFISH, HONEST = "selfish", "honest"
+
+
+def reward_vector():
+    return np.zeros(len(REWARDS))
+
+
+def credit(rewards, kind, owner, amount):
+    rewards[REWARDS.index((kind, owner))] += amount
+
+
+def include(pending, nephew_owner, rewards, capacity=2):
+    """
+    Let the next chain block, mined by <nephew_owner>, include up to <capacity> pending honest stale blocks,
+    nearest first like RewardEngine.include_below, then move the others one generation further
+    Args:
+        pending: tuple of the distances from the pending stale blocks to the next chain block, sorted
+        nephew_owner: SELFISH or HONEST
+        rewards: reward vector credited with the uncle and nephew rewards
+        capacity: number of uncles the nephew may still include
+    Returns:
+        tuple, the pending stale blocks of the chain block after the nephew
+    """
+    for distance in pending[:capacity]:
+        credit(rewards, "uncle", HONEST, (8 - distance) * 4)
+        credit(rewards, "nephew", nephew_owner, 1)
+    remaining = []
+    for distance in pending[capacity:]:
+        if distance < 6:
+            remaining.append(distance + 1)
+        else:
+            # too far to earn an uncle reward, a later nephew (usually the same miner class) still includes it
+            credit(rewards, "nephew", nephew_owner, 1)
+    return tuple(remaining)
+
+
+def add_stale(pending, distance, rewards, nephew_owner):
+    """
+    Add an honest stale block at <distance> from the next chain block to <pending>
+    """
+    if distance > 6:
+        credit(rewards, "nephew", nephew_owner, 1)
+        return pending
+    return tuple(sorted(pending + (distance,)))
+
+
+def transitions(state, alpha, gamma, max_lead=MAX_LEAD):
+    """
+    Transitions of the selfish mining Markov chain on the next mined block, with the strategy of SelfishMiner:
+    the private chain is kept until the public chain is one block behind it, then published whole. Uncles follow
+    the rules of RewardEngine: a chain block includes up to 2 stale blocks mined (or for selfish blocks,
+    published) before it, nearest first, and rewards are credited once the blocks they depend on are certain to
+    stay on the chain.
+    Args:
+        state: (lead, pending): lead of the private chain over the public one (TIE for a race), and the sorted
+               distances of the honest stale blocks not yet included as uncles to the next chain block
+        alpha: hash power share of the selfish miner
+        gamma: share of the honest hash power mining on the selfish block of a race
+        max_lead: leads are capped at max_lead
+    Returns:
+        [(probability, next state, reward vector)]
+    """
+    lead, pending = state
+    beta = 1 - alpha
+    result = []
+    if lead == 0:
+        rewards = reward_vector()
+        credit(rewards, "regular", HONEST, 32)
+        result.append((beta, (0, include(pending, HONEST, rewards)), rewards))
+        result.append((alpha, (1, pending), reward_vector()))
+    elif lead == 1:
+        # the selfish block is now certain to stay on the chain, and so is the new one
+        rewards = reward_vector()
+        credit(rewards, "regular", SELFISH, 64)
+        next_pending = include(include(pending, SELFISH, rewards), SELFISH, rewards)
+        result.append((alpha, (2, next_pending), rewards))
+        # an honest block at the same height, the selfish miner publishes its block
+        result.append((beta, (TIE, pending), reward_vector()))
+    elif lead == TIE:
+        # the selfish miner extends its block: the honest block of the race becomes stale
+        rewards = reward_vector()
+        credit(rewards, "regular", SELFISH, 64)
+        next_pending = add_stale(include(pending, SELFISH, rewards), 1, rewards, SELFISH)
+        result.append((alpha, (0, include(next_pending, SELFISH, rewards)), rewards))
+        # honest miners extend the selfish block
+        rewards = reward_vector()
+        credit(rewards, "regular", SELFISH, 32)
+        credit(rewards, "regular", HONEST, 32)
+        next_pending = add_stale(include(pending, SELFISH, rewards), 1, rewards, HONEST)
+        result.append((beta * gamma, (0, include(next_pending, HONEST, rewards)), rewards))
+        # honest miners extend the honest block: the selfish block becomes stale, the nephew includes it first
+        rewards = reward_vector()
+        credit(rewards, "regular", HONEST, 64)
+        next_pending = include(pending, HONEST, rewards)
+        credit(rewards, "uncle", SELFISH, (8 - 1) * 4)
+        credit(rewards, "nephew", HONEST, 1)
+        result.append((beta * (1 - gamma), (0, include(next_pending, HONEST, rewards, 1)), rewards))
+    else:
+        rewards = reward_vector()
+        credit(rewards, "regular", SELFISH, 32)
+        result.append((alpha, (min(lead + 1, max_lead), include(pending, SELFISH, rewards)), rewards))
+        # the honest block is stale, at <lead> generations below the next block of the private chain
+        rewards = reward_vector()
+        next_pending = add_stale(pending, lead, rewards, SELFISH)
+        # at a lead of 2 the selfish miner publishes its private chain and the race is over
+        result.append((beta, (0 if lead == 2 else lead - 1, next_pending), rewards))
+    return result
+
+
+def build_chain(alpha, gamma, max_lead=MAX_LEAD):
+    """
+    Enumerate the states reachable from (0, ()) and build the sparse transition matrix
+    Returns:
+        states: [state], P: scipy.sparse.csr_matrix of the transition probabilities, R: numpy array of the
+        expected reward vector of a transition from each state
+    """
+    start = (0, ())
+    index = {start: 0}
+    states = [start]
+    rows, cols, probabilities = [], [], []
+    expected = []
+    i = 0
+    while i < len(states):
+        rewards = reward_vector()
+        for probability, next_state, transition_rewards in transitions(states[i], alpha, gamma, max_lead):
+            if probability == 0:
+                continue
+            j = index.get(next_state)
+            if j is None:
+                j = index[next_state] = len(states)
+                states.append(next_state)
+            rows.append(i)
+            cols.append(j)
+            probabilities.append(probability)
+            rewards += probability * transition_rewards
+        expected.append(rewards)
+        i += 1
+    n = len(states)
+    P = sparse.csr_matrix((probabilities, (rows, cols)), shape=(n, n))
+    return states, P, np.array(expected)
+
+
+def stationary(P):
+    """
+    Returns:
+        numpy array, stationary distribution of the irreducible chain with transition matrix <P>
+    """
+    n = P.shape[0]
+    A = (P.T - sparse.identity(n, format="csr")).tolil()
+    # the balance equations are dependent: replace one by the normalization
+    A[n - 1, :] = np.ones(n)
+    b = np.zeros(n)
+    b[n - 1] = 1
+    return linalg.spsolve(A.tocsc(), b)
+
+
+def expected_rewards(alpha, gamma, max_lead=MAX_LEAD):
+    """
+    Expected rewards of the selfish and honest miners per mined block, in the units of MainMonitor.reward:
+    32 per chain block, (8 - distance) * 4 per uncle and 1 per included uncle to the nephew. Blocks propagate
+    instantly apart from the race of a published selfish block, where <gamma> of the honest hash power mines on it.
+    Args:
+        alpha: hash power share of the selfish miner, as selfish_miner_hash_power_in_percent
+        gamma: share of the honest hash power mining on the selfish block of a race
+        max_lead: leads are capped at max_lead
+    Returns:
+        dict{reward kind: dict{miner class: expected reward}} with kinds "regular", "uncle" and "nephew", and the
+        selfish rewards ratio under "ratio" as reported by MainMonitor.report
+    """
+    if alpha <= 0:
+        return {"regular": {SELFISH: 0.0, HONEST: 32.0}, "uncle": {SELFISH: 0.0, HONEST: 0.0},
+                "nephew": {SELFISH: 0.0, HONEST: 0.0}, "ratio": 0.0}
+    _, P, R = build_chain(alpha, gamma, max_lead)
+    totals = stationary(P) @ R
+    result = {}
+    for (kind, owner), total in zip(REWARDS, totals):
+        result.setdefault(kind, {})[owner] = float(total)
+    selfish = sum(result[kind][SELFISH] for kind in ("regular", "uncle", "nephew"))
+    honest = sum(result[kind][HONEST] for kind in ("regular", "uncle", "nephew"))
+    result["ratio"] = selfish / (selfish + honest)
+    return result
+
+
+def selfish_ratio(alpha, gamma, max_lead=MAX_LEAD):
+    return expected_rewards(alpha, gamma, max_lead)["ratio"]
+
+
+def gamma_from_races(propagation_rates):
+    """
+    Returns:
+        gamma measured by a racing test: the mean share of the honest miners that mined on the selfish block of
+        a race (MainMonitor.propagation_rates)
+    """
+    return sum(propagation_rates) / len(propagation_rates)
+
+
+def calibrate_gamma(alpha, ratio, max_lead=MAX_LEAD):
+    """
+    Find the gamma for which the model gives the selfish rewards ratio <ratio> of a simulation at <alpha>, the
+    ratio increases with gamma
+    Returns:
+        gamma in [0, 1], clipped when <ratio> is outside the ratios the model can give
+    """
+    low = selfish_ratio(alpha, 0, max_lead) - ratio
+    if low >= 0:
+        return 0.0
+    if selfish_ratio(alpha, 1, max_lead) - ratio <= 0:
+        return 1.0
+    return optimize.brentq(lambda gamma: selfish_ratio(alpha, gamma, max_lead) - ratio, 0, 1, xtol=1e-6)
+
+
+def main(config_file='selfish_config.json', gamma=None):
+    """
+    Print the expected rewards of each selfish hash power of config "hrs" (or
+    "selfish_miner_hash_power_in_percent"), with config "analytic.gamma" unless <gamma> is given
+    """
+    config = json.load(open(config_file))
+    settings = config.get('analytic', {})
+    if gamma is None:
+        gamma = settings.get('gamma', 0.5)
+    hrs = config.get('hrs') or [config['selfish_miner_hash_power_in_percent']]
+    for hr in hrs:
+        result = expected_rewards(hr, gamma, settings.get('max_lead', MAX_LEAD))
+        print(f"Selfish hr in percent: {hr}\n"
+              + f"Gamma: {gamma}\n"
+              + f"Selfish rewards ratio: {result['ratio']}\n"
+              + "".join(f"{kind.capitalize()} rewards per block: {result[kind][SELFISH]} / "
+                        f"{result[kind][SELFISH] + result[kind][HONEST]}\n" for kind in ("regular", "uncle", "nephew")))
+
+
+if __name__ == '__main__':
+    from fire import Fire
+    Fire(main)
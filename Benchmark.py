@@ -0,0 +1,287 @@
+import itertools
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+
+from Block import Block
+from Event import ReceiveNewBlockEvent, process_event, update_event
+from Log import configure
+from MainMonitor import new_monitor, new_pow
+from Miner import Miner
+from NetworkTopology import NetworkGraphGen
+from POW import POW
+
+GRID_KEYS = ("miner_count", "neighbour_count", "network_upload_bandwidth", "selfish_miner_hash_power_in_percent")
+# configuration keys the benchmark grid varies, other keys are taken from the configuration
+METRICS = {"ticks_per_s": 1, "blocks_per_s": 1, "events_per_s": 1, "peak_rss_kb": -1}
+# metrics compared against a baseline: 1 if higher is better, -1 if lower is better
+PART_METRICS = {"wall_time": -1, "blocks_per_s": 1, "events_per_s": 1}
+# metrics of the simulation part benchmarks compared against a baseline, those a part does not measure are skipped
+
+
+def grid_cases(config):
+    """
+    Returns:
+        [dict] of the settings of each benchmark case: the cartesian product of the lists in config "benchmark",
+        each key of GRID_KEYS defaults to its configured value
+    """
+    settings = config.get('benchmark', {})
+    values = [settings.get(key, [config[key]]) for key in GRID_KEYS]
+    return [dict(zip(GRID_KEYS, combination)) for combination in itertools.product(*values)]
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(args):
+    """
+    Run one simulation of the grid, in a fresh worker process so that its peak RSS is its own
+    Args:
+        args: (config, case settings)
+    Returns:
+        dict of the case settings and its measurements
+    """
+    config, case = args
+    config = dict(config, quiet=1, trace_file=None, checkpoint_file=None, resume_from=None, **case)
+    config['simulation_blocks'] = config.get('benchmark', {}).get('simulation_blocks', config['simulation_blocks'])
+    configure(config)
+    pow = new_pow(config)
+    random.seed(config['random_seed'])
+    start = time.perf_counter()
+    monitor = new_monitor(config, pow, case['selfish_miner_hash_power_in_percent'])
+    setup_time = time.perf_counter() - start
+    start = time.perf_counter()
+    monitor.run_simulation(config['simulation_blocks'], config.get('engine', 'tick'), config.get('propagation', 'event'))
+    wall_time = time.perf_counter() - start
+    events = sum(miner.recv_events.processed + miner.send_events.processed for miner in monitor.miners)
+    return {
+        "case": case,
+        "setup_time": setup_time,
+        "wall_time": wall_time,
+        "ticks": monitor.clock,
+        "blocks": monitor.pow.block_count,
+        "events": events,
+        "ticks_per_s": monitor.clock / wall_time,
+        "blocks_per_s": monitor.pow.block_count / wall_time,
+        "events_per_s": events / wall_time,
+        "peak_rss_kb": peak_rss_kb(),
+        "selfish_rewards_ratio": monitor.selfish_rewards_ratio,
+    }
+
+
+def bench_random_graph(miner_count, neighbour_count):
+    pow = POW(1, 1)
+    miners = [Miner(i, pow, 1, 1, 1) for i in range(miner_count)]
+    start = time.perf_counter()
+    NetworkGraphGen.random_graph(miners, neighbour_count)
+    return {"part": "random_graph", "miner_count": miner_count, "neighbour_count": neighbour_count,
+            "wall_time": time.perf_counter() - start}
+
+
+def bench_process_event(event_count):
+    """
+    Process <event_count> receptions of new blocks by one miner, without relaying them
+    """
+    pow = POW(1, 1)
+    miner = Miner(1, pow, 1, 1, event_count)
+    for i in range(event_count):
+        block = pow.new_block(pow.record_block(), 2, 0, 0, 2)
+        update_event(ReceiveNewBlockEvent(0, block, relay=False), miner.recv_events)
+    start = time.perf_counter()
+    process_event(miner, miner.recv_events, event_count)
+    wall_time = time.perf_counter() - start
+    return {"part": "process_event", "events": event_count, "wall_time": wall_time,
+            "events_per_s": event_count / wall_time}
+
+
+def bench_reward(config, block_count, fork_rate=0.15):
+    """
+    Assign uncles and rewards on a synthetic chain of <block_count> blocks, <fork_rate> of the heights having
+    a stale sibling
+    """
+    config = dict(config, quiet=1, miner_count=10, neighbour_count=2, selfish_propagator_count=0, trace_file=None)
+    monitor = new_monitor(config, new_pow(config), config['selfish_miner_hash_power_in_percent'])
+    blocks = {0: monitor.pow.prime_block}
+    tip = blocks[0]
+    clock = 0
+    while len(blocks) < block_count:
+        clock += random.randint(1, 5)
+        if random.random() < fork_rate:
+            stale = Block(len(blocks), random.randint(0, 10), clock, tip.id, tip.height + 1, monitor.pow.knowledge)
+            stale.publish_timestamp = clock if stale.miner_id == 0 else -1
+            blocks[stale.id] = stale
+            tip.add_child(stale.id)
+        block = Block(len(blocks), random.randint(0, 10), clock + 1, tip.id, tip.height + 1, monitor.pow.knowledge)
+        blocks[block.id] = block
+        tip.add_child(block.id)
+        tip = block
+    start = time.perf_counter()
+    monitor.reward(blocks, tip.id)
+    wall_time = time.perf_counter() - start
+    return {"part": "reward", "blocks": len(blocks), "wall_time": wall_time, "blocks_per_s": len(blocks) / wall_time}
+
+
+def run(config_file='selfish_config.json', output='benchmark.json'):
+    """
+    Run the benchmark grid of config "benchmark" and the benchmarks of the simulation parts, print them and save
+    them as JSON (a baseline for compare)
+    """
+    config = json.load(open(config_file))
+    settings = config.get('benchmark', {})
+    random.seed(config['random_seed'])
+    cases = grid_cases(config)
+    results = []
+    # one worker per case, so that the peak RSS of each case is measured alone
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_case, [(config, case) for case in cases]):
+            results.append(result)
+            print(format_case(result))
+    parts = []
+    for miner_count, neighbour_count in sorted({(case['miner_count'], case['neighbour_count']) for case in cases}):
+        parts.append(bench_random_graph(miner_count, neighbour_count))
+    parts.append(bench_process_event(settings.get('process_event_count', 100000)))
+    parts.append(bench_reward(config, settings.get('reward_block_count', 100000)))
+    for part in parts:
+        print(json.dumps(part))
+    with open(output, "w") as f:
+        json.dump({"python": platform.python_version(), "machine": platform.machine(), "time": time.time(),
+                   "cases": results, "parts": parts}, f, indent=2)
+
+
+def format_case(result):
+    return " ".join(f"{key}={value}" for key, value in result['case'].items()) \
+        + f": {result['ticks_per_s']:.1f} ticks/s, {result['blocks_per_s']:.2f} blocks/s, " \
+        + f"{result['events_per_s']:.0f} events/s, {result['peak_rss_kb'] / 1024:.1f} MB peak RSS"
+
+
+def case_key(case):
+    return tuple(case[key] for key in GRID_KEYS)
+
+
+def part_key(part):
+    # name and settings of a part benchmark
+    return tuple((key, value) for key, value in part.items() if key not in PART_METRICS)
+
+
+def curves(results_file='benchmark.json', x='miner_count', y='ticks_per_s'):
+    """
+    Print the scaling curve of metric <y> along grid key <x>, one curve per setting of the other grid keys
+    """
+    curves = {}
+    for result in json.load(open(results_file))['cases']:
+        others = tuple((key, value) for key, value in result['case'].items() if key != x)
+        curves.setdefault(others, []).append((result['case'][x], result[y]))
+    for others, points in curves.items():
+        print(" ".join(f"{key}={value}" for key, value in others))
+        for value, metric in sorted(points):
+            print(f"    {x}={value}: {y}={metric:.1f}")
+
+
+def compare_metrics(label, base, result, metrics, tolerance):
+    """
+    Print the change of each of <metrics> from <base> to <result>
+    Returns:
+        int, number of metrics that got worse by more than <tolerance>
+    """
+    regressions = 0
+    for metric, direction in metrics.items():
+        if metric not in base or metric not in result or base[metric] == 0:
+            continue
+        change = (result[metric] - base[metric]) / base[metric]
+        flag = ""
+        if change * direction < -tolerance:
+            flag = " REGRESSION"
+            regressions += 1
+        print(f"{label} {metric}: {base[metric]:.6g} -> {result[metric]:.6g} ({change:+.1%}){flag}")
+    return regressions
+
+
+def compare(baseline, current, tolerance=0.1, strict=False):
+    """
+    Compare two benchmark results and flag the metrics of METRICS (PART_METRICS for the simulation part benchmarks)
+    that got worse by more than <tolerance>
+    Args:
+        baseline: JSON file written by run
+        current: JSON file written by run
+        tolerance: relative change allowed
+        strict: if True, exit with status 1 when there is a regression
+    Returns:
+        int, number of regressions
+    """
+    baseline = json.load(open(baseline))
+    current = json.load(open(current))
+    baseline_cases = {case_key(result['case']): result for result in baseline['cases']}
+    regressions = 0
+    for result in current['cases']:
+        base = baseline_cases.get(case_key(result['case']))
+        if base is not None:
+            regressions += compare_metrics(case_key(result['case']), base, result, METRICS, tolerance)
+    baseline_parts = {part_key(part): part for part in baseline.get('parts', [])}
+    for part in current.get('parts', []):
+        base = baseline_parts.get(part_key(part))
+        if base is not None:
+            label = " ".join(f"{key}={value}" for key, value in part_key(part))
+            regressions += compare_metrics(label, base, part, PART_METRICS, tolerance)
+    print(f"{regressions} regressions")
+    if strict and regressions > 0:
+        sys.exit(1)
+    return regressions
+
+
+def engine_rates(config, engine, seeds):
+    """
+    Returns:
+        [float], propagation rates of the racing test of <config> under <engine>, over random seeds 0 to seeds - 1
+    """
+    rates = []
+    for seed in range(seeds):
+        run_config = dict(config, quiet=1, racing_test=1, random_seed=seed, trace_file=None, checkpoint_file=None,
+                          resume_from=None)
+        configure(run_config)
+        random.seed(seed)
+        monitor = new_monitor(run_config, new_pow(run_config), run_config['selfish_miner_hash_power_in_percent'])
+        monitor.run_simulation(run_config['simulation_blocks'], engine, run_config.get('propagation', 'event'))
+        rates.extend(monitor.propagation_rates)
+    return rates
+
+
+def engines(config_file='selfish_config.json', seeds=5, engine='event', sigmas=4.0, strict=False):
+    """
+    Check that <engine> gives the propagation rates of the "tick" engine on the racing test of the configuration:
+    the engines draw their random numbers in different orders, so their mean rates are compared, and flagged when
+    they differ by more than <sigmas> standard errors
+    Args:
+        config_file: configuration of the racing test, "racing_test" is set
+        seeds: number of random seeds each engine runs
+        engine: engine compared with the "tick" engine
+        sigmas: number of standard errors of the difference allowed
+        strict: if True, exit with status 1 when the engines differ
+    Returns:
+        bool, True if the engines agree
+    """
+    config = json.load(open(config_file))
+    means = {}
+    variances = {}
+    for name in ("tick", engine):
+        rates = engine_rates(config, name, seeds)
+        means[name] = sum(rates) / len(rates)
+        variances[name] = sum((rate - means[name]) ** 2 for rate in rates) / max(len(rates) - 1, 1) / len(rates)
+        print(f"{name}: {len(rates)} races, mean propagation rate {means[name]:.4f}")
+    difference = means[engine] - means["tick"]
+    error = (variances["tick"] + variances[engine]) ** 0.5
+    agree = abs(difference) <= sigmas * error
+    print(f"difference {difference:+.4f} ({sigmas} standard errors: {sigmas * error:.4f})"
+          + ("" if agree else " MISMATCH"))
+    if strict and not agree:
+        sys.exit(1)
+    return agree
+
+
+if __name__ == '__main__':
+    from fire import Fire
+    Fire({"run": run, "compare": compare, "curves": curves, "engines": engines})
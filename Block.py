@@ -1,5 +1,5 @@
 class Block:
-    def __init__(self, id, miner_id, timestamp, parent_id, height):
+    def __init__(self, id, miner_id, timestamp, parent_id, height, knowledge=None):
         """
         Represent a block in the blockchain
         Args:
@@ -7,6 +7,7 @@ class Block:
             miner: Miner id
             timestamp: Clock counter
             parent: parent id
+            knowledge: KnowledgeMatrix recording which miners received the block
         """
         self.id = id
         self.miner_id = miner_id
@@ -16,12 +17,19 @@ class Block:
         # self.other_children = [] # invalid childrens
         self.uncles = [] # ids of uncles
         self.height = height
-        self.notified_miner_count = 0
-        self.pending_notified_miner_count = 1 # for the miner who mined the block
+        self.knowledge = knowledge
         self.racing = False
         self.win_race_count = 0
         self.publish_timestamp = -1
 
+    @property
+    def notified_miner_count(self):
+        return self.knowledge.received_count(self.id)
+
+    @property
+    def pending_notified_miner_count(self):
+        return self.knowledge.pending_count(self.id)
+
     def need_more_uncles(self):
         return len(self.uncles) < 2
 
@@ -41,13 +49,16 @@ class Block:
 
 
     def subtree_str(self, blocks, level=0):
-        ret = "\t" * level + f"<{self.id},{self.miner_id},{self.notified_miner_count},{self.pending_notified_miner_count}>" + "\n"
-        children_str = [blocks[child].subtree_str(blocks, level + 1) for child in self.children]
-        children_str.sort(key=lambda s: len(s))
-        ret += "".join(children_str)
-        # for child in self.children:
-        #     ret += blocks[child].subtree_str(blocks, level + 1)
-        return ret
+        # iterative, see BlockTreeSnapshot.to_text: chains are too long to recurse
+        from Snapshot import BlockTreeSnapshot
+        subtree = {}
+        stack = [self]
+        while len(stack) > 0:
+            block = stack.pop()
+            subtree[block.id] = block
+            stack.extend(blocks[child] for child in block.children)
+        text = BlockTreeSnapshot(subtree, 0, 0).to_text()
+        return "".join("\t" * level + line for line in text.splitlines(keepends=True))
 
     # def subtree_str2(self, blocks, level=0):
     #     ret = f"<{'{0:0=4d}'.format(self.id)},{'{0:0=4d}'.format(self.miner_id)}> | "
@@ -0,0 +1,83 @@
+import bisect
+import itertools
+
+
+class BlockFinderSampler:
+    def __init__(self, pow, miners):
+        """
+        Network-wide sampler of the next block: every pow attempt of every miner is a draw of the same
+        geometric stream, so the next block comes from a single waiting time over the attempts of all miners.
+        The attempts of a clock time are laid out miner after miner in id order, hash_power attempts each, and the
+        finder is the miner owning the successful attempt: like the tick engine, a miner finds at most hash_power
+        blocks per clock time, Binomial(hash_power, p) of them.
+        The layout is rebuilt only when the hash power of a miner changes (pow.hash_power_version).
+        Args:
+            pow: pow shared among all miners
+            miners: list of Miner objects
+        """
+        self.pow = pow
+        self.miners = miners
+        self.version = None
+        # pow.hash_power_version the layout was built for
+        self.finders = []
+        # miners with hash power, in the order of their attempts within a clock time
+        self.ends = []
+        # end of the attempts of each finder within a clock time
+        self.total_hash_power = 0
+        self.next_attempt = None
+        # index of the next successful attempt, counted from clock 0 at the current total hash power
+        self.pending = None
+        # (clock time, Miner object) of the next block, drawn by next_clock but not yet taken by found_at
+
+    def outdated(self):
+        return self.version != self.pow.hash_power_version
+
+    def rebuild(self, clock):
+        """
+        Rebuild the attempt layout from the current hash power, the attempts before <clock> are dropped
+        """
+        self.version = self.pow.hash_power_version
+        self.finders = sorted((miner for miner in self.miners if miner.hash_power > 0), key=lambda miner: miner.id)
+        self.ends = list(itertools.accumulate(miner.hash_power for miner in self.finders))
+        self.total_hash_power = self.ends[-1] if len(self.ends) > 0 else 0
+        self.next_attempt = clock * self.total_hash_power + self.pow.sample_attempts() - 1
+
+    def next_block(self, clock):
+        """
+        Draw the next successful pow at or after <clock>, rebuilding the layout first if the hash power changed
+        Args:
+            clock: first clock time at which the block may be found
+        Returns:
+            (clock time, Miner object) of the next block, None if no miner has hash power
+        """
+        if self.outdated():
+            self.rebuild(clock)
+        if len(self.finders) == 0:
+            return None
+        if self.next_attempt < clock * self.total_hash_power:
+            self.next_attempt = clock * self.total_hash_power + self.pow.sample_attempts() - 1
+        block_clock, attempt = divmod(self.next_attempt, self.total_hash_power)
+        self.next_attempt += self.pow.sample_attempts()
+        return block_clock, self.finders[bisect.bisect_right(self.ends, attempt)]
+
+    def next_clock(self, clock):
+        """
+        Returns:
+            clock time of the next block at or after <clock>, None if no miner has hash power
+        """
+        if self.pending is None:
+            self.pending = self.next_block(clock)
+        return None if self.pending is None else self.pending[0]
+
+    def found_at(self, clock):
+        """
+        Draw the blocks found at <clock>, for a caller going through the clock times in increasing order
+        Returns:
+            dict{miner_id: number of blocks found at <clock>}
+        """
+        found = {}
+        while self.next_clock(clock) == clock:
+            miner_id = self.pending[1].id
+            found[miner_id] = found.get(miner_id, 0) + 1
+            self.pending = None
+        return found
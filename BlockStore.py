@@ -0,0 +1,213 @@
+import numpy as np
+
+from Block import Block
+
+
+class BlockStore:
+    def __init__(self, knowledge, capacity=1024):
+        """
+        Struct-of-arrays storage of all blocks of a simulation, indexed by block id. Children are not stored,
+        they are kept as a CSR adjacency (see children_csr) derived from parent ids when needed.
+        Blocks are handed out as BlockView objects which behave like Block.
+        Args:
+            knowledge: KnowledgeMatrix recording which miners received the blocks
+            capacity: initial number of blocks, the arrays double when full
+        """
+        self.knowledge = knowledge
+        self.size = 0
+        # number of block ids in use
+        self.miner_id = np.full(capacity, -1, dtype=np.int32)
+        self.timestamp = np.zeros(capacity, dtype=np.int32)
+        self.parent_id = np.full(capacity, -1, dtype=np.int32)
+        self.height = np.zeros(capacity, dtype=np.int32)
+        self.publish_timestamp = np.full(capacity, -1, dtype=np.int32)
+        self.win_race_count = np.zeros(capacity, dtype=np.int32)
+        self.racing = np.zeros(capacity, dtype=np.bool_)
+        self.uncles = np.full((capacity, 2), -1, dtype=np.int32)
+        # ids of the (at most 2) uncles of each block, -1 for none
+        self.extra_uncles = {}
+        # dict{block_id: [uncle ids]} beyond the first 2
+        self.csr = None
+        # cached (indptr, indices) of the children adjacency, None when outdated
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, id):
+        return BlockView(self, id)
+
+    def grow(self, capacity):
+        for name in ("miner_id", "timestamp", "parent_id", "height", "publish_timestamp", "win_race_count",
+                     "racing", "uncles"):
+            array = getattr(self, name)
+            new_array = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+            new_array[:len(array)] = array
+            new_array[len(array):] = -1 if name in ("miner_id", "parent_id", "publish_timestamp", "uncles") else 0
+            setattr(self, name, new_array)
+
+    def add(self, id, miner_id, timestamp, parent_id, height):
+        """
+        Store a new block, same arguments as Block
+        Returns:
+            BlockView of the new block
+        """
+        if id >= len(self.height):
+            self.grow(max(2 * len(self.height), id + 1))
+        self.miner_id[id] = miner_id
+        self.timestamp[id] = timestamp
+        self.parent_id[id] = parent_id
+        self.height[id] = height
+        self.size = max(self.size, id + 1)
+        self.csr = None
+        return BlockView(self, id)
+
+    def children_csr(self):
+        """
+        Returns:
+            (indptr, indices): the children of block i are indices[indptr[i]:indptr[i+1]], in id order
+        """
+        if self.csr is None:
+            parents = self.parent_id[1:self.size]
+            order = np.argsort(parents, kind="stable")
+            indices = order + 1
+            counts = np.bincount(parents[parents >= 0], minlength=self.size)
+            indptr = np.zeros(self.size + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+            # blocks without parent (prime block) sort first, skip them
+            self.csr = (indptr, indices[len(parents) - int(indptr[-1]):])
+        return self.csr
+
+    def nbytes(self):
+        """
+        Returns:
+            bytes used by the arrays
+        """
+        return sum(getattr(self, name).nbytes for name in (
+            "miner_id", "timestamp", "parent_id", "height", "publish_timestamp", "win_race_count", "racing",
+            "uncles"))
+
+
+class UncleList:
+    __slots__ = ("store", "id")
+
+    def __init__(self, store, id):
+        """
+        List-like view of the uncles of a block in a BlockStore
+        """
+        self.store = store
+        self.id = id
+
+    def __len__(self):
+        count = int((self.store.uncles[self.id] >= 0).sum())
+        return count + len(self.store.extra_uncles.get(self.id, []))
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __getitem__(self, i):
+        return self.tolist()[i]
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def tolist(self):
+        uncles = [int(u) for u in self.store.uncles[self.id] if u >= 0]
+        return uncles + self.store.extra_uncles.get(self.id, [])
+
+    def append(self, uncle_id):
+        row = self.store.uncles[self.id]
+        if row[0] < 0:
+            row[0] = uncle_id
+        elif row[1] < 0:
+            row[1] = uncle_id
+        else:
+            self.store.extra_uncles.setdefault(self.id, []).append(uncle_id)
+
+    def clear(self):
+        self.store.uncles[self.id] = -1
+        self.store.extra_uncles.pop(self.id, None)
+
+
+class BlockView:
+    __slots__ = ("store", "id")
+
+    def __init__(self, store, id):
+        """
+        Thin view of a block stored in a BlockStore, with the attributes and methods of Block
+        Args:
+            store: BlockStore holding the block
+            id: block id
+        """
+        self.store = store
+        self.id = id
+
+    def __eq__(self, other):
+        return isinstance(other, BlockView) and self.store is other.store and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    @property
+    def miner_id(self):
+        return int(self.store.miner_id[self.id])
+
+    @property
+    def timestamp(self):
+        return int(self.store.timestamp[self.id])
+
+    @property
+    def parent_id(self):
+        return int(self.store.parent_id[self.id])
+
+    @property
+    def height(self):
+        return int(self.store.height[self.id])
+
+    @property
+    def publish_timestamp(self):
+        return int(self.store.publish_timestamp[self.id])
+
+    @publish_timestamp.setter
+    def publish_timestamp(self, value):
+        self.store.publish_timestamp[self.id] = value
+
+    @property
+    def notified_miner_count(self):
+        return self.store.knowledge.received_count(self.id)
+
+    @property
+    def pending_notified_miner_count(self):
+        return self.store.knowledge.pending_count(self.id)
+
+    @property
+    def win_race_count(self):
+        return int(self.store.win_race_count[self.id])
+
+    @win_race_count.setter
+    def win_race_count(self, value):
+        self.store.win_race_count[self.id] = value
+
+    @property
+    def racing(self):
+        return bool(self.store.racing[self.id])
+
+    @racing.setter
+    def racing(self, value):
+        self.store.racing[self.id] = value
+
+    @property
+    def children(self):
+        indptr, indices = self.store.children_csr()
+        return indices[indptr[self.id]:indptr[self.id + 1]].tolist()
+
+    @property
+    def uncles(self):
+        return UncleList(self.store, self.id)
+
+    def add_child(self, child_id):
+        # children are derived from the parent id of the child
+        pass
+
+    need_more_uncles = Block.need_more_uncles
+    __str__ = Block.__str__
+    subtree_str = Block.subtree_str
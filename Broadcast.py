@@ -3,45 +3,149 @@ import time
 
 # one central node, receive request from all other nodes
 # other nodes runs local pow
+GENESIS = (0, 0)
+# id of the first block, block ids are (miner id, number of blocks mined by the miner) so that ranks never clash
+UPDATE_TAG, ANNOUNCE_TAG, ACK_TAG = 0, 1, 2
+# message tags: monitor updates to the miners, chains announced by the miners, DAG versions applied by the miners
+
+
+def isend(comm, requests, message, dest, tag):
+    """
+    Send <message> without blocking, its request is kept in <requests> until the send completes
+    """
+    requests[:] = [request for request in requests if not request.Test()]
+    requests.append(comm.isend(message, dest=dest, tag=tag))
+
+
+class BlockDag:
+    def __init__(self):
+        """
+        Blocks of all chains as parent pointers: a chain is the path from its tip to GENESIS, so chains sharing a
+        prefix share its blocks. Blocks are logged in insertion order, the version of the DAG is the length of the
+        log, and the blocks added after a version are sent as a delta (see since).
+        """
+        self.parents = {GENESIS: None}
+        # dict{block id: parent block id}
+        self.miners = {GENESIS: 0}
+        # dict{block id: id of the miner that found it}
+        self.heights = {GENESIS: 0}
+        # dict{block id: number of blocks from GENESIS}
+        self.log = []
+        # (block id, parent id, miner id) of the added blocks, in insertion order
+
+    @property
+    def version(self):
+        return len(self.log)
+
+    def add(self, block_id, parent_id, miner_id):
+        """
+        Add a block whose parent is already in the DAG, blocks already in it are ignored
+        """
+        if block_id in self.parents:
+            return
+        self.parents[block_id] = parent_id
+        self.miners[block_id] = miner_id
+        self.heights[block_id] = self.heights[parent_id] + 1
+        self.log.append((block_id, parent_id, miner_id))
+
+    def add_all(self, blocks):
+        """
+        Args:
+            blocks: [(block id, parent id, miner id)], parents first
+        """
+        for block in blocks:
+            self.add(*block)
+
+    def since(self, version):
+        """
+        Returns:
+            [(block id, parent id, miner id)] added after <version>, parents first
+        """
+        return self.log[version:]
+
+    def ancestor(self, block_id, height):
+        while self.heights[block_id] > height:
+            block_id = self.parents[block_id]
+        return block_id
+
+    def extends(self, tip, other_tip):
+        """
+        Returns:
+            True if the chain of <tip> contains <other_tip>, walking only the blocks above <other_tip>
+        """
+        height = self.heights[other_tip]
+        return self.heights[tip] >= height and self.ancestor(tip, height) == other_tip
+
+    def chain(self, tip):
+        """
+        Returns:
+            [miner id] of the blocks of the chain of <tip>, from GENESIS excluded
+        """
+        miners = []
+        while tip != GENESIS:
+            miners.append(self.miners[tip])
+            tip = self.parents[tip]
+        return miners[::-1]
+
+
 class BlockChain:
-    def __init__(self, chain_id, propagation_power, selfish = False):
+    def __init__(self, chain_id, propagation_power, selfish = False, tip = GENESIS, height = 0):
         """
+        Chain of a BlockDag, referenced by its tip block so that it is cheap to copy and send
         Args:
             propagation_power (int): a number representing the power of be propagated,
                                      if there are multiple chains of same length exists, the break tie rule would be
                                      random selection using propagation_power / sum(all_propagation_power)
             other chains of the same length
+            tip: id of the last block of the chain
+            height (int): number of blocks of the chain
         """
         self.chain_id = chain_id
-        self.chain = []
         self.propagation_power = propagation_power
         self.selfish  = selfish
+        self.tip = tip
+        self.height = height
 
     def __str__(self):
-        return str(self.chain)
+        return f"<{self.chain_id}: {self.tip} at {self.height}>"
 
-    def append_chain(self, miner_id):
-        self.chain.append(miner_id)
+    def copy(self):
+        return BlockChain(self.chain_id, self.propagation_power, self.selfish, self.tip, self.height)
 
-    def successor(self, other_chain):
+    def append_block(self, dag, block_id, miner_id):
+        """
+        Add block <block_id> found by <miner_id> on top of this chain to <dag>
+        Returns:
+            (block id, parent id, miner id) of the new block
+        """
+        block = (block_id, self.tip, miner_id)
+        dag.add(*block)
+        self.tip = block_id
+        self.height += 1
+        return block
+
+    def successor(self, other_chain, dag):
         """
         returns the longer chain is the longer one of this chain and other chain extends the shorter one
         Args:
             other_chain (BlockChain): other blochchain object
+            dag (BlockDag): DAG holding the blocks of both chains
 
         Returns:
             None if not successor relationship, else the longer chain
         """
         longer = self
         shorter = other_chain
-        if len(other_chain.chain) > len(self.chain):
+        if other_chain.height > self.height:
             longer = other_chain
             shorter = self
-        if longer.chain[:len(shorter.chain)] == shorter.chain:
+        if dag.extends(longer.tip, shorter.tip):
             return longer
 
+
 class BlockChainTree:
     def __init__(self):
+        self.dag = BlockDag()
         self.longest = []
         self.tree = {}
         self.count = 0
@@ -54,27 +158,48 @@ class BlockChainTree:
         ==============================================================================================================
         """
 
-    def update(self, chain):
+    def update(self, chain, blocks=()):
+        """
+        Args:
+            chain (BlockChain): chain announced by a miner
+            blocks: [(block id, parent id, miner id)] of the chain that may be new to the DAG, parents first
+        """
+        self.dag.add_all(blocks)
         if chain.chain_id not in self.tree:
             new_chain = chain
         else:
-            successor = self.tree[chain.chain_id].successor(chain)
+            successor = self.tree[chain.chain_id].successor(chain, self.dag)
             if successor:
                 new_chain = successor
             else:
-                chain.chain_id = self.count + 1
+                self.count += 1
+                chain.chain_id = self.count
                 new_chain = chain
+        self.count = max(self.count, new_chain.chain_id)
         self.tree[new_chain.chain_id] = new_chain
-        if len(self.longest) == 0 or len(new_chain.chain) == len(self.longest[0].chain):
-            self.longest.append(new_chain)
-        elif len(new_chain.chain) > len(self.longest[0].chain):
+        if len(self.longest) == 0 or new_chain.height == self.longest[0].height:
+            self.longest = [c for c in self.longest if c.chain_id != new_chain.chain_id] + [new_chain]
+        elif new_chain.height > self.longest[0].height:
             self.longest = [new_chain]
 
+    def apply(self, blocks, longest):
+        """
+        Apply an update broadcast by the monitor node
+        Args:
+            blocks: [(block id, parent id, miner id)] added to the monitor DAG since the version this rank
+                    acknowledged, those already applied are ignored
+            longest: [BlockChain], longest chains of the monitor
+        """
+        self.dag.add_all(blocks)
+        self.longest = longest
+
     def get_longest_chain(self):
         if len(self.longest) == 0:
             return BlockChain(0, 1)
         sum_propagation_power = sum([c.propagation_power for c in self.longest])
-        return random.choices(self.longest, [c.propagation_power / sum_propagation_power for c in self.longest])[0]
+        chain = random.choices(self.longest, [c.propagation_power / sum_propagation_power for c in self.longest])[0]
+        # a copy: the miner extends it without changing the chains of the tree
+        return chain.copy()
 
 
 class POW:
@@ -112,11 +237,19 @@ class MonitorNode:
         self.network_delay = network_delay
         self.pow = pow
         self.blockchains = BlockChainTree()
+        self.acked = [0] * comm.size
+        # DAG version each rank acknowledged having applied
+        self.requests = [] # pending sends
 
     def broadcast_blockchain(self):
+        """
+        Send each rank the blocks added since the version it acknowledged and the longest chains. Blocks of updates
+        still in flight are sent again, the rank ignores those it already has.
+        """
         blockchains = self.blockchains
         for i in range(1, self.comm.size):
-            self.comm.isend(blockchains, dest=i, tag=0)
+            blocks = blockchains.dag.since(self.acked[i])
+            isend(self.comm, self.requests, (blockchains.dag.version, blocks, blockchains.longest), i, UPDATE_TAG)
         # print(blockchains)
 
     def run(self, simulation_time, miners):
@@ -132,8 +265,11 @@ class MonitorNode:
                 res = miner.test()
                 if res:
                     update_flag = True
-                    self.blockchains.update(res)
-                    miner.wait()
+                    # test posted the next receive: a second one would swallow an announcement and its blocks
+                    self.blockchains.update(*res)
+                version = miner.test_ack()
+                if version is not None:
+                    self.acked[miner.id] = max(self.acked[miner.id], version)
             if update_flag:
                 self.broadcast_blockchain()
 
@@ -150,13 +286,17 @@ class MinerNode:
         self.compute_delay = compute_delay
         self.selfish = selfish
         self.blockchains = BlockChainTree()
+        self.mined = 0 # number of blocks found, numbers the block ids
         self.res = None # response used by monitor node
+        self.ack = None # acknowledgement request used by monitor node
+        self.requests = [] # pending sends
 
     def wait(self):
         """
         Called by monitor node to wait for response
         """
-        self.res = self.comm.irecv(source=self.id)
+        self.res = self.comm.irecv(source=self.id, tag=ANNOUNCE_TAG)
+        self.ack = self.comm.irecv(source=self.id, tag=ACK_TAG)
 
     def test(self):
         """
@@ -164,36 +304,61 @@ class MinerNode:
         """
         res = self.res.test()
         if res[0]:
-            self.res = self.comm.irecv(source=self.id)
+            self.res = self.comm.irecv(source=self.id, tag=ANNOUNCE_TAG)
             return res[1]
 
-    def anounce_block(self, chain):
-        self.comm.isend(chain, dest=0)
+    def test_ack(self):
+        """
+        Called by monitor node to get the latest DAG version this miner applied
+        Returns:
+            version, None if no acknowledgement arrived
+        """
+        version = None
+        res = self.ack.test()
+        while res[0]:
+            version = res[1]
+            self.ack = self.comm.irecv(source=self.id, tag=ACK_TAG)
+            res = self.ack.test()
+        return version
+
+    def anounce_block(self, chain, blocks):
+        """
+        Send <chain> to the monitor node with its <blocks> the monitor may not have
+        """
+        isend(self.comm, self.requests, (chain, blocks), 0, ANNOUNCE_TAG)
+
+    def update_blockchain(self, update):
+        """
+        Apply an update of the monitor node and acknowledge its DAG version
+        """
+        version, blocks, longest = update
+        self.blockchains.apply(blocks, longest)
+        isend(self.comm, self.requests, version, 0, ACK_TAG)
 
-    def update_blockchain(self, blockchains):
-        self.blockchains = blockchains
+    def new_block(self, chain):
+        self.mined += 1
+        return chain.append_block(self.blockchains.dag, (self.id, self.mined), self.id)
 
     def mining(self):
         nounce = self.pow.try_POW()
         time.sleep(self.compute_delay)
         if nounce:
-            print(f"Miner {rank} finds a block!")
+            print(f"Miner {self.id} finds a block!")
             chain = self.blockchains.get_longest_chain()
-            chain.append_chain(self.id)
-            self.anounce_block(chain)
+            self.anounce_block(chain, [self.new_block(chain)])
 
     def run(self, simulation_time):
         print(f"Miner {self.id} running...")
         start = time.time()
         # initial blockchain update request from monitor node
-        bc_update_req = self.comm.irecv(source=0, tag=0)
+        bc_update_req = self.comm.irecv(source=0, tag=UPDATE_TAG)
 
         while time.time() - start < simulation_time:
             # check if there is update to the blockchain tree
             res = bc_update_req.test()
             if res[0]:
                 self.update_blockchain(res[1])
-                bc_update_req = self.comm.irecv(source=0, tag=0)
+                bc_update_req = self.comm.irecv(source=0, tag=UPDATE_TAG)
             # start mining
             self.mining()
 
@@ -201,10 +366,16 @@ class SelfishMinerNode(MinerNode):
     def __init__(self, comm, id, pow, compute_delay):
         super().__init__(comm, id, pow, compute_delay)
         self.private_chain = None
+        self.unpublished = [] # blocks of the private chain not sent to the monitor node yet
         self.selfish = True
 
-    def update_blockchain(self, blockchains):
-        self.blockchains = blockchains
+    def publish(self):
+        self.private_chain.propagation_power = 2
+        self.anounce_block(self.private_chain.copy(), self.unpublished)
+        self.unpublished = []
+
+    def update_blockchain(self, update):
+        super().update_blockchain(update)
         public_chain = self.blockchains.get_longest_chain()
         private_chain = self.private_chain
         print("==========================================================")
@@ -212,14 +383,13 @@ class SelfishMinerNode(MinerNode):
         print(f"private chain: {private_chain}")
         print("==========================================================")
         print()
-        if private_chain is None or len(public_chain.chain) > len(private_chain.chain):
+        if private_chain is None or public_chain.height > private_chain.height:
             self.private_chain = public_chain
-        elif len(public_chain.chain) == len(private_chain.chain):
-            private_chain.propagation_power = 2
-            self.comm.isend(private_chain, dest=0)
-        elif len(public_chain.chain) == len(private_chain.chain) - 1:
-            private_chain.propagation_power = 2
-            self.comm.isend(private_chain, dest=0)
+            self.unpublished = []
+        elif public_chain.height == private_chain.height:
+            self.publish()
+        elif public_chain.height == private_chain.height - 1:
+            self.publish()
         else:
             pass
 
@@ -227,10 +397,10 @@ class SelfishMinerNode(MinerNode):
         nounce = self.pow.try_POW()
         time.sleep(self.compute_delay)
         if nounce:
-            print(f"Selfish Miner {rank} finds a block!")
+            print(f"Selfish Miner {self.id} finds a block!")
             if self.private_chain is None:
                 self.private_chain = self.blockchains.get_longest_chain()
-            self.private_chain.append_chain(self.id)
+            self.unpublished.append(self.new_block(self.private_chain))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,56 @@
+import os
+import pickle
+import random
+
+from Miner import Miner
+
+
+class CheckpointPickler(pickle.Pickler):
+    def persistent_id(self, obj):
+        # miners reference each other (neighbours, queued events), pickling them by id keeps the recursion shallow
+        if isinstance(obj, Miner):
+            return obj.id
+        return None
+
+
+class CheckpointUnpickler(pickle.Unpickler):
+    def __init__(self, file, miners):
+        super().__init__(file)
+        self.miners = miners
+
+    def persistent_load(self, miner_id):
+        return self.miners[miner_id]
+
+
+def save_checkpoint(monitor, path):
+    """
+    Save the whole simulation state of <monitor> to <path>: miners with their event queues, block tree,
+    knowledge matrix, random number generators, clock and pow.block_count. The file is written next to <path>
+    and renamed, so a run killed while saving keeps its previous checkpoint.
+    Format: a pickle of [(miner class, miner id)], then a pickle of the monitor, the miner states and the state of
+    the random module in which miners are referenced by id.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump([(type(miner), miner.id) for miner in monitor.miners], f, protocol=pickle.HIGHEST_PROTOCOL)
+        CheckpointPickler(f, protocol=pickle.HIGHEST_PROTOCOL).dump({
+            "monitor": monitor,
+            "miners": {miner.id: miner.__dict__ for miner in monitor.miners},
+            "random": random.getstate(),
+        })
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Restore a simulation saved by save_checkpoint, including the state of the random module
+    Returns:
+        MainMonitor, ready to continue with run_simulation
+    """
+    with open(path, "rb") as f:
+        miners = {miner_id: cls.__new__(cls) for cls, miner_id in pickle.load(f)}
+        state = CheckpointUnpickler(f, miners).load()
+    for miner_id, miner_state in state["miners"].items():
+        miners[miner_id].__dict__.update(miner_state)
+    random.setstate(state["random"])
+    return state["monitor"]
@@ -0,0 +1,78 @@
+from Log import logger
+from Shard import ShardWorker, WindowPlanner, check_shardable, collect, partition
+
+
+def mpi():
+    # imported here: initializing MPI is only wanted by MPI runs
+    from mpi4py import MPI
+    return MPI
+
+
+def mpi_comm():
+    return mpi().COMM_WORLD
+
+
+def mpi_rank():
+    """
+    Returns:
+        rank of this process in MPI.COMM_WORLD, 0 when run without mpirun
+    """
+    return mpi_comm().Get_rank()
+
+
+def local_miner_ids(config):
+    """
+    Returns:
+        set of the ids of the miners simulated by this rank in an MPI run of <config>: the selfish miner 0, the
+        honest miners and the selfish propagators are split into contiguous ranges of ids, one per rank
+    """
+    comm = mpi_comm()
+    owner = partition(range(1 + config['miner_count'] + config['selfish_propagator_count']), comm.Get_size())
+    return {miner_id for miner_id, rank in owner.items() if rank == comm.Get_rank()}
+
+
+def run_mpi(monitor, time):
+    """
+    Simulate until <time> blocks are mined with the miners split across the ranks of MPI.COMM_WORLD, e.g.
+        mpirun -n 4 python MainMonitor.py config.json
+    with config "engine" "mpi". Each rank builds only its own miners (see local_miner_ids), with RemoteMiner
+    proxies for the others and the knowledge bits of its miners only. Ranks synchronize every lookahead clock
+    times like the sharded engine (see Shard.run_sharded): rank 0 draws the blocks found in each window and sends
+    them to every rank, and the blocks sent across ranks are exchanged with their fields, so a rank stores the
+    blocks its miners mined or received. Rank 0 collects the blocks of all ranks at the end, the blocks and
+    rewards of run_ticks with the same seed.
+    Args:
+        monitor: MainMonitor at the start of a run, built by every rank from the same configuration and seed
+        time: number of blocks to simulate
+    Returns:
+        blocks: dict{block_id: block object} of all mined blocks, last_block_id: id of the last mined block;
+        (None, None) on the other ranks
+    """
+    comm = mpi_comm()
+    rank = comm.Get_rank()
+    lookahead = comm.allreduce(check_shardable(monitor), op=mpi().MIN)
+    owner = partition([miner.id for miner in monitor.miners] + list(monitor.remote_miners), comm.Get_size())
+    monitor.pow.profiler = None
+    monitor.pow.tracer = None
+    worker = ShardWorker(monitor, rank, owner, lookahead)
+    planner = None
+    if rank == 0:
+        planner = WindowPlanner(monitor, monitor.miners + list(monitor.remote_miners.values()), time, lookahead)
+    monitor.progress.start(monitor)
+    idle = True
+    while True:
+        window = comm.bcast(planner.next_window(idle) if rank == 0 else None, root=0)
+        if window is None:
+            break
+        worker.run_window(*window)
+        outgoing = worker.drain()
+        incoming = comm.alltoall([outgoing.get(shard, []) for shard in range(comm.Get_size())])
+        worker.deliver([message for messages in incoming for message in messages])
+        idle = comm.allreduce(int(worker.busy())) == 0
+        if rank == 0:
+            monitor.progress.update(monitor, time)
+    results = comm.gather(worker.result(), root=0)
+    if rank != 0:
+        return None, None
+    logger.info("MPI run: %d ranks, %d windows of %d clock times", comm.Get_size(), planner.windows, lookahead)
+    return collect(monitor, results, planner)
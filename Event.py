@@ -1,5 +1,9 @@
+import heapq
+from collections import deque
 from enum import IntEnum
 
+from Trace import TRACE_RECEIVE, TRACE_SEND
+
 
 class EventType(IntEnum):
     ANY = 0
@@ -13,39 +17,95 @@ class Event:
     def process(self, miner):
         pass
 
+class EventQueue:
+    def __init__(self):
+        """
+        Priority queue of events ordered by timestamp, events of the same timestamp are kept in FIFO order.
+        Distinct timestamps are kept in a heap and the events of each timestamp in a deque, so pushing and
+        popping an event cost O(1) plus O(log n) for the first/last event of a timestamp.
+        """
+        self.timestamps = []
+        # heap of the distinct timestamps of queued events
+        self.buckets = {}
+        # dict{timestamp: deque of events}
+        self.processed = 0
+        # number of events processed from this queue, successfully or not
+
+    def __bool__(self):
+        return len(self.timestamps) > 0
+
+    def push(self, event):
+        update_event(event, self)
+
+    def peek_timestamp(self):
+        """
+        Returns:
+            timestamp of the earliest event
+        """
+        return self.timestamps[0]
+
+    def pop(self):
+        """
+        Remove and return the earliest event
+        """
+        timestamp = self.timestamps[0]
+        bucket = self.buckets[timestamp]
+        event = bucket.popleft()
+        if len(bucket) == 0:
+            heapq.heappop(self.timestamps)
+            del self.buckets[timestamp]
+        return event
+
+
 def update_event(new_event, events):
-    if new_event.timestamp not in events:
-        events[new_event.timestamp] = []
-    events[new_event.timestamp].append(new_event)
+    bucket = events.buckets.get(new_event.timestamp)
+    if bucket is None:
+        bucket = events.buckets[new_event.timestamp] = deque()
+        heapq.heappush(events.timestamps, new_event.timestamp)
+    bucket.append(new_event)
 
-def process_event(miner, events_dict, bandwidth):
+def process_event(miner, events, bandwidth):
+    """
+    Process the events of <events> whose timestamp is not after miner.clock in timestamp order, until <bandwidth>
+    of them are processed successfully
+    Args:
+        miner: Miner object processing the events
+        events: EventQueue
+        bandwidth: number of events that can be processed
+    """
     current_bandwidth = bandwidth
-    passed_timestamps = list(events_dict.keys())
-    passed_timestamps.sort()
-    i = 0
-    while i < len(passed_timestamps) and current_bandwidth > 0:
-        events = events_dict[passed_timestamps[i]]
-        while len(events) > 0 \
-                and events[0].timestamp <= miner.clock \
-                and current_bandwidth > 0:
-            current_event = events.pop(0)
+    timestamps = events.timestamps
+    processed = 0
+    while current_bandwidth > 0 and timestamps and timestamps[0] <= miner.clock:
+        timestamp = timestamps[0]
+        bucket = events.buckets[timestamp]
+        while current_bandwidth > 0 and bucket:
+            current_event = bucket.popleft()
+            processed += 1
             if current_event.process(miner):
                 current_bandwidth -= 1
-        if len(events) == 0:
-            del events_dict[passed_timestamps[i]]
-        i += 1
+        if not bucket:
+            heapq.heappop(timestamps)
+            del events.buckets[timestamp]
+    events.processed += processed
 
 
 class ReceiveNewBlockEvent(Event):
-    def __init__(self, timestamp, block):
+    def __init__(self, timestamp, block, relay=True, sender=None):
         super().__init__(timestamp)
         self.block = block
+        self.sender = sender # Miner object that sent the block, None if not known
         self.type = EventType.RECV_NEW_BLOCK
         self.direction = 0 # 0 for download, 1 for upload
+        self.relay = relay # False when the arrival times of all miners are already computed
 
     def process(self, miner):
+        if miner.pow.tracer is not None:
+            miner.pow.tracer.record(miner.clock, TRACE_RECEIVE, miner.id, self.block.id,
+                                    -1 if self.sender is None else self.sender.id)
         if miner.update_blockchain(self.block):
-            miner.notify_neighbours(self.block)
+            if self.relay:
+                miner.notify_neighbours(self.block)
             if self.block.racing and miner.honest:
                 if miner.select_block_parent().id == self.block.id:
                     self.block.win_race_count += 1
@@ -62,10 +122,11 @@ class SendNewBlockEvent(Event):
         self.direction = 1 # 0 for download, 1 for upload
 
     def process(self, miner):
-        new_event = ReceiveNewBlockEvent(miner.clock + miner.delay, self.block)
+        new_event = ReceiveNewBlockEvent(miner.clock + miner.link_delay(self.dest), self.block, sender=miner)
+        if miner.pow.tracer is not None:
+            miner.pow.tracer.record(miner.clock, TRACE_SEND, miner.id, self.block.id, self.dest.id)
         update_event(new_event, self.dest.recv_events)
-        if new_event.block.id not in self.dest.pending_notified_blocks:
-            self.dest.pending_notified_blocks.append(new_event.block.id)
-            new_event.block.pending_notified_miner_count += 1
+        self.dest.wake(new_event.timestamp)
+        miner.pow.knowledge.mark_pending(self.dest.id, new_event.block.id)
         return True
 
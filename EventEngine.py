@@ -0,0 +1,171 @@
+import heapq
+from enum import IntEnum
+from BlockFinder import BlockFinderSampler
+from Log import logger
+from Rng import schedule
+from Trace import TRACE_RUN
+
+
+class HappeningType(IntEnum):
+    BLOCK_FOUND = 0
+    BLOCK_RECEIVED = 1
+    UPLOAD_SLOT_FREE = 2
+
+
+class EventEngine:
+    def __init__(self, monitor):
+        """
+        Discrete-event driver of a MainMonitor. Instead of running every miner on every clock tick, keep one
+        global priority queue of timestamped happenings and jump from one to the next, only running the miners
+        that have something to do at that clock time.
+        Args:
+            monitor: MainMonitor whose miners are simulated
+        """
+        self.monitor = monitor
+        self.pow = monitor.pow
+        self.clock = monitor.clock
+        # clock time of the happenings currently processed
+        self.happenings = []
+        # priority queue of (clock, sequence, happening type, miner)
+        self.sequence = 0
+        # insertion counter, keeps the queue order deterministic within a clock time
+        self.wakeups = set()
+        # set{(clock, miner_id)} of queued BLOCK_RECEIVED / UPLOAD_SLOT_FREE happenings
+        self.finder = BlockFinderSampler(self.pow, monitor.miners)
+        # draws the clock time and the finder of the next block over all miners
+        self.found_sequence = None
+        # sequence of the queued BLOCK_FOUND happening, older ones are outdated
+        for miner in monitor.miners:
+            miner.scheduler = self
+            miner.clock = self.clock
+        self.schedule_block(self.clock)
+
+    def push(self, clock, happening_type, miner):
+        heapq.heappush(self.happenings, (clock, self.sequence, happening_type, miner))
+        self.sequence += 1
+
+    def wake(self, miner, timestamp, happening_type=HappeningType.BLOCK_RECEIVED):
+        """
+        Queue a run of <miner> at <timestamp> for pending received or sent events. A miner runs at most once per
+        clock time, so events arriving for the clock time being processed are handled at the next one.
+        Args:
+            miner: Miner object with pending events
+            timestamp: clock time of the pending events
+            happening_type: BLOCK_RECEIVED or UPLOAD_SLOT_FREE
+        """
+        clock = max(timestamp, self.clock + 1)
+        if (clock, miner.id) not in self.wakeups:
+            self.wakeups.add((clock, miner.id))
+            self.push(clock, happening_type, miner)
+
+    def schedule_block(self, clock):
+        """
+        Queue the BLOCK_FOUND happening of the next block found at or after <clock>
+        """
+        next_block = self.finder.next_block(clock)
+        self.found_sequence = self.sequence
+        if next_block is not None:
+            self.push(next_block[0], HappeningType.BLOCK_FOUND, next_block[1])
+
+    def pop_batch(self):
+        """
+        Pop all happenings at the current clock time
+        Returns:
+            [Miner] to run at the current clock time, dict{miner_id: number of blocks found}
+        """
+        batch = {}
+        found = {}
+        while len(self.happenings) > 0 and self.happenings[0][0] == self.clock:
+            _, sequence, happening_type, miner = heapq.heappop(self.happenings)
+            if happening_type == HappeningType.BLOCK_FOUND:
+                if sequence != self.found_sequence:
+                    # drawn before a change of hash power
+                    continue
+                found[miner.id] = found.get(miner.id, 0) + 1
+                self.schedule_block(self.clock)
+            else:
+                self.wakeups.discard((self.clock, miner.id))
+            batch[miner.id] = miner
+        return list(batch.values()), found
+
+    def run_miner(self, miner, found):
+        """
+        Run <miner> for the current clock time, the event driven counterpart of Miner.run
+        Args:
+            miner: Miner object to run
+            found: number of blocks found by the miner at the current clock time
+        Returns:
+            new_blocks: any new blocks mined
+        """
+        miner.clock = self.clock
+        if self.pow.profiler is None:
+            miner.process_recv_events()
+            new_blocks = miner.mine_found_blocks(found)
+            miner.process_send_events()
+        else:
+            new_blocks = self.pow.profiler.run_phases(miner, found)
+        if self.pow.tracer is not None and self.pow.tracer.runs:
+            self.pow.tracer.record(self.clock, TRACE_RUN, miner.id, len(new_blocks))
+        miner.clock = self.clock + 1
+
+        if miner.recv_events:
+            self.wake(miner, miner.recv_events.peek_timestamp())
+        if miner.send_events:
+            # upload bandwidth is used up, the rest is sent once a slot is free
+            self.wake(miner, self.clock + 1, HappeningType.UPLOAD_SLOT_FREE)
+        return new_blocks
+
+    def run(self, time):
+        """
+        Simulate until <time> blocks are mined (or until the races are done in racing test)
+        Returns:
+            blocks: dict{block_id: block object} of all mined blocks, last_block_id: id of the last mined block
+        """
+        monitor = self.monitor
+        blocks = monitor.blocks
+        profiler = self.pow.profiler
+        monitor.progress.start(monitor)
+
+        while len(self.happenings) > 0 and (monitor.racing_test or self.pow.block_count < time) and (
+                not monitor.racing_test or len(monitor.propagation_rates) < monitor.race_count):
+            if self.finder.outdated():
+                # hash power changed since the queued block was drawn
+                self.schedule_block(self.clock + 1)
+            self.clock = self.happenings[0][0]
+            batch, found = self.pop_batch()
+            schedule(self.pow.rng, batch, self.clock)
+            new_block_flag = False
+            for miner in batch:
+                new_blocks = self.run_miner(miner, found.get(miner.id, 0))
+                if len(new_blocks) >= 1:
+                    monitor.last_block_id = new_blocks[0].id
+                for new_block in new_blocks:
+                    new_block_flag = True
+                    blocks[new_block.id] = new_block
+                    if monitor.chain_index is not None:
+                        monitor.chain_index.add(new_block)
+
+            if profiler is None:
+                monitor.check_races()
+            else:
+                profiler.call("races", monitor.check_races)
+            monitor.clock = self.clock + 1
+            if monitor.chain_index is not None:
+                monitor.chain_index.settle(monitor.clock)
+                if monitor.pruner is not None:
+                    monitor.pruner.prune()
+            monitor.progress.update(monitor, time)
+            if new_block_flag:
+                logger.debug("Clock: %d, Block Count: %d", monitor.clock, self.pow.block_count)
+                monitor.checkpoint_if_due()
+                if monitor.snapshots is not None and not monitor.racing_test:
+                    monitor.snapshots.offer(monitor)
+        return blocks, monitor.last_block_id
+
+    def detach(self):
+        """
+        Hand the miners back to the fixed-tick loop, at the clock time after the last processed happening
+        """
+        for miner in self.monitor.miners:
+            miner.scheduler = None
+            miner.clock = self.monitor.clock
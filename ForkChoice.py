@@ -0,0 +1,166 @@
+import math
+
+from Log import logger
+from Reward import RewardEngine
+
+SETTLE_DEPTH = 12
+# blocks this far below the tip are settled: beyond the 7 block uncle window, and deeper than usual reorgs
+
+
+class ChainIndex:
+    def __init__(self, blocks, prime_block, selfish_miner, settle_depth=SETTLE_DEPTH):
+        """
+        Fork choice and reward accounting updated as blocks are mined. The tip is the first mined block of the
+        greatest height, every block is indexed by height, and the chain below the tip is settled block by block
+        once it is <settle_depth> blocks deep: its uncles are assigned (same rules as RewardEngine, which does
+        the uncle bookkeeping) and its rewards credited, so the rewards of the settled chain are known during the
+        run. A chain block is settled only once it is older than the current clock time and below the private
+        chain of the selfish miner, so no block mined or published later could have been its uncle.
+        If the tip moves to a branch forking below the settled chain, the rewards are computed again from the
+        final chain at the end of the run.
+        Args:
+            blocks: dict{block_id: block object} of all mined blocks, shared with the monitor
+            prime_block: first block of the chain
+            selfish_miner: SelfishMiner whose private chain is not settled
+            settle_depth: depth below the tip at which chain blocks are settled
+        """
+        self.blocks = blocks
+        self.selfish_miner = selfish_miner
+        self.settle_depth = settle_depth
+        self.heights = {}
+        # dict{height: [block ids]} of all blocks, in mining order
+        self.tips = []
+        # blocks of the greatest height in mining order, self.tips[0] is the tip
+        self.chain = {}
+        # dict{height: block} of the settled chain
+        self.settled_height = prime_block.height - 1
+        # height of the highest settled chain block
+        self.engine = RewardEngine(blocks, [], selfish_miner.id)
+        self.regular_rewards = {}
+        # dict{miner_id: reward} of the settled chain: 32 per block and 1 per included uncle
+        self.uncle_rewards = {}
+        # dict{miner_id: reward} of the uncles included by the settled chain
+        self.reorged = False
+        # True once the tip moved to a branch forking below the settled chain
+        self.pruned_height = 0
+        # blocks up to this height were dropped by a BlockPruner
+        for block_id in sorted(blocks):
+            self.add(blocks[block_id])
+
+    @property
+    def tip(self):
+        return self.tips[0]
+
+    def add(self, block):
+        """
+        Index a newly mined block
+        """
+        self.heights.setdefault(block.height, []).append(block.id)
+        if len(self.tips) == 0 or block.height > self.tip.height:
+            self.tips = [block]
+            if not self.reorged and self.settled_height in self.chain \
+                    and self.ancestor(block, self.settled_height).id != self.chain[self.settled_height].id:
+                logger.warning("Reorganization below settled height %d, rewards are computed at the end of the run",
+                               self.settled_height)
+                self.reorged = True
+        elif block.height == self.tip.height:
+            self.tips.append(block)
+        parent = self.chain.get(block.height - 1)
+        if block.height <= self.settled_height and parent is not None and parent.id == block.parent_id:
+            # a late sibling of a settled chain block, an uncle candidate of the blocks settled from now on
+            self.engine.push(block)
+
+    def blocks_at(self, height):
+        """
+        Returns:
+            [block] mined at <height>, in mining order
+        """
+        return [self.blocks[block_id] for block_id in self.heights.get(height, [])]
+
+    def ancestor(self, block, height):
+        while block.height > height:
+            block = self.blocks[block.parent_id]
+        return block
+
+    def settle(self, clock):
+        """
+        Settle the chain blocks of the tip that are self.settle_depth blocks deep, mined before <clock> and below
+        the private chain of the selfish miner. Called between two clock times.
+        """
+        if self.reorged:
+            return
+        target = self.tip.height - self.settle_depth
+        private_chain = self.selfish_miner.private_chain
+        if len(private_chain) > 0:
+            target = min(target, private_chain[0].height - 1)
+        if target > self.settled_height:
+            self.settle_up_to(target, clock)
+
+    def settle_up_to(self, target, clock):
+        """
+        Settle the chain blocks of the tip up to height <target>, stopping at the first one mined at or after
+        <clock>
+        """
+        pending = []
+        block = self.ancestor(self.tip, target)
+        while block.height > self.settled_height:
+            pending.append(block)
+            if block.height == 1:
+                break
+            block = self.blocks[block.parent_id]
+        for block in reversed(pending):
+            if block.timestamp >= clock:
+                break
+            self.settle_block(block)
+
+    def settle_block(self, block):
+        """
+        Settle chain block <block>, the next one above the settled chain
+        """
+        parent = self.chain.get(block.height - 1)
+        if parent is not None:
+            # siblings from the height index, parent.children rebuilds the children of a BlockStore on every new block
+            for sibling_id in self.heights.get(block.height, []):
+                if sibling_id != block.id and self.blocks[sibling_id].parent_id == parent.id:
+                    self.engine.push(self.blocks[sibling_id])
+        # the first two blocks include no uncles, see RewardEngine.assign_uncles
+        if block.height >= 3:
+            self.engine.assign(block)
+        self.regular_rewards[block.miner_id] = self.regular_rewards.get(block.miner_id, 0) + 32 + len(block.uncles)
+        for uncle_id in block.uncles:
+            uncle = self.blocks[uncle_id]
+            distance = block.height - uncle.height
+            self.uncle_rewards[uncle.miner_id] = self.uncle_rewards.get(uncle.miner_id, 0) \
+                + ((8 - distance) * 4 if distance <= 6 else 0)
+        self.chain[block.height] = block
+        self.settled_height = block.height
+
+    def selfish_rewards_ratio(self):
+        """
+        Returns:
+            share of the selfish miner in the rewards of the settled chain, None before any reward
+        """
+        total = sum(self.regular_rewards.values()) + sum(self.uncle_rewards.values())
+        if total == 0:
+            return None
+        selfish_miner_id = self.selfish_miner.id
+        return (self.regular_rewards.get(selfish_miner_id, 0) + self.uncle_rewards.get(selfish_miner_id, 0)) / total
+
+    def rewards(self):
+        """
+        Settle the whole chain of the tip at the end of the run
+        Returns:
+            regular_rewards: dict{miner_id: reward}, uncle_rewards: dict{miner_id: reward}
+        """
+        if self.reorged:
+            if self.pruned_height > 0:
+                raise RuntimeError(f"Reorganization below settled height {self.settled_height} after pruning, "
+                                   "increase settle_depth")
+            longest_chain = [self.tip]
+            while longest_chain[-1].height > 1:
+                longest_chain.append(self.blocks[longest_chain[-1].parent_id])
+            for block in longest_chain:
+                block.uncles.clear()
+            return RewardEngine(self.blocks, longest_chain, self.selfish_miner.id).rewards()
+        self.settle_up_to(self.tip.height, math.inf)
+        return self.regular_rewards, self.uncle_rewards
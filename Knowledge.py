@@ -0,0 +1,212 @@
+import numpy as np
+
+
+class KnowledgeMatrix:
+    def __init__(self, miner_count=0, first_miner_id=0):
+        """
+        Blocks x miners bit matrices recording which miners received a block and which miners have it pending
+        (a send to them was created, or they mined it). Each block is a row of packed bits in one contiguous
+        bytearray, so membership is O(1) and the number of miners knowing a block is a popcount of its row.
+        The rows of old blocks can be dropped (see drop_rows), the arrays then start at block id self.base.
+        Args:
+            miner_count: initial number of miners, grows with add_miner
+            first_miner_id: id of the miner of the first column, a process simulating a range of miner ids (see
+                            MainMonitor local_miners) only has the columns of its miners
+        """
+        self.row_bytes = max(1, (miner_count + 7) // 8)
+        # bytes per block row
+        self.miner_count = miner_count
+        # number of columns in use
+        self.first_miner_id = first_miner_id
+        self.base = 0
+        # block id of the first row, the rows of the blocks below were dropped
+        self.block_capacity = 0
+        # block id after the last row allocated
+        self.dropped = {}
+        # dict{block_id: [received row, pending row]} of the dropped blocks some miner had not received, the
+        # others count as received by every miner
+        self.received = bytearray()
+        # bit (block, miner) set once the miner added the block to its blockchain
+        self.pending = bytearray()
+        # bit (block, miner) set once the block is on its way to the miner
+
+    def add_miner(self, miner_id):
+        """
+        Make room for the bits of <miner_id>
+        """
+        column = miner_id - self.first_miner_id
+        self.miner_count = max(self.miner_count, column + 1)
+        if column < self.row_bytes * 8:
+            return
+        row_bytes = max(2 * self.row_bytes, column // 8 + 1)
+        rows = self.block_capacity - self.base
+        for name in ("received", "pending"):
+            old = getattr(self, name)
+            new = bytearray(rows * row_bytes)
+            for row in range(rows):
+                start = row * self.row_bytes
+                new[row * row_bytes:row * row_bytes + self.row_bytes] = old[start:start + self.row_bytes]
+            setattr(self, name, new)
+        for bits in self.dropped.values():
+            for row in bits:
+                row.extend(bytearray(row_bytes - self.row_bytes))
+        self.row_bytes = row_bytes
+
+    def add_block(self, block_id):
+        """
+        Make room for the bits of <block_id>
+        """
+        if block_id < self.block_capacity:
+            return
+        capacity = max(self.base + 2 * (self.block_capacity - self.base), block_id + 1, self.base + 64)
+        extra = bytearray((capacity - self.block_capacity) * self.row_bytes)
+        self.received.extend(extra)
+        self.pending.extend(extra)
+        self.block_capacity = capacity
+
+    def has_received(self, miner_id, block_id):
+        row = block_id - self.base
+        if row < 0:
+            return self.has_dropped_bit(0, miner_id, block_id)
+        if block_id >= self.block_capacity:
+            return False
+        column = miner_id - self.first_miner_id
+        return self.received[row * self.row_bytes + (column >> 3)] & (1 << (column & 7)) != 0
+
+    def has_pending(self, miner_id, block_id):
+        row = block_id - self.base
+        if row < 0:
+            return self.has_dropped_bit(1, miner_id, block_id)
+        if block_id >= self.block_capacity:
+            return False
+        column = miner_id - self.first_miner_id
+        return self.pending[row * self.row_bytes + (column >> 3)] & (1 << (column & 7)) != 0
+
+    def has_dropped_bit(self, kind, miner_id, block_id):
+        bits = self.dropped.get(block_id)
+        if bits is None:
+            return True
+        column = miner_id - self.first_miner_id
+        return bits[kind][column >> 3] & (1 << (column & 7)) != 0
+
+    def mark_dropped_bit(self, kind, miner_id, block_id):
+        """
+        Set bit (<block_id>, <miner_id>) of the received (<kind> 0) or pending (<kind> 1) row of a dropped block
+        Returns:
+            Bool: True if the bit was not set before
+        """
+        bits = self.dropped.get(block_id)
+        if bits is None:
+            return False
+        row = bits[kind]
+        column = miner_id - self.first_miner_id
+        bit = 1 << (column & 7)
+        if row[column >> 3] & bit:
+            return False
+        row[column >> 3] |= bit
+        return True
+
+    def mark_received(self, miner_id, block_id):
+        """
+        Returns:
+            Bool: True if the miner had not received the block before
+        """
+        row = block_id - self.base
+        if row < 0:
+            return self.mark_dropped_bit(0, miner_id, block_id)
+        self.add_block(block_id)
+        column = miner_id - self.first_miner_id
+        i = row * self.row_bytes + (column >> 3)
+        bit = 1 << (column & 7)
+        if self.received[i] & bit:
+            return False
+        self.received[i] |= bit
+        return True
+
+    def mark_pending(self, miner_id, block_id):
+        """
+        Returns:
+            Bool: True if the block was not pending for the miner before, False as well for a miner without a
+            column, simulated by another process
+        """
+        column = miner_id - self.first_miner_id
+        if not 0 <= column < self.miner_count:
+            return False
+        row = block_id - self.base
+        if row < 0:
+            return self.mark_dropped_bit(1, miner_id, block_id)
+        self.add_block(block_id)
+        i = row * self.row_bytes + (column >> 3)
+        bit = 1 << (column & 7)
+        if self.pending[i] & bit:
+            return False
+        self.pending[i] |= bit
+        return True
+
+    def row(self, kind, block_id):
+        """
+        Returns:
+            bytes of the received (<kind> 0) or pending (<kind> 1) row of <block_id>, None for a block without
+            a row: not added yet, or dropped once every miner received it
+        """
+        row = block_id - self.base
+        if row < 0:
+            bits = self.dropped.get(block_id)
+            return None if bits is None else bits[kind]
+        if block_id >= self.block_capacity:
+            return None
+        bits = self.pending if kind else self.received
+        return bits[row * self.row_bytes:(row + 1) * self.row_bytes]
+
+    def received_count(self, block_id):
+        """
+        Returns:
+            number of miners that received the block
+        """
+        row = self.row(0, block_id)
+        if row is None:
+            return self.miner_count if block_id < self.base else 0
+        return bin(int.from_bytes(row, "little")).count("1")
+
+    def pending_count(self, block_id):
+        """
+        Returns:
+            number of miners the block is on its way to but who did not receive it yet
+        """
+        row = self.row(1, block_id)
+        if row is None:
+            return 0
+        return bin(int.from_bytes(row, "little")).count("1") - self.received_count(block_id)
+
+    def drop_rows(self, block_id):
+        """
+        Drop the rows of the blocks below <block_id>, which are no longer looked up by the simulation. Blocks
+        received by every miner then count as received and pending for every miner, the rows of the others are
+        kept aside since they may still be delivered.
+        """
+        if block_id <= self.base:
+            return
+        self.add_block(block_id - 1)
+        for dropped_id in range(self.base, block_id):
+            if self.received_count(dropped_id) < self.miner_count:
+                self.dropped[dropped_id] = [bytearray(self.row(0, dropped_id)), bytearray(self.row(1, dropped_id))]
+        size = (block_id - self.base) * self.row_bytes
+        del self.received[:size]
+        del self.pending[:size]
+        self.base = block_id
+
+    def to_arrays(self, block_count, miner_count):
+        """
+        Unpack the matrices for analysis
+        Returns:
+            (received, pending): bool arrays of shape (block_count, miner_count)
+        """
+        if self.base > 0:
+            raise ValueError("The rows of the pruned blocks were dropped")
+        self.add_block(block_count - 1)
+        arrays = []
+        for bits in (self.received, self.pending):
+            rows = np.frombuffer(bits, dtype=np.uint8, count=block_count * self.row_bytes)
+            rows = rows.reshape(block_count, self.row_bytes)
+            arrays.append(np.unpackbits(rows, axis=1, bitorder="little")[:, :miner_count].astype(bool))
+        return arrays[0], arrays[1]
@@ -0,0 +1,34 @@
+import logging
+import sys
+
+logger = logging.getLogger("selfish_mining")
+# logger of the simulator, messages take %-style arguments so they are only formatted when their level is enabled
+
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+
+def configure(config):
+    """
+    Set the verbosity of the simulator from the configuration:
+        "log_level": "debug" (per block details: private chain publications, public chain heads, uncle
+                     candidates), "info" (progress, races and rewards) or "warning"
+        "quiet": if 1, only the final summary of each run is printed (implies "warning")
+    Messages go to stdout without decoration, like the print calls they replace.
+    """
+    level = LEVELS[config.get('log_level', 'info').lower()]
+    if config.get('quiet', 0):
+        level = max(level, logging.WARNING)
+    logger.setLevel(level)
+    if len(logger.handlers) == 0:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+
+
+def quiet():
+    """
+    Returns:
+        Bool: True if progress messages are disabled, the caller then prints the final summary itself
+    """
+    return not logger.isEnabledFor(logging.INFO)
@@ -1,9 +1,8 @@
+import json
 import math
-import sys
-sys.setrecursionlimit(10000)
+import multiprocessing
 from Block import Block
 
-PLOT_GRAPHVIZ = True
 # def get_longest_chain(prime_block, blocks):
 #     """
 #     Perform a BFS to return the block heads of the longest chain, sorted in timestamp order
@@ -19,39 +18,63 @@ PLOT_GRAPHVIZ = True
 #         current = queue.pop(0)
 #         for child in current.children:
 #             queue.append(blocks[child])
-from Miner import Miner, SelfishMiner, SelfishPropagator
+from Miner import Miner, RemoteMiner, SelfishMiner, SelfishPropagator
 from NetworkTopology import NetworkGraphGen
 import random
 # import networkx as nx
 # import matplotlib.pyplot as plt
-from graphviz import Digraph
 from POW import POW
+from EventEngine import EventEngine
+from Propagation import ShortestPathPropagation
+from Race import BatchedRaceEstimator
+from Shard import run_sharded
+from BlockFinder import BlockFinderSampler
+from Distributed import local_miner_ids, mpi_rank, run_mpi
+from ForkChoice import SETTLE_DEPTH, ChainIndex
+from Prune import BlockPruner
+from Rng import new_rng, schedule
+from Reward import RewardEngine
+from Log import configure, logger, quiet
+from Trace import new_tracer
+from Profile import ProgressReporter, new_profiler
+from Snapshot import new_snapshot_renderer
+from Checkpoint import load_checkpoint, save_checkpoint
 
 
 class MainMonitor:
     def __init__(self, pow, miner_count, neighbour_count, delay, upload_bandwidth, download_bandwidth,
                  hash_power=1, selfish_miner_hash_power_in_percent=0.3, propagator_count=100,
-                 propagator_delay=0, propagator_upload_bandwidth=100, propagator_download_bandwidth=100, racing_test=False, race_count=0):
+                 propagator_delay=0, propagator_upload_bandwidth=100, propagator_download_bandwidth=100, racing_test=False, race_count=0,
+                 topology="random", topology_file=None, latency_scale=1, rng=None, tracer=None, local_miners=None):
 
         self.hash_power = hash_power
         self.selfish_miner_hash_power_in_percent = selfish_miner_hash_power_in_percent
         self.racing_test = racing_test
         self.race_count = race_count
+        self.local_miners = local_miners
+        # ids of the miners simulated by this process (a rank of an MPI run, a range of ids), the others are
+        # RemoteMiner proxies; None to simulate every miner
         if not racing_test:
             # init <miner_count> miners
             self.pow = pow
+            if local_miners is not None:
+                self.pow.knowledge.first_miner_id = min(local_miners)
             self.miner_count = miner_count
             self.propagater_count = propagator_count
             self.selfish_miner = None
             # if configuration == "selfish1":
             selfish_miner_hr = math.ceil(hash_power*miner_count/(1-selfish_miner_hash_power_in_percent)-miner_count*hash_power)
-            self.selfish_miner = SelfishMiner(0, pow, delay, upload_bandwidth, download_bandwidth, selfish_miner_hr)
-            selfish_propagaters = [SelfishPropagator(self.selfish_miner, i, pow, propagator_delay, propagator_upload_bandwidth, propagator_download_bandwidth) for i in range(1+self.miner_count,1+self.miner_count+self.propagater_count)]
-            self.miners = [Miner(i, pow, delay, upload_bandwidth, download_bandwidth, hash_power) for i in range(1, miner_count+1)] \
+            self.selfish_miner = SelfishMiner(0, pow, delay, upload_bandwidth, download_bandwidth, selfish_miner_hr) \
+                if self.is_local(0) else RemoteMiner(0, delay, selfish_miner_hr)
+            self.racer_miner = None
+            selfish_propagaters = [SelfishPropagator(self.selfish_miner, i, pow, propagator_delay, propagator_upload_bandwidth, propagator_download_bandwidth)
+                                   if self.is_local(i) else RemoteMiner(i, propagator_delay, 0)
+                                   for i in range(1+self.miner_count,1+self.miner_count+self.propagater_count)]
+            self.miners = [Miner(i, pow, delay, upload_bandwidth, download_bandwidth, hash_power) if self.is_local(i)
+                           else RemoteMiner(i, delay, hash_power) for i in range(1, miner_count+1)] \
                             + [self.selfish_miner] + selfish_propagaters
             # else:
             #     self.miners = [Miner(i, pow, delay, bandwidth, hash_power) for i in range(miner_count)]
-            NetworkGraphGen.random_graph(self.miners, neighbour_count)
             self.clock = 0
             self.propagation_rates = []
 
@@ -65,88 +88,255 @@ class MainMonitor:
             self.selfish_miner = SelfishMiner(0, self.pow, delay, upload_bandwidth, download_bandwidth, 1)
             self.selfish_miner.racing_test = True
             racer_miner = Miner(1, self.pow, delay, upload_bandwidth, download_bandwidth, 1)
+            self.racer_miner = racer_miner
             selfish_propagaters = [SelfishPropagator(self.selfish_miner, i, self.pow, propagator_delay, propagator_upload_bandwidth, propagator_download_bandwidth) for i in range(1+self.miner_count,1+self.miner_count+self.propagater_count)]
             self.miners = [Miner(i, self.pow, delay, upload_bandwidth, download_bandwidth, 0) for i in range(2, miner_count+1)] \
                           + [self.selfish_miner] + [racer_miner] + selfish_propagaters
             # else:
             #     self.miners = [Miner(i, pow, delay, bandwidth, hash_power) for i in range(miner_count)]
-            NetworkGraphGen.random_graph(self.miners, neighbour_count)
             self.clock = 0
             self.propagation_rates = []
+        self.pow.rng = rng
+        self.pow.tracer = tracer
+        self.topology = NetworkGraphGen.generate(self.miners, neighbour_count, topology, topology_file, rng,
+                                                latency_scale)
+        self.remote_miners = {miner.id: miner for miner in self.miners if isinstance(miner, RemoteMiner)}
+        # dict{miner_id: RemoteMiner} of the miners simulated by other processes
+        if len(self.remote_miners) > 0:
+            # the whole network was drawn so that every process gets the same one, each keeps its own links
+            self.miners = [miner for miner in self.miners if not isinstance(miner, RemoteMiner)]
+            for miner in self.remote_miners.values():
+                miner.neighbours = []
+        self.selfish_rewards_ratio = None
+        self.blocks = {0: self.pow.prime_block}
+        self.last_block_id = 0
+        self.engine = None
+        self.checkpoint_file = None
+        self.checkpoint_every = 0
+        self.checkpoint_block_count = 0
+        self.progress = ProgressReporter()
+        self.race_estimator = "simulate"
+        # "simulate" to run the races of a racing test, "batched" to estimate them with BatchedRaceEstimator
+        self.chain_index = None
+        # ChainIndex settling the rewards during the run, None to compute them at the end
+        self.pruner = None
+        # BlockPruner dropping the settled blocks, None to keep every block
+        self.snapshots = None
+        # SnapshotRenderer of the block tree, None when not rendering snapshots
+        self.shard_count = 0
+        # number of processes of the "sharded" engine, 0 for one per core
+
+    def run_simulation(self, time, engine="tick", propagation="event"):
+        """
+        Run the simulation until <time> blocks are mined and report the rewards
+        Args:
+            time: number of blocks to simulate
+            engine: "tick" to run every miner on every clock tick, "event" to jump between timestamped happenings
+                    with the discrete-event EventEngine, "sharded" to split the tick loop across processes
+                    (see Shard.run_sharded), "mpi" to split it across the ranks of an MPI run (see
+                    Distributed.run_mpi)
+            propagation: "event" to relay blocks hop by hop through send/receive events, "shortest_path" to deliver
+                         them at their shortest-path arrival times (ShortestPathPropagation), "auto" to use
+                         shortest paths whenever bandwidth_unconstrained()
+        Returns:
+            str, summary of the rewards
+        """
+        if self.racing_test and self.race_estimator == "batched" and not self.links_unconstrained(2):
+            logger.warning("The batched race estimator needs room for both racing blocks on every link, "
+                           "simulating the races instead")
+        elif self.racing_test and self.race_estimator == "batched":
+            estimator = BatchedRaceEstimator(self.miners, self.selfish_miner, self.racer_miner)
+            self.propagation_rates = estimator.propagation_rates(self.race_count, self.miner_count, self.pow.rng)
+            return self.report(self.blocks, self.last_block_id)
+        if propagation == "shortest_path" or (propagation == "auto" and self.bandwidth_unconstrained()):
+            shortest_path_propagation = ShortestPathPropagation(self.miners)
+            for miner in self.miners:
+                miner.propagation = shortest_path_propagation
+        elif propagation not in ("event", "auto"):
+            raise ValueError(f"Unknown propagation mode: {propagation}")
+        if engine == "tick":
+            if self.engine is not None:
+                self.engine.detach()
+                self.engine = None
+            blocks, last_block_id = self.run_ticks(time)
+        elif engine == "event":
+            # a monitor restored from a checkpoint of an event driven run continues with its engine
+            if self.engine is None:
+                self.engine = EventEngine(self)
+            blocks, last_block_id = self.engine.run(time)
+        elif engine == "sharded":
+            blocks, last_block_id = run_sharded(self, time, self.shard_count)
+        elif engine == "mpi":
+            blocks, last_block_id = run_mpi(self, time)
+            if blocks is None:
+                # the blocks of all ranks were collected by rank 0, which reports
+                return ""
+        else:
+            raise ValueError(f"Unknown simulation engine: {engine}")
+        if self.checkpoint_file is not None:
+            save_checkpoint(self, self.checkpoint_file)
+        if self.engine is not None:
+            self.engine.detach()
+            self.engine = None
+        if self.pow.tracer is not None:
+            self.pow.tracer.close()
+        if self.snapshots is not None:
+            self.snapshots.close()
+        if self.pow.profiler is None:
+            return self.report(blocks, last_block_id)
+        output = self.pow.profiler.call("report", self.report, blocks, last_block_id)
+        self.pow.profiler.save()
+        return output
 
-    def run_simulation(self, time):
-        blocks = {0: self.pow.prime_block}
+    def is_local(self, miner_id):
+        """
+        Returns:
+            Bool: True if this process simulates miner <miner_id>
+        """
+        return self.local_miners is None or miner_id in self.local_miners
+
+    def bandwidth_unconstrained(self):
+        """
+        Check whether blocks propagate along shortest paths: every miner can send a block to all its neighbours
+        and receive it from all its senders within one timestamp, and no delay is zero. Blocks propagating at the
+        same time may still compete for bandwidth, which is neglected.
+        Returns:
+            Bool: True if the shortest-path propagation applies
+        """
+        if self.racing_test:
+            return False
+        return self.links_unconstrained(1)
+
+    def links_unconstrained(self, block_count):
+        """
+        Check whether every miner can send <block_count> blocks to all its neighbours and receive them from all its
+        senders within one timestamp, and no delay is zero
+        Args:
+            block_count: number of blocks propagating at the same time, 2 for the racing blocks of a racing test
+        Returns:
+            Bool: True if no bandwidth limit delays a block
+        """
+        in_degree = {miner.id: 0 for miner in self.miners}
+        for miner in self.miners:
+            for neighbour in miner.neighbours:
+                in_degree[neighbour.id] += 1
+        in_degree[self.selfish_miner.id] += self.propagater_count
+        for miner in self.miners:
+            if miner.delay <= 0 or miner.upload_bandwidth < block_count * len(miner.neighbours) \
+                    or miner.download_bandwidth < block_count * in_degree[miner.id]:
+                return False
+        return True
+
+    def run_ticks(self, time):
+        blocks = self.blocks
         # dict{block_id: (block object, propagate count)}
         longest_chain_height = 1
-
-        # HC: last block storage
-        last_block_id = 0
-        # HC #
+        profiler = self.pow.profiler
+        self.progress.start(self)
+        finder = None
+        if self.pow.rng is not None and self.pow.rng.keyed:
+            # keyed streams: the blocks are found network-wide, like the sharded engines do
+            finder = BlockFinderSampler(self.pow, self.miners)
 
         # while (self.racing_test or self.clock < time) and (not self.racing_test or len(self.propagation_rates) < self.race_count):
         while (self.racing_test or self.pow.block_count < time) and (
                     not self.racing_test or len(self.propagation_rates) < self.race_count):
-            random.shuffle(self.miners)
+            schedule(self.pow.rng, self.miners, self.clock)
+            found = None if finder is None else finder.found_at(self.clock)
             new_block_flag = False
             for miner in self.miners:
-                new_blocks = miner.run()
+                new_blocks = miner.run(None if found is None else found.get(miner.id, 0))
                 # HC: record new highest height
                 if len(new_blocks) >= 1:
-                    last_block_id = new_blocks[0].id
+                    self.last_block_id = new_blocks[0].id
                 # HC #
 
                 for new_block in new_blocks:
                     new_block_flag = True
                     blocks[new_block.id] = new_block
+                    if self.chain_index is not None:
+                        self.chain_index.add(new_block)
                     if new_block.height > longest_chain_height:
                         longest_chain_height = new_block.height
 
-            if len(self.selfish_miner.racing_blocks) > 0:
-                racing_blocks = self.selfish_miner.racing_blocks[:]
-                for block in racing_blocks:
-                    if block.notified_miner_count == self.miner_count + self.propagater_count + 1:
-                        pr = block.win_race_count / self.miner_count
-                        self.propagation_rates.append(pr)
-                        print(f"Race finish, propagation rate: {pr}")
-                        self.selfish_miner.racing_blocks.remove(block)
+            if profiler is None:
+                self.check_races()
+            else:
+                profiler.call("races", self.check_races)
 
             self.clock += 1
-            if self.clock % 100 == 0 or new_block_flag:
-                print(f"Clock: {self.clock}, Block Count: {self.pow.block_count}")
-                if self.racing_test:
-                    print(f"Race count: {len(self.propagation_rates)}")
-            # if new_block_flag and not self.racing_test:
-            #     G = Digraph(comment="Blockchain state", format='png')
-            #     G.node(str(self.pow.prime_block.id), label=str(self.pow.prime_block))
-            #     for id in blocks:
-            #         block = blocks[id]
-            #         if id != 0:
-            #             G.node(str(block.id), label=str(block), color=f"{'grey' if block.notified_miner_count == 0 else 'black'}")
-            #             G.edge(str(block.id), str(blocks[block.parent_id].id))
-            #     print(self.pow.prime_block.subtree_str(blocks))
-                '''
-                if PLOT_GRAPHVIZ is True:
-                    G.render(f'test-output/blockchain-clock-{self.clock}.gv', view=True)
-                '''
-                # print(self.pow.prime_block.subtree_str(blocks))
-                # print("=====================================================")
-                # nx.draw_planar(G, with_labels=True)
-                # nx.draw_kamada_kawai(G, with_labels=True)
-                # nx.draw_networkx(G,with_labels=True)
-                # nx.draw(G, with_labels=True)
+            if self.chain_index is not None:
+                self.chain_index.settle(self.clock)
+                if self.pruner is not None:
+                    self.pruner.prune()
+            self.progress.update(self, time)
+            if new_block_flag:
+                logger.debug("Clock: %d, Block Count: %d", self.clock, self.pow.block_count)
+                self.checkpoint_if_due()
+                if self.snapshots is not None and not self.racing_test:
+                    self.snapshots.offer(self)
+        return blocks, self.last_block_id
+
+    def checkpoint_if_due(self):
+        """
+        Save a checkpoint to self.checkpoint_file once self.checkpoint_every blocks were mined since the last one.
+        Called between two clock times, when the state can be resumed.
+        """
+        if self.checkpoint_file is not None and self.checkpoint_every > 0 \
+                and self.pow.block_count - self.checkpoint_block_count >= self.checkpoint_every:
+            self.checkpoint_block_count = self.pow.block_count
+            if self.pow.profiler is None:
+                save_checkpoint(self, self.checkpoint_file)
+            else:
+                self.pow.profiler.call("checkpoint", save_checkpoint, self, self.checkpoint_file)
+
+    def set_selfish_hash_power(self, selfish_miner_hash_power_in_percent):
+        """
+        Give the selfish miner <selfish_miner_hash_power_in_percent> of the hash power, like the constructor does,
+        e.g. to branch a variant from a checkpoint
+        """
+        if selfish_miner_hash_power_in_percent == self.selfish_miner_hash_power_in_percent:
+            return
+        self.selfish_miner_hash_power_in_percent = selfish_miner_hash_power_in_percent
+        self.selfish_miner.hash_power = math.ceil(
+            self.hash_power*self.miner_count/(1-selfish_miner_hash_power_in_percent)-self.miner_count*self.hash_power)
+
+    def check_races(self):
+        """
+        Record the propagation rate of every racing block that has reached all miners
+        """
+        if len(self.selfish_miner.racing_blocks) > 0:
+            racing_blocks = self.selfish_miner.racing_blocks[:]
+            for block in racing_blocks:
+                if block.notified_miner_count == self.miner_count + self.propagater_count + 1:
+                    pr = block.win_race_count / self.miner_count
+                    self.propagation_rates.append(pr)
+                    logger.info("Race finish, propagation rate: %s", pr)
+                    self.selfish_miner.racing_blocks.remove(block)
+
+    def report(self, blocks, last_block_id):
+        """
+        Log the race results and the rewards of the simulated blocks
+        Args:
+            blocks: dict{block_id: block object} of all mined blocks
+            last_block_id: id of the last mined block
+        Returns:
+            str, summary of the rewards
+        """
         if len(self.propagation_rates) > 0:
-            print(f"Avg propagation rate: {sum(self.propagation_rates) / len(self.propagation_rates)}")
-            print(f"Propagation race results: {self.propagation_rates}")
+            logger.info("Avg propagation rate: %s", sum(self.propagation_rates) / len(self.propagation_rates))
+            logger.info("Propagation race results: %s", self.propagation_rates)
         else:
-            print("No propagation race")
+            logger.info("No propagation race")
         regular_rewards, uncle_rewards = self.reward(blocks, last_block_id)
         total_rewards = sum(regular_rewards.values())+sum(uncle_rewards.values())
         selfish_rewards = regular_rewards.get(0, 0)+uncle_rewards.get(0, 0)
-        print("Total reward ratio:", selfish_rewards, " / ", total_rewards)
-        print("Uncle reward ratio:", uncle_rewards.get(0, 0), " / ", sum(uncle_rewards.values()))
-        print("Regular reward ratio:", regular_rewards.get(0, 0), " / ", sum(regular_rewards.values()))
-        print("Selfish rewards:", regular_rewards.get(0, 0)+uncle_rewards.get(0, 0))
-        print("Selfish rewards ratio:", (regular_rewards.get(0, 0) + uncle_rewards.get(0, 0))/total_rewards)
+        self.selfish_rewards_ratio = selfish_rewards / total_rewards
+        logger.info("Total reward ratio: %s  /  %s", selfish_rewards, total_rewards)
+        logger.info("Uncle reward ratio: %s  /  %s", uncle_rewards.get(0, 0), sum(uncle_rewards.values()))
+        logger.info("Regular reward ratio: %s  /  %s", regular_rewards.get(0, 0), sum(regular_rewards.values()))
+        logger.info("Selfish rewards: %s", selfish_rewards)
+        logger.info("Selfish rewards ratio: %s", self.selfish_rewards_ratio)
         output = f"Selfish hr in percent: {self.selfish_miner_hash_power_in_percent}\n" \
             + f"Selfish rewards ratio: {(regular_rewards.get(0, 0) + uncle_rewards.get(0, 0))/total_rewards}\n" \
             + f"Total reward ratio: {selfish_rewards} / {total_rewards}\n" \
@@ -155,83 +345,26 @@ class MainMonitor:
 
 
 
-        print("regular reward dictionary:")
-        print(regular_rewards)
-        print("uncle reward dictionary:")
-        print(uncle_rewards)
+        logger.info("regular reward dictionary:\n%s", regular_rewards)
+        logger.info("uncle reward dictionary:\n%s", uncle_rewards)
         #selfish_miner_rewards = regular_rewards[0]+uncle_rewards[0]
         #print(selfish_miner_rewards)
-        print("Simulation Done!")
+        logger.info("Simulation Done!")
         return output
 
 
     # assume a block earns the miner 32 unit
     def reward(self, blocks, last_block_id):
+        """
+        Assign the uncles of the longest chain and compute the rewards, see RewardEngine. With a chain index the
+        chain is that of its tip and only the blocks not yet settled are left to assign.
+        Returns:
+            regular_rewards: dict{miner_id: reward}, uncle_rewards: dict{miner_id: reward}
+        """
+        if self.chain_index is not None:
+            return self.chain_index.rewards()
         longest_chain = self.find_longest_chain(blocks, last_block_id)
-        new_blocks = self.assign_uncles(blocks, longest_chain)
-        # new_blocks = self.assign_uncles_all_selfish(blocks, longest_chain)
-        uncles, nephews = self.find_uncles_nephews(new_blocks, longest_chain)
-        # regular reward dict {miner_id: reward}
-        regular_rewards = {}
-        # uncle reward dict {miner_id: reward}
-        uncle_rewards = {}
-
-        # assign regular block reward
-        for regular_block in longest_chain:
-            # miner_id does not exist yet
-            if regular_block.miner_id not in regular_rewards:
-                regular_rewards[regular_block.miner_id] = 32
-            # miner_id alreay exists
-            else:
-                regular_rewards[regular_block.miner_id] += 32
-
-        # assign nephew block reward
-        for nephew_block in nephews:
-            # print("len(nephew_block.uncles): ", len(nephew_block.uncles))
-            regular_rewards[nephew_block.miner_id] += len(nephew_block.uncles)
-
-        '''
-        # assign nephew block reward
-        for nephew_block in nephews:
-            regular_rewards[nephew_block.miner_id] += 1
-            
-        '''
-
-        # assign uncle block reward
-        uncle_ids = uncles.keys()
-        for uncle_id in uncle_ids:
-            temp_miner_id = blocks[uncle_id].miner_id
-            # update key
-            if temp_miner_id not in uncle_rewards:
-                uncle_rewards[temp_miner_id] = 0
-            # compute reward amount
-            if uncles[uncle_id] <= 6:
-                temp_reward = (8 - uncles[uncle_id])*4
-                uncle_rewards[temp_miner_id] += temp_reward
-            # trivia but save for future modification
-            else:
-                temp_reward = 0
-                uncle_rewards[temp_miner_id] += temp_reward
-
-        '''
-        # assign uncle block reward
-        uncle_ids = uncles.keys()
-        for uncle_id in uncle_ids:
-            temp_miner_id = blocks[uncle_id].miner_id
-            # update key
-            if temp_miner_id not in uncle_rewards:
-                uncle_rewards[temp_miner_id] = 0
-            # compute reward amount
-            if uncles[uncle_id] <= 6:
-                temp_reward = (8 - uncles[uncle_id])*4
-                uncle_rewards[temp_miner_id] += temp_reward
-            # trivia but save for future modification
-            else:
-                temp_reward = 0
-                uncle_rewards[temp_miner_id] += temp_reward
-        '''
-
-        return regular_rewards, uncle_rewards
+        return RewardEngine(blocks, longest_chain, self.selfish_miner.id).rewards()
 
     def find_longest_chain(self, blocks, last_block_id):
         # longest chain list
@@ -264,103 +397,11 @@ class MainMonitor:
 
 
     def assign_uncles(self, blocks, longest_chain):
-        print("start assign_uncles")
-        rev_longest_chain = longest_chain[-3::-1] # skip first two blocks
-        uncle_candidates = self.find_uncle_candidates(blocks, longest_chain)
-        for regular_block in rev_longest_chain:
-            #
-            # if this regular block is mined by a selfish miner (Rational)
-            if regular_block.miner_id == 0:
-                # self uncle check count
-                if regular_block.height < 6:
-                    generation_count = regular_block.height - 2
-                else:
-                    generation_count = 6
-                # find uncles mined by itself from current to previous height
-                for i in range(regular_block.height, regular_block.height-generation_count, -1):
-                    if i in uncle_candidates:
-                        for uncle_id in uncle_candidates[i]:
-                            print("0uncle_id:", uncle_id)
-                            #print("regular_block uncle test:", len(regular_block.uncles),"answer: ", regular_block.need_more_uncles())
-                            print("regular_block uncle test:", len(regular_block.uncles), "answer: ", regular_block.need_more_uncles())
-                            print("blocks[uncle_id].miner_id == regular_block.miner_id:", "answer: ", blocks[uncle_id].miner_id == regular_block.miner_id)
-                            print("blocks[uncle_id].publish_timestamp <= regular_block.timestamp", "answer: ", blocks[uncle_id].publish_timestamp <= regular_block.timestamp)
-                            if regular_block.need_more_uncles() and blocks[uncle_id].miner_id == regular_block.miner_id \
-                                    and blocks[uncle_id].publish_timestamp <= regular_block.timestamp:
-                                blocks[regular_block.id].uncles.append(uncle_id)
-                                # remove uncle_id
-                                print("0before remove:", uncle_candidates[i])
-                                uncle_candidates[i].remove(uncle_id)
-                                print("0after remove:", uncle_candidates[i])
-                        '''
-                        # remove this entry if its empty
-                        if len(uncle_candidates[i]) == 0:
-                            del uncle_candidates[i]
-                        '''
-
-
-                # find uncles mined by anyone
-                #while regular_block.need_more_uncles and len(uncle_candidates) > 0:
-                    #temp_list = uncle_candidates.keys().copy()
-                for j in uncle_candidates.keys():
-
-                    if j < regular_block.height:
-                        for uncle_id in uncle_candidates[j]:
-                            print("1uncle_id:", uncle_id)
-                            # print("regular_block uncle test:", len(regular_block.uncles), "answer: ", regular_block.need_more_uncles())
-                            print("regular_block uncle test:", len(regular_block.uncles), "answer: ", regular_block.need_more_uncles())
-                            print("blocks[uncle_id].timestamp < regular_block.timestamp:", "answer: ", blocks[uncle_id].timestamp < regular_block.timestamp)
-                            if regular_block.need_more_uncles() and blocks[uncle_id].timestamp < regular_block.timestamp:
-                                blocks[regular_block.id].uncles.append(uncle_id)
-                                # remove uncle_id
-                                print("1before remove:", uncle_candidates[j])
-                                uncle_candidates[j].remove(uncle_id)
-                                print("1after remove:", uncle_candidates[j])
-                        '''
-                        # remove this entry if its empty
-                        if len(uncle_candidates[j]) == 0:
-                            del uncle_candidates[j]
-                        '''
-
-            # regular block mined by honest miner
-            else:
-                #while regular_block.need_more_uncles and len(uncle_candidates) > 0:
-                    # temp_list = uncle_candidates.keys().copy()
-                for k in uncle_candidates.keys():
-
-                    if k < regular_block.height:
-                        for uncle_id in uncle_candidates[k]:
-                            print("2uncle_id:", uncle_id)
-                            print("regular_block uncle test:", len(regular_block.uncles), "answer: ", regular_block.need_more_uncles())
-                            print("blocks[uncle_id].timestamp < regular_block.timestamp:", "answer: ", blocks[uncle_id].timestamp < regular_block.timestamp)
-                            print("(blocks[uncle_id].miner_id != 0", "answer: ", (blocks[uncle_id].miner_id != 0))
-                            # print("regular_block uncle test:", len(regular_block.uncles), "answer: ", regular_block.need_more_uncles())
-                            if regular_block.need_more_uncles() and blocks[uncle_id].timestamp < regular_block.timestamp and (blocks[uncle_id].miner_id != 0):
-                                blocks[regular_block.id].uncles.append(uncle_id)
-                                # remove uncle_id
-                                print("2before remove:", uncle_candidates[k])
-                                uncle_candidates[k].remove(uncle_id)
-                                print("2after remove:", uncle_candidates[k])
-                            print("regular_block uncle test:", len(regular_block.uncles), "answer: ", regular_block.need_more_uncles())
-                            print("blocks[uncle_id].publish_timestamp < regular_block.timestamp:", "answer: ", blocks[uncle_id].publish_timestamp < regular_block.timestamp)
-                            print("(blocks[uncle_id].miner_id == 0", "answer: ", (blocks[uncle_id].miner_id == 0))
-                            if regular_block.need_more_uncles() and blocks[uncle_id].publish_timestamp < regular_block.timestamp and (blocks[uncle_id].miner_id == 0):
-                                blocks[regular_block.id].uncles.append(uncle_id)
-                                # remove uncle_id
-                                print(regular_block.id)
-                                print("3before remove:", uncle_candidates[k])
-                                uncle_candidates[k].remove(uncle_id)
-                                print("3after remove:", uncle_candidates[k])
-                        '''
-                        # remove this entry if its empty
-                        if len(uncle_candidates[k]) == 0:
-                            del uncle_candidates[k]
-                        '''
-        print("Uncles have been assigned!")
+        RewardEngine(blocks, longest_chain, self.selfish_miner.id).assign_uncles()
         return blocks
 
     def assign_uncles_all_selfish(self, blocks, longest_chain):
-        print("start assign_uncles")
+        logger.debug("start assign_uncles")
         rev_longest_chain = longest_chain[-3::-1] # skip first two blocks
         uncle_candidates = self.find_uncle_candidates(blocks, longest_chain)
         for regular_block in rev_longest_chain:
@@ -421,7 +462,7 @@ class MainMonitor:
                         if len(uncle_candidates[k]) == 0:
                             del uncle_candidates[k]
                         '''
-        print("Uncles have been assigned!")
+        logger.debug("Uncles have been assigned!")
         return blocks
 
 
@@ -446,69 +487,153 @@ class MainMonitor:
                         else:
                             uncle_candidates[blocks[child_id].height].append(child_id)
             temp_last_regular_block = regular_block
-        print("uncle_candidates", uncle_candidates)
+        logger.debug("uncle_candidates %s", uncle_candidates)
 
         return uncle_candidates
 
+def new_pow(config):
+    return POW(config['pow_difficulty'] * 100000000000, 100000000000, bool(config.get('sampled_pow', 0)),
+               bool(config.get('block_store', 0)))
+
+
+def new_monitor(config, pow, hr, trace_suffix=""):
+    local_miners = None
+    if config.get('engine') == 'mpi' and not config['racing_test']:
+        # each MPI rank builds only its own miners
+        local_miners = local_miner_ids(config)
+    return MainMonitor(pow, miner_count=config['miner_count'], neighbour_count=config['neighbour_count'],
+                       delay=config['network_delay'], upload_bandwidth=config['network_upload_bandwidth'],
+                       download_bandwidth=config['network_download_bandwidth'],
+                       hash_power=config['hash_power_per_miner'],
+                       selfish_miner_hash_power_in_percent=hr,
+                       propagator_count=config['selfish_propagator_count'],
+                       propagator_delay=config['propagator_delay'],
+                       propagator_upload_bandwidth=config['propagator_upload_bandwidth'],
+                       propagator_download_bandwidth=config['propagator_download_bandwidth'],
+                       racing_test=bool(config['racing_test']),
+                       race_count=config['race_count'],
+                       topology=config.get('topology', 'random'),
+                       topology_file=config.get('topology_file'),
+                       latency_scale=config.get('latency_scale', 1),
+                       rng=new_rng(config),
+                       tracer=new_tracer(config, trace_suffix),
+                       local_miners=local_miners)
+
+
+def load_monitor(config, pow, hr, suffix="", seed=None):
+    """
+    Create the monitor of a run, or restore it from the checkpoint config "resume_from" (e.g. a shared warm-up)
+    with the selfish miner given <hr>. Checkpoints of the run are saved to config "checkpoint_file" + <suffix>
+    every config "checkpoint_every" blocks and at the end of the run, a restored monitor traces to a new file.
+    The phase profile of the run is saved to config "profile_file" + <suffix>, block tree snapshots to the
+    directory config "snapshot_dir" + <suffix>.
+    Args:
+        config: configuration dict
+        pow: pow of a new monitor
+        hr: selfish miner hash power in percent
+        suffix: suffix of the trace, checkpoint and profile files of this run
+        seed: if not None, reseed the random numbers of a restored monitor so that branches differ
+    Returns:
+        MainMonitor
+    """
+    if config.get('resume_from'):
+        monitor = load_checkpoint(config['resume_from'])
+        monitor.set_selfish_hash_power(hr)
+        # the checkpoint and trace files of the saved run are not written to by its branches
+        monitor.checkpoint_file = None
+        monitor.pow.tracer = new_tracer(config, suffix)
+        if seed is not None:
+            random.seed(seed)
+            if monitor.pow.rng is not None:
+                monitor.pow.rng = new_rng(config)
+    else:
+        monitor = new_monitor(config, pow, hr, suffix)
+    monitor.pow.profiler = new_profiler(config, suffix)
+    monitor.snapshots = new_snapshot_renderer(config, suffix)
+    monitor.progress.interval = config.get('progress_interval', 1)
+    monitor.race_estimator = config.get('race_estimator', 'simulate')
+    monitor.shard_count = config.get('shard_count', 0)
+    if (config.get('reward_accounting', 'end') == 'streaming' or config.get('prune_blocks')) \
+            and monitor.chain_index is None:
+        monitor.chain_index = ChainIndex(monitor.blocks, monitor.pow.prime_block, monitor.selfish_miner,
+                                         config.get('settle_depth', SETTLE_DEPTH))
+    if config.get('prune_blocks') and monitor.pruner is None:
+        monitor.pruner = BlockPruner(monitor)
+    if config.get('checkpoint_file'):
+        monitor.checkpoint_file = config['checkpoint_file'] + suffix
+        monitor.checkpoint_every = config.get('checkpoint_every', 0)
+        monitor.checkpoint_block_count = monitor.pow.block_count
+    return monitor
+
+
+def run_sweep_job(config, hr, honest):
+    """
+    Run one simulation of the hrs sweep, in the calling process or in a worker of the sweep pool
+    Args:
+        config: configuration dict
+        hr: selfish miner hash power in percent
+        honest: if True, the selfish miner mines honestly
+    Returns:
+        (output file name, output)
+    """
+    configure(config)
+    pow = new_pow(config)
+    # every run of the sweep uses the configured seed, so that the selfish and honest runs of a hash rate share the
+    # same network, and a run gives the same result wherever it executes
+    random.seed(config['random_seed'])
+    monitor = load_monitor(config, pow, hr, f".{'honest' if honest else 'selfish'}_{hr}")
+    engine = config.get('engine', 'tick')
+    propagation = config.get('propagation', 'event')
+    if honest:
+        monitor.selfish_miner.honest = True
+        return f"honest_hash_power_{hr}", \
+            "Honest\n" + monitor.run_simulation(config['simulation_blocks'], engine, propagation)
+    return f"selfish_hash_power_{hr}", \
+        "Selfish\n" + monitor.run_simulation(config['simulation_blocks'], engine, propagation)
+
+
+def run_sweep_job_args(args):
+    return run_sweep_job(*args)
+
+
 def main(config_file='selfish_config.json'):
     config = json.load(open(config_file))
-    pow = POW(config['pow_difficulty']*100000000000, 100000000000)
+    pow = new_pow(config)
     random.seed(config['random_seed'])
+    configure(config)
     hrs = config.get('hrs', [])
+    engine = config.get('engine', 'tick')
+    workers = config.get('sweep_workers', 1)
+    # the ranks of an MPI run simulate each job together, rank 0 collects the blocks and writes the output
+    root = engine != 'mpi' or mpi_rank() == 0
+    if engine == 'mpi':
+        workers = 1
     if len(hrs) > 0:
-        for hr in hrs:
-            print(f"Running {hr}")
-            pow = POW(config['pow_difficulty'] * 100000000000, 100000000000)
-            random.seed(config['random_seed'])
-            monitor = MainMonitor(pow, miner_count=config['miner_count'], neighbour_count=config['neighbour_count'],
-                                  delay=config['network_delay'], upload_bandwidth=config['network_upload_bandwidth'],
-                                  download_bandwidth=config['network_download_bandwidth'],
-                                  hash_power=config['hash_power_per_miner'],
-                                  selfish_miner_hash_power_in_percent=hr,
-                                  propagator_count=config['selfish_propagator_count'],
-                                  propagator_delay=config['propagator_delay'],
-                                  propagator_upload_bandwidth=config['propagator_upload_bandwidth'],
-                                  propagator_download_bandwidth=config['propagator_download_bandwidth'],
-                                  racing_test=bool(config['racing_test']),
-                                  race_count=config['race_count'])
-            output = "Selfish\n" + monitor.run_simulation(config['simulation_blocks'])
-            with open(f"selfish_hash_power_{hr}", "w") as f:
-                f.write(output)
-            pow = POW(config['pow_difficulty'] * 100000000000, 100000000000)
-            random.seed(config['random_seed'])
-            monitor = MainMonitor(pow, miner_count=config['miner_count'], neighbour_count=config['neighbour_count'],
-                                  delay=config['network_delay'], upload_bandwidth=config['network_upload_bandwidth'],
-                                  download_bandwidth=config['network_download_bandwidth'],
-                                  hash_power=config['hash_power_per_miner'],
-                                  selfish_miner_hash_power_in_percent=hr,
-                                  propagator_count=config['selfish_propagator_count'],
-                                  propagator_delay=config['propagator_delay'],
-                                  propagator_upload_bandwidth=config['propagator_upload_bandwidth'],
-                                  propagator_download_bandwidth=config['propagator_download_bandwidth'],
-                                  racing_test=bool(config['racing_test']),
-                                  race_count=config['race_count'])
-            monitor.selfish_miner.honest = True
-            output = "Honest\n" + monitor.run_simulation(config['simulation_blocks'])
-            with open(f"honest_hash_power_{hr}", "w") as f:
-                f.write(output)
+        jobs = [(config, hr, honest) for hr in hrs for honest in (False, True)]
+        if workers > 1:
+            # every job seeds itself, so the outputs do not depend on the number of workers
+            with multiprocessing.Pool(workers) as pool:
+                for file_name, output in pool.imap(run_sweep_job_args, jobs):
+                    with open(file_name, "w") as f:
+                        f.write(output)
+        else:
+            for job in jobs:
+                if not job[2]:
+                    logger.info("Running %s", job[1])
+                file_name, output = run_sweep_job(*job)
+                if root:
+                    with open(file_name, "w") as f:
+                        f.write(output)
     else:
-
-
-
-        monitor = MainMonitor(pow, miner_count=config['miner_count'], neighbour_count=config['neighbour_count'],
-                              delay=config['network_delay'], upload_bandwidth=config['network_upload_bandwidth'],
-                              download_bandwidth=config['network_download_bandwidth'],
-                              hash_power=config['hash_power_per_miner'], selfish_miner_hash_power_in_percent=config['selfish_miner_hash_power_in_percent'],
-                              propagator_count=config['selfish_propagator_count'], propagator_delay=config['propagator_delay'],
-                              propagator_upload_bandwidth=config['propagator_upload_bandwidth'], propagator_download_bandwidth=config['propagator_download_bandwidth'], racing_test=bool(config['racing_test']),
-                              race_count=config['race_count'])
+        monitor = load_monitor(config, pow, config['selfish_miner_hash_power_in_percent'])
         if config['honest_test']:
             monitor.selfish_miner.honest = True
-        monitor.run_simulation(config['simulation_blocks'])
+        output = monitor.run_simulation(config['simulation_blocks'], engine, config.get('propagation', 'event'))
+        if quiet() and root:
+            print(output)
 
 
 if __name__ == '__main__':
-    import json
     from fire import Fire
     Fire(main)
 
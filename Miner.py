@@ -1,6 +1,9 @@
-from Block import Block
-from Event import SendNewBlockEvent, process_event
-import random
+import logging
+
+from Event import EventQueue, SendNewBlockEvent, process_event, update_event
+from Log import logger
+from Rng import shuffle
+from Trace import TRACE_MINE, TRACE_PUBLISH, TRACE_RUN
 
 
 class Miner:
@@ -11,26 +14,45 @@ class Miner:
         # number of update events that can be processed in 1 timestamp
         self.download_bandwidth = download_bandwidth
         # number of download events that can be processed in 1 timestamp
+        self.pow = pow
+        # pow that is shared among all miners
         self.hash_power = hash_power
         # number of pow attempts per timestamp
         self.id = id
         # id of miner
-        self.pow = pow
-        # pow that is shared among all miners
+        pow.knowledge.add_miner(id)
+        # received and pending blocks are recorded in pow.knowledge
         self.delay = delay
         # number of timestamp added to upload event timestamp when sent
-        self.recv_events = {}
-        # dictionary of future events to process, using timestamp as key
-        self.send_events = {}
-        # dictionary of events that need to be sent to neighbours, using timestamp as key
+        self.recv_events = EventQueue()
+        # priority queue of future events to process, ordered by timestamp
+        self.send_events = EventQueue()
+        # priority queue of events that need to be sent to neighbours, ordered by timestamp
         self.neighbours = []
         # Miner object of neighbours of this miner
-        self.blocks = {}
-        # dict{block_id: block object}, received blocks
+        self.topology = None
+        # CSR Topology the neighbours are a view of, None for a plain list
         self.longest_chain_heads = [pow.prime_block]
         # priority queue of longest chain heads, currently managed using timestamp
-        self.pending_notified_blocks = []
         self.honest = True
+        self.scheduler = None
+        # event engine driving this miner, None when run by the fixed-tick loop
+        self.propagation = None
+        # ShortestPathPropagation delivering announced blocks, None to send them through events
+        self.pow_attempts_left = None
+        # number of pow attempts until the next successful one, drawn from pow.sample_attempts
+        self.pow_clock = 0
+        # first clock time whose pow attempts are not yet counted in self.pow_attempts_left
+
+    @property
+    def hash_power(self):
+        return self._hash_power
+
+    @hash_power.setter
+    def hash_power(self, hash_power):
+        # let samplers built from the hash power of all miners know they are outdated
+        self._hash_power = hash_power
+        self.pow.hash_power_version += 1
 
     def select_block_parent(self):
         """
@@ -46,38 +68,96 @@ class Miner:
         Returns:
             new_block: Block object
         """
-        block_head = self.select_block_parent()
         nounce = self.pow.try_POW()
         if nounce:
-            new_block = Block(self.pow.block_count-1, self.id, self.clock, block_head.id, block_head.height + 1)
-            block_head.add_child(new_block.id)
-            # self.blocks[new_block.id] = new_block
-            return new_block
+            return self.create_block()
+
+    def pow_successes(self):
+        """
+        Count the successful pow attempts of this miner at self.clock from sampled waiting times, the attempts of
+        the clock times since this was last called are consumed first
+        Returns:
+            int, number of blocks found at self.clock
+        """
+        if self.hash_power <= 0:
+            self.pow_clock = self.clock + 1
+            return 0
+        if self.pow_attempts_left is None:
+            self.pow_attempts_left = self.pow.sample_attempts()
+            self.pow_clock = self.clock
+        self.pow_attempts_left -= (self.clock - self.pow_clock) * self.hash_power
+        self.pow_clock = self.clock + 1
+        attempts = self.hash_power
+        successes = 0
+        while self.pow_attempts_left <= attempts:
+            successes += 1
+            attempts -= self.pow_attempts_left
+            self.pow_attempts_left = self.pow.sample_attempts()
+        self.pow_attempts_left -= attempts
+        return successes
+
+    def mine_found_blocks(self, found):
+        """
+        Create and announce <found> blocks whose pow succeeded at self.clock
+        Returns:
+            new_blocks: the new blocks
+        """
+        new_blocks = []
+        for i in range(found):
+            self.pow.record_block()
+            new_block = self.create_block()
+            self.accept_mined_block(new_block)
+            new_blocks.append(new_block)
+        return new_blocks
+
+    def create_block(self):
+        """
+        Create the block of the latest successful pow on top of the selected block parent
+        Returns:
+            new_block: Block object
+        """
+        block_head = self.select_block_parent()
+        new_block = self.pow.new_block(self.pow.block_count-1, self.id, self.clock, block_head.id, block_head.height + 1)
+        block_head.add_child(new_block.id)
+        if self.pow.tracer is not None:
+            self.pow.tracer.record(self.clock, TRACE_MINE, self.id, new_block.id, block_head.id)
+        return new_block
 
+    def accept_mined_block(self, new_block):
+        """
+        Add a block mined by this miner to its blockchain and notify neighbours about it
+        Args:
+            new_block: Block object mined by this miner
+        """
+        self.update_blockchain(new_block)
+        self.pow.knowledge.mark_pending(self.id, new_block.id)
+        self.notify_neighbours(new_block)
 
     def update_blockchain(self, block):
         """
-        update self.blocks and self.longest_chain_heads with block.
+        update received blocks and self.longest_chain_heads with block.
         Args:
             block: received block
 
         Returns:
             Bool: return true if the block is new
         """
-        if block.id not in self.blocks:
-            self.blocks[block.id] = block
-            block.notified_miner_count += 1
-            block.pending_notified_miner_count -= 1
+        if self.pow.knowledge.mark_received(self.id, block.id):
             if block.height > self.longest_chain_heads[0].height:
                 self.longest_chain_heads = [block]
             elif block.height == self.longest_chain_heads[0]:
                 self.longest_chain_heads.append(block)
             return True
-        if block.miner_id != self.blocks[block.id].miner_id:
-            print(f"Block conflict: {block} vs. {self.blocks[block.id]}")
 
         return False
 
+    def has_received(self, block):
+        """
+        Returns:
+            Bool: return true if this miner has added block to its blockchain
+        """
+        return self.pow.knowledge.has_received(self.id, block.id)
+
     def notify_neighbours(self, block):
         """
         Notify all neighbours about block by creating SendNewBlockEvent and add that event to
@@ -85,42 +165,101 @@ class Miner:
         Args:
             block: Block object to notify
         """
-        random.shuffle(self.neighbours)
+        if self.propagation is not None:
+            self.propagation.announce(self, block)
+            return
+        shuffle(self.pow.rng, "relay", self.neighbours, self.id)
         for neighbour in self.neighbours:
             new_event = SendNewBlockEvent(self.clock, block, neighbour)
-            if new_event.timestamp not in self.send_events:
-                self.send_events[new_event.timestamp] = []
-            self.send_events[new_event.timestamp].append(new_event)
+            update_event(new_event, self.send_events)
 
-    def run(self):
+    def link_delay(self, neighbour):
         """
-        Run simulation for 1 timestamp.
-        This includes:
-            1. process recevied events up to download bandwidth times
-            2. mine self.hash_power times, call notify neighbours if needed
-            3. process sent events up to upload bandwidth times
         Returns:
-            new_blocks: return any new blocks mined to MainMonitor
+            number of timestamps added to a block sent to <neighbour>: self.delay plus the latency of the link
         """
+        if self.topology is None:
+            return self.delay
+        return self.delay + self.topology.latency_between(self.topology.index[self.id],
+                                                          self.topology.index[neighbour.id])
 
-        # process each received events that is greater than current clock time
-        # up to self.download_bandwidth times, unprocessed events will be processed
-        # in next timestamp
+    def relay_targets(self, block):
+        """
+        Returns:
+            [Miner] this miner sends <block> to when it receives it from another miner
+        """
+        return self.neighbours
+
+    def wake(self, timestamp):
+        """
+        Tell the event engine (if any) that this miner has events to process at <timestamp>
+        Args:
+            timestamp: clock time of the new event
+        """
+        if self.scheduler is not None:
+            self.scheduler.wake(self, timestamp)
+
+    def process_recv_events(self):
+        """
+        process each received events that is greater than current clock time
+        up to self.download_bandwidth times, unprocessed events will be processed
+        in next timestamp
+        """
         process_event(self, self.recv_events, self.download_bandwidth)
 
+    def process_send_events(self):
+        """
+        process each send events that is greater than current clock time
+        up to self.upload_bandwidth times, unprocessed events will be processed
+        in next timestamp
+        """
+        process_event(self, self.send_events, self.upload_bandwidth)
+
+    def mine_blocks(self):
+        """
+        Mine self.hash_power times, call notify neighbours if needed
+        Returns:
+            new_blocks: any new blocks mined
+        """
+        if self.pow.sampled:
+            return self.mine_sampled_blocks()
         new_blocks = []
         for i in range(self.hash_power):
             new_block = self.mine()
             if new_block:
-                self.update_blockchain(new_block)
-                self.pending_notified_blocks.append(new_block.id)
-                self.notify_neighbours(new_block)
+                self.accept_mined_block(new_block)
                 new_blocks.append(new_block)
+        return new_blocks
 
-        # process each send events that is greater than current clock time
-        # up to self.upload_bandwidth times, unprocessed events will be processed
-        # in next timestamp
-        process_event(self, self.send_events, self.upload_bandwidth)
+    def mine_sampled_blocks(self):
+        """
+        Mine self.hash_power times using sampled waiting times, call notify neighbours if needed
+        Returns:
+            new_blocks: any new blocks mined
+        """
+        return self.mine_found_blocks(self.pow_successes())
+
+    def run(self, found=None):
+        """
+        Run simulation for 1 timestamp.
+        This includes:
+            1. process recevied events up to download bandwidth times
+            2. mine self.hash_power times, call notify neighbours if needed
+            3. process sent events up to upload bandwidth times
+        Args:
+            found: number of blocks found at this timestamp by a BlockFinderSampler (keyed random streams), None
+                   to mine with the pow
+        Returns:
+            new_blocks: return any new blocks mined to MainMonitor
+        """
+        if self.pow.profiler is None:
+            self.process_recv_events()
+            new_blocks = self.mine_blocks() if found is None else self.mine_found_blocks(found)
+            self.process_send_events()
+        else:
+            new_blocks = self.pow.profiler.run_phases(self, found)
+        if self.pow.tracer is not None and self.pow.tracer.runs:
+            self.pow.tracer.record(self.clock, TRACE_RUN, self.id, len(new_blocks))
         self.clock += 1
 
         return new_blocks
@@ -135,15 +274,17 @@ class SelfishMiner(Miner):
         self.honest = False
 
     def publish_private_chain(self, received_publish_timestamp):
-        print(f"Clock {self.clock}: Publish private chain!")
+        logger.info("Clock %d: Publish private chain!", self.clock)
         for block in self.private_chain:
             if received_publish_timestamp > block.timestamp:
                 block.publish_timestamp = received_publish_timestamp
             else:
                 block.publish_timestamp = block.timestamp
-            print("check:block.timestamp: ", block.id, "--", block.timestamp)
-            print("check:block.publish_timestamp: ", block.id, "--", block.publish_timestamp)
-            print(f"Private block {block.id}")
+            if self.pow.tracer is not None:
+                self.pow.tracer.record(self.clock, TRACE_PUBLISH, self.id, block.id)
+            logger.debug("check:block.timestamp:  %d -- %d", block.id, block.timestamp)
+            logger.debug("check:block.publish_timestamp:  %d -- %d", block.id, block.publish_timestamp)
+            logger.debug("Private block %d", block.id)
             super().update_blockchain(block)
             super().notify_neighbours(block)
         self.private_chain = []
@@ -164,9 +305,14 @@ class SelfishMiner(Miner):
             if self.racing_test and len(self.private_chain) > 0:
                 self.private_chain[-1].racing = True
                 self.racing_blocks.append(self.private_chain[-1])
-                self.publish_private_chain()
+                self.publish_private_chain(self.clock)
 
 
+    def relay_targets(self, block):
+        if self.honest:
+            return super().relay_targets(block)
+        return []
+
     def update_blockchain(self, block):
         """
         Update private chain or publish private chain according to what received
@@ -179,15 +325,17 @@ class SelfishMiner(Miner):
             update = super().update_blockchain(block)
             if update and len(self.private_chain) > 0 \
                     and self.longest_chain_heads[0].height >= (self.private_chain[-1].height - 1):
-                print("Public chain:")
-                for block in self.longest_chain_heads:
-                    print(f"{block.id},{block.miner_id},{block.notified_miner_count},{block.pending_notified_miner_count}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Public chain:")
+                    for head in self.longest_chain_heads:
+                        logger.debug("%d,%d,%d,%d", head.id, head.miner_id, head.notified_miner_count,
+                                     head.pending_notified_miner_count)
                 if self.longest_chain_heads[0].height == self.private_chain[-1].height:
                     self.racing_blocks.append(self.private_chain[-1])
                     self.private_chain[-1].racing = True
-                self.publish_private_chain(block.timestamp)
+                self.publish_private_chain(self.longest_chain_heads[-1].timestamp)
         else:
-            if block.id not in self.blocks:
+            if not self.has_received(block):
                 # selfish miner mined a block
                 self.private_chain.append(block)
                 update = True
@@ -206,11 +354,40 @@ class SelfishPropagator(SelfishMiner):
         else:
             # notify selfish miner about new block
             new_event = SendNewBlockEvent(self.clock, block, self.selfish_miner)
-            if new_event.timestamp not in self.send_events:
-                self.send_events[new_event.timestamp] = []
-            self.send_events[new_event.timestamp].append(new_event)
+            update_event(new_event, self.send_events)
+
+    def relay_targets(self, block):
+        if block.miner_id == self.selfish_miner.id:
+            return super().relay_targets(block)
+        return [self.selfish_miner]
 
 
+class RemoteMiner:
+    __slots__ = ("id", "delay", "hash_power", "honest", "neighbours", "topology", "recv_events")
 
+    def __init__(self, id, delay, hash_power):
+        """
+        Stand-in for a miner simulated by another process of a partitioned run (see MainMonitor local_miners):
+        the network links to it, and the blocks the local miners send to it wait in recv_events until they are
+        passed to its process. It keeps neither blocks, events of its own nor knowledge bits.
+        Args:
+            id: id of the miner
+            delay: number of timestamp added to the blocks it sends
+            hash_power: number of pow attempts per timestamp
+        """
+        self.id = id
+        self.delay = delay
+        self.hash_power = hash_power
+        self.honest = True
+        self.neighbours = []
+        # Miner objects of its neighbours, only while the network is generated
+        self.topology = None
+        # CSR Topology of the network, None for a plain list
+        self.recv_events = None
+        # EventQueue of the blocks sent to it, None if no local miner sends to it
 
+    # same link delays as the miner it stands for
+    link_delay = Miner.link_delay
 
+    def wake(self, timestamp):
+        pass
@@ -1,8 +1,263 @@
+import os
 import random
 
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class Topology:
+    def __init__(self, indptr, indices, latency=None, positions=None, latency_scale=0):
+        """
+        Directed network topology as CSR arrays: the neighbours of node i are indices[indptr[i]:indptr[i+1]]
+        Args:
+            indptr: int64 array of n + 1 row offsets
+            indices: int32 array of neighbour node indices
+            latency: optional int32 array aligned with indices, extra timestamps taken by a block on the edge
+            positions: optional (n, 2) float array of node coordinates, latency between any two nodes is their
+                       distance times latency_scale
+            latency_scale: timestamps per unit of distance
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.latency = latency
+        self.positions = positions
+        self.latency_scale = latency_scale
+        self.miners = None
+        # Miner objects indexed like the nodes, set by attach
+        self.index = None
+        # dict{miner_id: node index}, set by attach
+        self.edge_targets = None
+        # copy of indices with each row sorted, set by attach: shuffling a NeighbourView permutes the rows of indices
+        self.edge_latency = None
+        # latency aligned with self.edge_targets
+
+    @property
+    def node_count(self):
+        return len(self.indptr) - 1
+
+    @staticmethod
+    def from_edges(n, sources, targets, latency=None, positions=None, latency_scale=0):
+        """
+        Build a topology from edge arrays, dropping self loops and duplicate edges
+        """
+        keep = sources != targets
+        keys, first = np.unique(sources[keep].astype(np.int64) * n + targets[keep], return_index=True)
+        sources = (keys // n).astype(np.int64)
+        targets = (keys % n).astype(np.int32)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+        if latency is not None:
+            latency = latency[keep][first].astype(np.int32)
+        return Topology(indptr, targets, latency, positions, latency_scale)
+
+    def symmetric(self):
+        """
+        Returns:
+            Topology with every edge in both directions
+        """
+        sources = np.repeat(np.arange(self.node_count), np.diff(self.indptr))
+        latency = None if self.latency is None else np.concatenate([self.latency, self.latency])
+        return Topology.from_edges(self.node_count, np.concatenate([sources, self.indices]),
+                                   np.concatenate([self.indices, sources]), latency, self.positions,
+                                   self.latency_scale)
+
+    def latency_between(self, i, j):
+        """
+        Returns:
+            latency from node <i> to node <j>: that of the edge if there is one, else their distance times
+            latency_scale (e.g. a selfish propagator and its selfish miner)
+        """
+        if self.edge_targets is not None:
+            start, end = self.indptr[i], self.indptr[i + 1]
+            k = start + int(np.searchsorted(self.edge_targets[start:end], j))
+            if k < end and self.edge_targets[k] == j:
+                return int(self.edge_latency[k])
+        if self.positions is None:
+            return 0
+        return int(np.rint(np.hypot(*(self.positions[i] - self.positions[j])) * self.latency_scale))
+
+    def attach(self, miners):
+        """
+        Make the neighbours of each miner a view onto this topology, nodes are assigned to miners in id order
+        Args:
+            miners: list of Miner objects, as many as nodes
+        """
+        if len(miners) != self.node_count:
+            raise ValueError(f"The topology has {self.node_count} nodes for {len(miners)} miners")
+        self.miners = sorted(miners, key=lambda miner: miner.id)
+        self.index = {miner.id: i for i, miner in enumerate(self.miners)}
+        if self.latency is not None:
+            order = np.lexsort((self.indices, np.repeat(np.arange(self.node_count), np.diff(self.indptr))))
+            self.edge_targets = self.indices[order]
+            self.edge_latency = self.latency[order]
+        for i, miner in enumerate(self.miners):
+            miner.neighbours = NeighbourView(self, i)
+            miner.topology = self
+
+    def save(self, path):
+        np.savez(path, indptr=self.indptr, indices=self.indices,
+                 latency=self.latency if self.latency is not None else np.zeros(0, dtype=np.int32),
+                 positions=self.positions if self.positions is not None else np.zeros((0, 2)),
+                 latency_scale=self.latency_scale)
+
+    @staticmethod
+    def load(path, node_count=None):
+        """
+        Load a topology saved by save
+        Args:
+            path: .npz file
+            node_count: if not None, number of nodes the topology must have
+        """
+        data = np.load(path)
+        topology = Topology(data['indptr'], data['indices'],
+                            data['latency'] if len(data['latency']) > 0 else None,
+                            data['positions'] if len(data['positions']) > 0 else None,
+                            float(data['latency_scale']))
+        if node_count is not None and topology.node_count != node_count:
+            raise ValueError(f"Topology file {path} has {topology.node_count} nodes, expected {node_count}")
+        return topology
+
+
+class NeighbourView:
+    __slots__ = ("topology", "node")
+
+    def __init__(self, topology, node):
+        """
+        List-like view of the neighbours of one node of a Topology, yields Miner objects.
+        Assigning (e.g. random.shuffle) permutes the node's row of the CSR indices in place.
+        """
+        self.topology = topology
+        self.node = node
+
+    def row(self):
+        return self.topology.indices[self.topology.indptr[self.node]:self.topology.indptr[self.node + 1]]
+
+    def __len__(self):
+        return int(self.topology.indptr[self.node + 1] - self.topology.indptr[self.node])
+
+    def __iter__(self):
+        miners = self.topology.miners
+        return (miners[i] for i in self.row().tolist())
+
+    def __getitem__(self, i):
+        return self.topology.miners[self.row()[i]]
+
+    def __setitem__(self, i, miner):
+        self.row()[i] = self.topology.index[miner.id]
+
 
 class NetworkGraphGen:
     @staticmethod
-    def random_graph(miners, neighbour_count):
+    def random_graph(miners, neighbour_count, rng=None):
+        if rng is None:
+            for i in range(len(miners)):
+                miners[i].neighbours = random.sample(miners[:i] + miners[i+1:], neighbour_count)
+            return
+        generator = rng.generator("topology")
         for i in range(len(miners)):
-            miners[i].neighbours = random.sample(miners[:i] + miners[i+1:], neighbour_count)
\ No newline at end of file
+            # index j >= i of the other miners is miner j + 1
+            choice = generator.choice(len(miners) - 1, neighbour_count, replace=False).tolist()
+            miners[i].neighbours = [miners[j + (j >= i)] for j in choice]
+
+    @staticmethod
+    def rng(rng=None):
+        # topology stream of the RandomStreams if given, else a numpy generator seeded from the global random
+        # state, so seeded runs stay reproducible
+        if rng is not None:
+            return rng.generator("topology")
+        return np.random.default_rng(random.getrandbits(64))
+
+    @staticmethod
+    def random_k_out(n, k, rng=None):
+        """
+        Every node picks k distinct random other nodes, in O(n * k)
+        """
+        rng = NetworkGraphGen.rng(rng)
+        targets = rng.integers(0, n - 1, size=(n, k))
+        # rows with a repeated neighbour are drawn again, rare when k << n
+        while True:
+            ordered = np.sort(targets, axis=1)
+            repeated = np.flatnonzero((ordered[:, 1:] == ordered[:, :-1]).any(axis=1))
+            if len(repeated) == 0:
+                break
+            targets[repeated] = rng.integers(0, n - 1, size=(len(repeated), k))
+        # skip the node itself
+        targets += targets >= np.arange(n)[:, None]
+        indptr = np.arange(0, n * k + 1, k, dtype=np.int64)
+        return Topology(indptr, targets.reshape(-1).astype(np.int32))
+
+    @staticmethod
+    def random_regular(n, k, rng=None):
+        """
+        Undirected random k-regular graph by random stub matching, self loops and duplicate edges are dropped
+        so a few nodes may end up with degree slightly below k
+        """
+        rng = NetworkGraphGen.rng(rng)
+        stubs = rng.permutation(np.repeat(np.arange(n), k))
+        if len(stubs) % 2 == 1:
+            stubs = stubs[:-1]
+        pairs = stubs.reshape(-1, 2)
+        return Topology.from_edges(n, pairs[:, 0], pairs[:, 1]).symmetric()
+
+    @staticmethod
+    def small_world(n, k, rewire_probability=0.1, rng=None):
+        """
+        Undirected Watts-Strogatz graph: a ring where each node links to its k // 2 next nodes, each link
+        rewired to a random node with <rewire_probability>
+        """
+        rng = NetworkGraphGen.rng(rng)
+        sources = np.repeat(np.arange(n), max(1, k // 2))
+        targets = (sources + np.tile(np.arange(1, max(1, k // 2) + 1), n)) % n
+        rewired = rng.random(len(targets)) < rewire_probability
+        targets[rewired] = rng.integers(0, n, size=int(rewired.sum()))
+        return Topology.from_edges(n, sources, targets).symmetric()
+
+    @staticmethod
+    def geographic(n, k, latency_scale=1, rng=None):
+        """
+        Nodes placed uniformly in a square of side sqrt(n), one node per unit of area so distances do not shrink
+        with n, each linked to its k nearest nodes (in both directions).
+        Edges are annotated with latency: distance * latency_scale extra timestamps, rounded to the nearest integer.
+        """
+        rng = NetworkGraphGen.rng(rng)
+        positions = rng.random((n, 2)) * np.sqrt(n)
+        distances, nearest = cKDTree(positions).query(positions, k=k + 1)
+        sources = np.repeat(np.arange(n), k)
+        targets = nearest[:, 1:].reshape(-1)
+        latency = np.rint(distances[:, 1:].reshape(-1) * latency_scale).astype(np.int32)
+        return Topology.from_edges(n, sources, targets, latency, positions, latency_scale).symmetric()
+
+    @staticmethod
+    def generate(miners, neighbour_count, kind="random", path=None, rng=None, latency_scale=1):
+        """
+        Build the network of <miners>
+        Args:
+            miners: list of Miner objects
+            neighbour_count: number of neighbours per miner
+            kind: "random" (random.sample per miner), "k_out", "regular", "small_world" or "geographic"
+            path: optional .npz file, the CSR topology is loaded from it if it exists and saved to it otherwise
+            rng: RandomStreams to draw the topology from, None for the random module
+            latency_scale: timestamps of latency per unit of distance of a "geographic" topology
+        """
+        if kind == "random":
+            NetworkGraphGen.random_graph(miners, neighbour_count, rng)
+            return None
+        if path is not None and os.path.exists(path):
+            topology = Topology.load(path, len(miners))
+        else:
+            generators = {
+                "k_out": NetworkGraphGen.random_k_out,
+                "regular": NetworkGraphGen.random_regular,
+                "small_world": NetworkGraphGen.small_world,
+                "geographic": NetworkGraphGen.geographic,
+            }
+            if kind not in generators:
+                raise ValueError(f"Unknown topology: {kind}")
+            if kind == "geographic":
+                topology = NetworkGraphGen.geographic(len(miners), neighbour_count, latency_scale, rng)
+            else:
+                topology = generators[kind](len(miners), neighbour_count, rng=rng)
+            if path is not None:
+                topology.save(path)
+        topology.attach(miners)
+        return topology
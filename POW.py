@@ -1,29 +1,89 @@
+import math
 import random
 from Block import Block
+from BlockStore import BlockStore
+from Knowledge import KnowledgeMatrix
+from Rng import uniform
 
 
 class POW:
-    def __init__(self, difficulty, difficulty_bound):
+    def __init__(self, difficulty, difficulty_bound, sampled=False, block_store=False):
         """
         Create a POW with <difficulty> parameter. A miner will run a random number generator to produce a number
         between 0 and 100000. If the number generated is smaller than difficulty, the POW is valid
         Args:
             difficulty (int): difficulty of POW
+            sampled (bool): if True, miners draw the waiting time until their next successful pow
+                            (see sample_attempts) instead of calling try_POW once per unit of hash power
+            block_store (bool): if True, blocks are kept in a shared BlockStore and handed out as BlockView
+                                objects instead of one Block object each
         """
         self.difficulty = difficulty
         self.bound = difficulty_bound
+        self.sampled = sampled
         # self.count = 0
         self.block_count = 1 # keep track of global block count
-        self.prime_block = Block(0, -1, 0, -1, 1)
-        self.prime_block.notified_miner_count = -1
+        self.hash_power_version = 0 # changed whenever the hash power of a miner is set
+        self.knowledge = KnowledgeMatrix()
+        # which miners received each block, shared among all miners
+        self.store = BlockStore(self.knowledge) if block_store else None
+        # struct-of-arrays storage of all blocks, None to use Block objects
+        self.rng = None
+        # RandomStreams shared by the simulation, None to draw from the random module
+        self.tracer = None
+        # TraceRecorder of the simulation, None when not tracing
+        self.profiler = None
+        # PhaseProfiler of the simulation, None when not profiling
+        self.prime_block = self.new_block(0, -1, 0, -1, 1)
 
     def try_POW(self):
-        nounce = random.randint(0, self.bound)
+        if self.rng is None:
+            nounce = random.randint(0, self.bound)
+        else:
+            nounce = self.rng.randint("mining", 0, self.bound)
         # self.count += 1
         # if self.count % 100 == 0:
         #     print(f"POW is tried {self.count} times")
 
         if nounce <= self.difficulty:
             # self.count = 0
-            self.block_count += 1
-            return True
\ No newline at end of file
+            self.record_block()
+            return True
+
+    def new_block(self, id, miner_id, timestamp, parent_id, height):
+        """
+        Create a block, same arguments as Block
+        Returns:
+            Block object, or BlockView when blocks are kept in self.store
+        """
+        if self.store is not None:
+            return self.store.add(id, miner_id, timestamp, parent_id, height)
+        return Block(id, miner_id, timestamp, parent_id, height, self.knowledge)
+
+    def record_block(self):
+        """
+        Count a successful pow in the global block count
+        Returns:
+            id of the block produced by the pow
+        """
+        self.block_count += 1
+        return self.block_count - 1
+
+    def success_probability(self):
+        """
+        Returns:
+            probability that a single call of try_POW succeeds
+        """
+        return min(1.0, (math.floor(self.difficulty) + 1) / (self.bound + 1))
+
+    def sample_attempts(self):
+        """
+        Draw the number of pow attempts up to and including the next successful one, which is geometric
+        with the success probability of try_POW. Costs a single random number whatever the difficulty.
+        Returns:
+            int, number of attempts
+        """
+        p = self.success_probability()
+        if p >= 1:
+            return 1
+        return 1 + int(math.log(1.0 - uniform(self.rng, "mining")) / math.log(1.0 - p))
@@ -0,0 +1,173 @@
+import json
+import time
+
+from Log import logger
+from Miner import SelfishMiner, SelfishPropagator
+
+PHASES = ("receive", "mine", "send")
+# phases of a miner run, in order
+MONITOR_PHASES = ("races", "checkpoint", "report")
+# phases of the monitor between and after the miner runs, profiled as miner kind "monitor"
+
+
+def miner_kind(miner):
+    """
+    Returns:
+        str, "propagator", "selfish" or "honest": the class of <miner> the profiler aggregates it into
+    """
+    if isinstance(miner, SelfishPropagator):
+        return "propagator"
+    if isinstance(miner, SelfishMiner):
+        return "selfish"
+    return "honest"
+
+
+class PhaseProfiler:
+    def __init__(self, path=None):
+        """
+        Wall time, number of calls and number of events of each phase of the simulation, per miner class.
+        Miner runs are timed phase by phase in place of Miner.run (see run_phases), the monitor times its own
+        phases with add. Nothing is timed when pow.profiler is None.
+        Args:
+            path: JSON file the counters are saved to by save, None to keep them in memory
+        """
+        self.path = path
+        self.counters = {}
+        # dict{(miner kind, phase): [wall time, calls, events]}
+        self.kinds = {}
+        # dict{miner id: miner kind}, cached
+
+    def add(self, kind, phase, wall_time, events=0):
+        counter = self.counters.get((kind, phase))
+        if counter is None:
+            counter = self.counters[(kind, phase)] = [0.0, 0, 0]
+        counter[0] += wall_time
+        counter[1] += 1
+        counter[2] += events
+
+    def call(self, phase, function, *args):
+        """
+        Call function(*args) and time it as monitor <phase>
+        Returns:
+            the result of the function
+        """
+        start = time.perf_counter()
+        result = function(*args)
+        self.add("monitor", phase, time.perf_counter() - start)
+        return result
+
+    def run_phases(self, miner, found=None):
+        """
+        Run the three phases of a miner run and time each of them. Events are the received and sent events
+        processed and the blocks mined.
+        Args:
+            miner: Miner object to run
+            found: number of blocks found by the miner for an event driven run (see Miner.mine_found_blocks),
+                   None to mine with Miner.mine_blocks
+        Returns:
+            new_blocks: any new blocks mined
+        """
+        kind = self.kinds.get(miner.id)
+        if kind is None:
+            kind = self.kinds[miner.id] = miner_kind(miner)
+        recv_events = miner.recv_events
+        send_events = miner.send_events
+        processed = recv_events.processed
+        start = time.perf_counter()
+        miner.process_recv_events()
+        end = time.perf_counter()
+        self.add(kind, "receive", end - start, recv_events.processed - processed)
+        start = end
+        new_blocks = miner.mine_blocks() if found is None else miner.mine_found_blocks(found)
+        end = time.perf_counter()
+        self.add(kind, "mine", end - start, len(new_blocks))
+        processed = send_events.processed
+        start = end
+        miner.process_send_events()
+        self.add(kind, "send", time.perf_counter() - start, send_events.processed - processed)
+        return new_blocks
+
+    def to_dict(self):
+        """
+        Returns:
+            dict{miner kind: dict{phase: {"wall_time", "calls", "events"}}}, the monitor phases under "monitor"
+        """
+        result = {}
+        for (kind, phase), (wall_time, calls, events) in sorted(self.counters.items()):
+            result.setdefault(kind, {})[phase] = {"wall_time": wall_time, "calls": calls, "events": events}
+        return result
+
+    def save(self):
+        if self.path is None:
+            return
+        with open(self.path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def processed_events(miners):
+    """
+    Returns:
+        int, number of received and sent events processed by <miners>
+    """
+    return sum(miner.recv_events.processed + miner.send_events.processed for miner in miners)
+
+
+def new_profiler(config, suffix=""):
+    """
+    Returns:
+        PhaseProfiler saving to config "profile_file" + <suffix>, None if no profile file is configured
+    """
+    if not config.get('profile_file'):
+        return None
+    return PhaseProfiler(config['profile_file'] + suffix)
+
+
+class ProgressReporter:
+    def __init__(self, interval=1.0):
+        """
+        Log the progress of a run at most once every <interval> seconds of wall time: clock, block count,
+        events processed per second and the estimated time until the last block is mined, and with a chain index
+        the selfish rewards ratio of the settled chain
+        """
+        self.interval = interval
+        self.start_time = None
+        # wall time the run started, None before start
+        self.start_blocks = 0
+        # block count when the run started
+        self.start_events = 0
+        # events processed when the run started
+        self.next_time = 0
+        # wall time of the next report
+
+    def start(self, monitor):
+        self.start_time = time.perf_counter()
+        self.start_blocks = monitor.pow.block_count
+        self.start_events = processed_events(monitor.miners)
+        self.next_time = self.start_time + self.interval
+
+    def update(self, monitor, target):
+        """
+        Called once per simulated clock time, reports when the interval has passed
+        Args:
+            monitor: MainMonitor being run
+            target: number of blocks the run stops at
+        """
+        now = time.perf_counter()
+        if now < self.next_time:
+            return
+        self.next_time = now + self.interval
+        elapsed = now - self.start_time
+        block_count = monitor.pow.block_count
+        events = processed_events(monitor.miners) - self.start_events
+        mined = block_count - self.start_blocks
+        if monitor.racing_test:
+            logger.info("Clock: %d, Block Count: %d, %.0f events/s, Race count: %d", monitor.clock, block_count,
+                        events / elapsed, len(monitor.propagation_rates))
+        elif mined > 0:
+            logger.info("Clock: %d, Block Count: %d, %.0f events/s, ETA %.0fs", monitor.clock, block_count,
+                        events / elapsed, (target - block_count) * elapsed / mined)
+            if monitor.chain_index is not None and monitor.chain_index.selfish_rewards_ratio() is not None:
+                logger.info("Settled height: %d, Selfish rewards ratio: %s", monitor.chain_index.settled_height,
+                            monitor.chain_index.selfish_rewards_ratio())
+        else:
+            logger.info("Clock: %d, Block Count: %d, %.0f events/s", monitor.clock, block_count, events / elapsed)
@@ -0,0 +1,59 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from Event import ReceiveNewBlockEvent, update_event
+from Miner import Miner
+
+
+class ShortestPathPropagation:
+    def __init__(self, miners):
+        """
+        Deliver announced blocks straight at their arrival times. When no bandwidth limit binds, a block reaches
+        every miner at its delay-weighted shortest-path distance from the announcing miner, so one Dijkstra pass
+        over the relay graph replaces the SendNewBlockEvent/ReceiveNewBlockEvent pairs of every hop.
+        The relay graph follows Miner.relay_targets, which only depends on who mined the block: one graph is built
+        for the blocks of honest miners and one for the blocks of each other (selfish) miner, in which that miner
+        announces to all its neighbours. Edges are weighted by Miner.link_delay.
+        Args:
+            miners: list of all Miner objects of the simulation
+        """
+        self.miners = list(miners)
+        # copy, the monitor shuffles its list of miners every tick
+        self.index = {miner.id: i for i, miner in enumerate(miners)}
+        # dict{miner_id: row of the miner in the relay graphs}
+        self.special_ids = {miner.id for miner in miners if type(miner) is not Miner}
+        # ids of miners whose blocks may be relayed differently from honest blocks
+        self.graphs = {}
+        # dict{special miner id or None for honest blocks: CSR relay graph weighted by sender delay}
+
+    def graph(self, block):
+        key = block.miner_id if block.miner_id in self.special_ids else None
+        if key not in self.graphs:
+            edges = {}
+            for i, miner in enumerate(self.miners):
+                targets = miner.neighbours if miner.id == key else miner.relay_targets(block)
+                for target in targets:
+                    edges[(i, self.index[target.id])] = miner.link_delay(target)
+            rows = [edge[0] for edge in edges]
+            cols = [edge[1] for edge in edges]
+            self.graphs[key] = csr_matrix((list(edges.values()), (rows, cols)),
+                                          shape=(len(self.miners), len(self.miners)))
+        return self.graphs[key]
+
+    def announce(self, origin, block):
+        """
+        Schedule the arrival of <block>, announced by <origin> at origin.clock, at every miner it reaches
+        Args:
+            origin: Miner object announcing the block to its neighbours
+            block: Block object
+        """
+        distances = dijkstra(self.graph(block), indices=self.index[origin.id])
+        for i in np.flatnonzero(np.isfinite(distances)):
+            dest = self.miners[i]
+            if dest is origin:
+                continue
+            arrival = origin.clock + int(distances[i])
+            update_event(ReceiveNewBlockEvent(arrival, block, relay=False), dest.recv_events)
+            dest.wake(arrival)
+            origin.pow.knowledge.mark_pending(dest.id, block.id)
@@ -0,0 +1,81 @@
+from Log import logger
+
+PRUNE_DEPTH = 8
+# blocks more than 7 generations below every tip are pruned: they can neither be mined on nor become the parent
+# of an uncle, and their rewards are settled
+
+
+class BlockPruner:
+    def __init__(self, monitor, depth=PRUNE_DEPTH):
+        """
+        Drop the blocks that no longer take part in the simulation, so that long runs use a bounded memory. Once
+        the ChainIndex of the monitor has settled the rewards of a height, and every mining miner's longest chain
+        is more than <depth> - 1 blocks above it, the blocks of that height leave the monitor's blocks and the
+        chain index, and their rows of the knowledge matrix are dropped. Uncle candidates not yet included stay
+        until they are. Blocks still in flight keep their received bits (see KnowledgeMatrix.drop_rows).
+        Args:
+            monitor: MainMonitor with a chain index, simulated with Block objects
+            depth: number of generations kept below the lowest tip
+        """
+        if monitor.chain_index is None:
+            raise ValueError("Pruning needs the streaming reward accounting")
+        if monitor.pow.store is not None:
+            raise ValueError("Pruning is not supported with the block store")
+        self.monitor = monitor
+        self.chain_index = monitor.chain_index
+        self.knowledge = monitor.pow.knowledge
+        self.depth = depth
+        self.held = []
+        # ids of the pruned heights' uncle candidates that are not yet included, still in monitor.blocks
+        self.done = set()
+        # ids of pruned blocks whose knowledge rows are not dropped yet, the rows are dropped in id order
+        self.pruned_count = 0
+        # number of blocks pruned
+
+    def prune_height(self):
+        """
+        Returns:
+            height up to which blocks can be pruned
+        """
+        height = self.chain_index.settled_height
+        for miner in self.monitor.miners:
+            if miner.hash_power > 0:
+                height = min(height, miner.longest_chain_heads[0].height)
+        return height - self.depth
+
+    def prune(self):
+        """
+        Prune the blocks of the heights that left the window since the last call, called after
+        ChainIndex.settle
+        """
+        chain_index = self.chain_index
+        if chain_index.reorged or chain_index.settled_height - self.depth <= chain_index.pruned_height:
+            return
+        target = self.prune_height()
+        if target <= chain_index.pruned_height:
+            return
+        blocks = self.monitor.blocks
+        candidates = chain_index.engine.candidate_ids()
+        held = [block_id for block_id in self.held if block_id in candidates]
+        pruned = [block_id for block_id in self.held if block_id not in candidates]
+        for height in range(chain_index.pruned_height + 1, target + 1):
+            for block_id in chain_index.heights.pop(height, []):
+                if block_id in candidates:
+                    held.append(block_id)
+                else:
+                    pruned.append(block_id)
+            chain_index.chain.pop(height, None)
+        for block_id in pruned:
+            del blocks[block_id]
+            self.done.add(block_id)
+        self.held = held
+        chain_index.pruned_height = target
+        self.pruned_count += len(pruned)
+        base = self.knowledge.base
+        while base in self.done:
+            base += 1
+        # dropping rows moves the remaining ones, do it in batches
+        if base - self.knowledge.base >= 64:
+            self.done.difference_update(range(self.knowledge.base, base))
+            self.knowledge.drop_rows(base)
+        logger.debug("Pruned up to height %d, %d blocks pruned, %d kept", target, self.pruned_count, len(blocks))
@@ -0,0 +1,122 @@
+import random
+
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+from Block import Block
+from Propagation import ShortestPathPropagation
+
+SELFISH_BLOCK, HONEST_BLOCK = 0, 1
+# index of the racing blocks in the arrival times, and the block a miner mines on first
+
+
+class BatchedRaceEstimator:
+    def __init__(self, miners, selfish_miner, racer_miner):
+        """
+        Estimate the propagation rates of racing_test races without simulating them. In a race the selfish miner
+        and the racer each announce a block at the same clock time, and an honest miner mines on the one it
+        receives first. Without bandwidth limits each block reaches each miner at its delay-weighted
+        shortest-path distance (see ShortestPathPropagation), so two Dijkstra passes give the arrival times of
+        every race. Miners receiving both blocks at the same clock time keep the one whose
+        ReceiveNewBlockEvent was queued first: the events sent at the earliest clock time, and among those the
+        events of the sender that ran first in the shuffled miner order, which sends the block it received
+        first. Only these ties differ from race to race: the miner order of each clock time is drawn once per
+        race and shared by all the ties it breaks, for a whole batch of races at once.
+        Args:
+            miners: list of all Miner objects of the racing test
+            selfish_miner: SelfishMiner announcing the racing block
+            racer_miner: honest Miner announcing the competing block
+        """
+        for miner in miners:
+            if miner.delay <= 0:
+                raise ValueError("The batched race estimator needs a positive network delay")
+        propagation = ShortestPathPropagation(miners)
+        self.miners = propagation.miners
+        graphs = [propagation.graph(Block(-1, selfish_miner.id, 0, -1, 0)),
+                  propagation.graph(Block(-1, racer_miner.id, 0, -1, 0))]
+        # relay graphs of the selfish and honest blocks, indexed by SELFISH_BLOCK / HONEST_BLOCK
+        self.arrivals = np.vstack([dijkstra(graphs[SELFISH_BLOCK], indices=propagation.index[selfish_miner.id]),
+                                   dijkstra(graphs[HONEST_BLOCK], indices=propagation.index[racer_miner.id])])
+        # arrival times of each racing block at each miner, inf if it never arrives
+        if not np.all(np.isfinite(self.arrivals[SELFISH_BLOCK])):
+            raise ValueError("The selfish racing block does not reach every miner, the simulated races never finish")
+        self.first = np.where(self.arrivals[SELFISH_BLOCK] < self.arrivals[HONEST_BLOCK], SELFISH_BLOCK,
+                              HONEST_BLOCK).astype(np.int8)
+        # block each miner receives first, when it is the same in every race
+        self.honest = np.array([miner.honest for miner in self.miners])
+        # miners counted in the propagation rate, like ReceiveNewBlockEvent.process
+        self.ties = self.find_ties([graph.tocsc() for graph in graphs])
+        # [(miner index, send clock time, sender indices, block sent by each sender or -1 for the block the
+        # sender received first)] of the miners receiving both blocks at the same clock time, in arrival order
+        self.senders = {}
+        # dict{send clock time: sorted indices of the senders breaking ties at that clock time}
+        for _, sent, senders, _ in self.ties:
+            self.senders[sent] = np.union1d(self.senders.get(sent, []), senders).astype(np.int64)
+        self.ties = [(i, sent, np.searchsorted(self.senders[sent], senders), blocks)
+                     for i, sent, senders, blocks in self.ties]
+        # sender indices replaced by their position in self.senders of the send clock time
+
+    def find_ties(self, incoming):
+        """
+        Args:
+            incoming: relay graphs in CSC format, column j lists the senders to miner j
+        Returns:
+            [(miner index, send clock time, numpy array of sender indices, numpy array of blocks sent)], in
+            arrival order
+        """
+        arrivals = self.arrivals
+        tied = np.flatnonzero(np.isfinite(arrivals[SELFISH_BLOCK])
+                              & (arrivals[SELFISH_BLOCK] == arrivals[HONEST_BLOCK]))
+        ties = []
+        for i in tied[np.argsort(arrivals[SELFISH_BLOCK][tied], kind="stable")]:
+            arrival = arrivals[SELFISH_BLOCK][i]
+            senders = {}
+            # dict{sender index: set of blocks it sends at the earliest clock time}
+            earliest = np.inf
+            for block, graph in enumerate(incoming):
+                start, end = graph.indptr[i], graph.indptr[i + 1]
+                for sender, delay in zip(graph.indices[start:end], graph.data[start:end]):
+                    sent = arrivals[block][sender]
+                    if sent + delay != arrival or sent > earliest:
+                        continue
+                    if sent < earliest:
+                        earliest = sent
+                        senders = {}
+                    senders.setdefault(sender, set()).add(block)
+            sender_indices = np.array(list(senders), dtype=np.int64)
+            sent_blocks = np.array([blocks.pop() if len(blocks) == 1 else -1 for blocks in senders.values()],
+                                   dtype=np.int8)
+            ties.append((i, earliest, sender_indices, sent_blocks))
+        return ties
+
+    def propagation_rates(self, race_count, miner_count, rng=None, batch_size=1024):
+        """
+        Args:
+            race_count: number of races
+            miner_count: number of honest miners the win counts are divided by, as MainMonitor.check_races
+            rng: RandomStreams drawing the tie breaks from its "scheduling" stream, None to seed a numpy generator
+                 from the random module
+            batch_size: number of races drawn at once
+        Returns:
+            [float], propagation rate of each race: the share of honest miners mining on the selfish block
+        """
+        if rng is not None:
+            generator = rng.generator("scheduling")
+        else:
+            generator = np.random.default_rng(random.getrandbits(64))
+        rates = []
+        for start in range(0, race_count, batch_size):
+            races = np.arange(min(batch_size, race_count - start))
+            first = np.tile(self.first, (len(races), 1))
+            order = {sent: generator.random((len(races), len(senders))) for sent, senders in self.senders.items()}
+            # rank of each sender in the shuffled miner order of each send clock time
+            for i, sent, senders, blocks in self.ties:
+                pick = np.argmin(order[sent][:, senders], axis=1)
+                block = blocks[pick]
+                relayed = block < 0
+                # a sender that received both blocks at once sends the one it received first
+                block[relayed] = first[races[relayed], self.senders[sent][senders[pick[relayed]]]]
+                first[:, i] = block
+            wins = np.count_nonzero(first[:, self.honest] == SELFISH_BLOCK, axis=1)
+            rates.extend((wins / miner_count).tolist())
+        return rates
@@ -0,0 +1,126 @@
+import json
+import math
+import multiprocessing
+import random
+
+from scipy import stats
+
+from Log import configure, logger
+from MainMonitor import load_monitor, new_pow
+
+
+class RunningStats:
+    def __init__(self):
+        """
+        Streaming mean and variance of the replicate results (Welford's algorithm)
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        # sum of squared differences from the mean
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def variance(self):
+        if self.count < 2:
+            return math.inf
+        return self.m2 / (self.count - 1)
+
+    def half_width(self, confidence):
+        """
+        Returns:
+            half width of the Student t confidence interval of the mean
+        """
+        if self.count < 2:
+            return math.inf
+        t = stats.t.ppf((1 + confidence) / 2, self.count - 1)
+        return t * math.sqrt(self.variance() / self.count)
+
+
+def replicate_seed(config, replicate):
+    return config['random_seed'] + replicate
+
+
+def run_replicate(args):
+    """
+    Run one replicate of the configuration in the calling process or in a worker of the replication pool
+    Args:
+        args: (config, hr, honest, replicate index)
+    Returns:
+        selfish rewards ratio of the replicate
+    """
+    config, hr, honest, replicate = args
+    configure(config)
+    pow = new_pow(config)
+    random.seed(replicate_seed(config, replicate))
+    monitor = load_monitor(config, pow, hr, f".{'honest' if honest else 'selfish'}_{hr}_{replicate}",
+                           replicate_seed(config, replicate))
+    if honest:
+        monitor.selfish_miner.honest = True
+    monitor.run_simulation(config['simulation_blocks'], config.get('engine', 'tick'),
+                           config.get('propagation', 'event'))
+    return monitor.selfish_rewards_ratio
+
+
+def replicate(config, hr, honest=False):
+    """
+    Run replicates of one configuration with seeds random_seed, random_seed + 1, ... until the confidence
+    interval of the mean selfish rewards ratio is narrower than the target. Replicates run in parallel but are
+    consumed in seed order, so the stopping point and the estimate do not depend on the number of workers.
+    Args:
+        config: configuration dict, settings are read from config['replication']
+        hr: selfish miner hash power in percent
+        honest: if True, the selfish miner mines honestly
+    Returns:
+        RunningStats of the selfish rewards ratio
+    """
+    settings = config.get('replication', {})
+    target = settings.get('target_half_width', 0.01)
+    confidence = settings.get('confidence', 0.95)
+    min_replicates = max(2, settings.get('min_replicates', 5))
+    max_replicates = settings.get('max_replicates', 1000)
+    workers = settings.get('workers', 1)
+
+    running = RunningStats()
+    jobs = ((config, hr, honest, i) for i in range(max_replicates))
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    results = pool.imap(run_replicate, jobs) if pool is not None else map(run_replicate, jobs)
+    try:
+        for ratio in results:
+            running.add(ratio)
+            half_width = running.half_width(confidence)
+            logger.info("Replicate %d: ratio %s, mean %s +- %s", running.count, ratio, running.mean, half_width)
+            if running.count >= min_replicates and half_width <= target:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return running
+
+
+def main(config_file='selfish_config.json'):
+    config = json.load(open(config_file))
+    configure(config)
+    hrs = config.get('hrs', []) or [config['selfish_miner_hash_power_in_percent']]
+    confidence = config.get('replication', {}).get('confidence', 0.95)
+    for hr in hrs:
+        for honest in (False, True):
+            name = "Honest" if honest else "Selfish"
+            running = replicate(config, hr, honest)
+            output = f"{name}\n" \
+                + f"Selfish hr in percent: {hr}\n" \
+                + f"Replicates: {running.count}\n" \
+                + f"Mean selfish rewards ratio: {running.mean}\n" \
+                + f"Confidence interval ({confidence}): +- {running.half_width(confidence)}\n"
+            print(output)
+            with open(f"replicated_{name.lower()}_hash_power_{hr}", "w") as f:
+                f.write(output)
+
+
+if __name__ == '__main__':
+    from fire import Fire
+    Fire(main)
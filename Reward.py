@@ -0,0 +1,156 @@
+import bisect
+import heapq
+
+
+class RewardEngine:
+    def __init__(self, blocks, longest_chain, selfish_miner_id=0):
+        """
+        Uncle assignment and rewards of a simulated chain, same rules as the original MainMonitor.assign_uncles.
+        Uncle candidates (children of chain blocks that are not on the chain) are indexed by height, and only
+        enter the index once the timestamp of the nephew being filled may make them eligible (see
+        activation_time). Each nephew then walks the indexed candidates nearest first and stops at 2 uncles,
+        instead of scanning every height of the chain.
+        Args:
+            blocks: dict{block_id: block object} of all mined blocks
+            longest_chain: [Block] from the last block down to the prime block, see MainMonitor.find_longest_chain
+            selfish_miner_id: id of the selfish miner, whose blocks follow the publish time rules
+        """
+        self.blocks = blocks
+        self.longest_chain = longest_chain
+        self.selfish_miner_id = selfish_miner_id
+        self.waiting = []
+        # heap of (activation time, block id) of the candidates not yet indexed
+        self.candidates = {}
+        # dict{height: [block ids]} of the indexed candidates not yet included as uncles, in id order
+        self.heights = []
+        # sorted heights having indexed candidates
+        for i in range(1, len(longest_chain)):
+            parent = longest_chain[i]
+            on_chain = longest_chain[i - 1].id
+            for child_id in parent.children:
+                if child_id != on_chain:
+                    self.push(blocks[child_id])
+
+    def push(self, block):
+        """
+        Add an uncle candidate: a child of a chain block that is not on the chain
+        """
+        heapq.heappush(self.waiting, (self.activation_time(block), block.id))
+
+    def candidate_ids(self):
+        """
+        Returns:
+            set of the ids of the candidates not yet included as uncles
+        """
+        ids = {block_id for _, block_id in self.waiting}
+        for height_ids in self.candidates.values():
+            ids.update(height_ids)
+        return ids
+
+    def activation_time(self, block):
+        """
+        Returns:
+            first nephew timestamp at which <block> may be included as an uncle: after it was mined, or for
+            blocks of the selfish miner, once it was published
+        """
+        if block.miner_id == self.selfish_miner_id:
+            return min(block.timestamp + 1, block.publish_timestamp)
+        return block.timestamp + 1
+
+    def activate(self, timestamp):
+        """
+        Index the candidates that may be included by a nephew with <timestamp>
+        """
+        while len(self.waiting) > 0 and self.waiting[0][0] <= timestamp:
+            _, block_id = heapq.heappop(self.waiting)
+            height = self.blocks[block_id].height
+            if height not in self.candidates:
+                self.candidates[height] = []
+                bisect.insort(self.heights, height)
+            bisect.insort(self.candidates[height], block_id)
+
+    def include(self, nephew, height, eligible):
+        """
+        Include the candidates of <height> that are <eligible> as uncles of <nephew>, in id order, until it
+        has enough uncles
+        Args:
+            nephew: chain block
+            height: height of the candidates
+            eligible: function(block) -> Bool
+        """
+        ids = self.candidates.get(height)
+        if ids is None:
+            return
+        for uncle_id in list(ids):
+            if not nephew.need_more_uncles():
+                break
+            if eligible(self.blocks[uncle_id]):
+                nephew.uncles.append(uncle_id)
+                ids.remove(uncle_id)
+        if len(ids) == 0:
+            del self.candidates[height]
+            del self.heights[bisect.bisect_left(self.heights, height)]
+
+    def include_below(self, nephew, eligible):
+        """
+        Include eligible candidates of heights below <nephew>, nearest first
+        """
+        i = bisect.bisect_left(self.heights, nephew.height) - 1
+        while i >= 0 and nephew.need_more_uncles():
+            # including may only delete the height at index i, the lower ones keep their index
+            self.include(nephew, self.heights[i], eligible)
+            i -= 1
+
+    def assign_uncles(self):
+        """
+        Walk the chain from the third block up and include up to 2 uncles in each block:
+            - a block of the selfish miner first includes the selfish miner's own published blocks of its
+              6-generation window (its own height included), then any block mined before it
+            - an honest block includes blocks mined before it, or for blocks of the selfish miner, published
+              before it
+        """
+        for nephew in self.longest_chain[-3::-1]:
+            self.assign(nephew)
+
+    def assign(self, nephew):
+        """
+        Include the uncles of chain block <nephew>, the nephews below it must have been assigned already
+        """
+        selfish_miner_id = self.selfish_miner_id
+        timestamp = nephew.timestamp
+        self.activate(timestamp)
+        if nephew.miner_id == selfish_miner_id:
+            generation_count = nephew.height - 2 if nephew.height < 6 else 6
+            for height in range(nephew.height, nephew.height - generation_count, -1):
+                if not nephew.need_more_uncles():
+                    break
+                self.include(nephew, height, lambda block: block.miner_id == selfish_miner_id
+                             and block.publish_timestamp <= timestamp)
+            self.include_below(nephew, lambda block: block.timestamp < timestamp)
+        else:
+            self.include_below(nephew, lambda block: block.timestamp < timestamp
+                               if block.miner_id != selfish_miner_id else block.publish_timestamp < timestamp)
+
+    def rewards(self):
+        """
+        Assign the uncles and compute the rewards: 32 per chain block, 1 per included uncle to the nephew, and
+        (8 - distance) * 4 to an uncle at most 6 generations below its nephew
+        Returns:
+            regular_rewards: dict{miner_id: reward}, uncle_rewards: dict{miner_id: reward}
+        """
+        self.assign_uncles()
+        regular_rewards = {}
+        uncle_rewards = {}
+        for block in self.longest_chain:
+            regular_rewards[block.miner_id] = regular_rewards.get(block.miner_id, 0) + 32
+        for nephew in self.longest_chain:
+            uncles = nephew.uncles
+            if len(uncles) == 0:
+                continue
+            regular_rewards[nephew.miner_id] += len(uncles)
+            for uncle_id in uncles:
+                uncle = self.blocks[uncle_id]
+                distance = nephew.height - uncle.height
+                uncle_rewards[uncle.miner_id] = uncle_rewards.get(uncle.miner_id, 0) \
+                    + ((8 - distance) * 4 if distance <= 6 else 0)
+        return regular_rewards, uncle_rewards
@@ -0,0 +1,194 @@
+import random
+
+import numpy as np
+
+MASK64 = (1 << 64) - 1
+
+
+def mix64(x):
+    """
+    Returns:
+        the 64 bit int <x> scrambled by the SplitMix64 finalizer
+    """
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+def mix64_array(x):
+    """
+    Returns:
+        mix64 of each element of the uint64 array <x>, products wrap around like the masks of mix64
+    """
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class RandomStreams:
+    STREAMS = ("mining", "relay", "scheduling", "topology")
+
+    def __init__(self, seed, block_size=4096, keyed=False):
+        """
+        Central random number service on numpy Generators. Each purpose draws from its own independent substream
+        (spawned from one SeedSequence), so changing how often one subsystem draws does not move the numbers
+        seen by the others. Uniforms and permutations are generated in blocks and handed out one at a time.
+        With <keyed> streams, the numbers of a miner do not depend on when the other miners draw, so that
+        processes simulating different miners draw them alike: the relay stream is split into one substream per
+        miner (see keyed_generator), the scheduling order comes from counter-based priorities (see priorities)
+        and the blocks are found by a BlockFinderSampler over the whole network.
+        Args:
+            seed: int seed of the whole simulation
+            block_size: number of variates generated per block
+            keyed: True to draw the relay and scheduling streams per miner
+        """
+        self.block_size = block_size
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.keyed = keyed
+        self.counter_seeds = {
+            name: int(np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=(len(self.STREAMS) + i,))
+                      .generate_state(1, np.uint64)[0])
+            for i, name in enumerate(self.STREAMS)}
+        # dict{stream name: 64 bit seed of its counter-based draws}
+        self.keyed_generators = {}
+        # dict{(stream name, key): numpy Generator}, created on first use
+        children = self.seed_sequence.spawn(len(self.STREAMS))
+        self.generators = {name: np.random.Generator(np.random.PCG64(child))
+                           for name, child in zip(self.STREAMS, children)}
+        # dict{stream name: numpy Generator}
+        self.uniforms = {name: [] for name in self.STREAMS}
+        # dict{stream name: remaining pre-generated uniforms, consumed from the end}
+        self.permutations = {}
+        # dict{(stream name, length): remaining pre-generated permutations, consumed from the end}
+
+    def generator(self, stream):
+        """
+        Returns:
+            numpy Generator of <stream>, for vectorized draws
+        """
+        return self.generators[stream]
+
+    def keyed_generator(self, stream, key):
+        """
+        Returns:
+            numpy Generator of the substream of <stream> for int <key>
+        """
+        generator = self.keyed_generators.get((stream, key))
+        if generator is None:
+            seed = np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=(self.STREAMS.index(stream), key))
+            generator = self.keyed_generators[(stream, key)] = np.random.Generator(np.random.PCG64(seed))
+        return generator
+
+    def priority(self, stream, key, counter):
+        """
+        Returns:
+            64 bit int, counter-based draw of <stream> for int <key> at int <counter>: it depends on nothing else,
+            so any process can compute the draw of any key
+        """
+        return mix64(mix64(self.counter_seeds[stream] ^ key) ^ counter)
+
+    def priorities(self, stream, keys, counter):
+        """
+        Returns:
+            uint64 array, priority of each of the int array <keys> at <counter>
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        return mix64_array(mix64_array(keys ^ np.uint64(self.counter_seeds[stream])) ^ np.uint64(counter))
+
+    def random(self, stream):
+        """
+        Returns:
+            float uniform in [0, 1) from <stream>
+        """
+        uniforms = self.uniforms[stream]
+        if len(uniforms) == 0:
+            uniforms.extend(self.generators[stream].random(self.block_size).tolist())
+        return uniforms.pop()
+
+    def randint(self, stream, low, high):
+        """
+        Returns:
+            int uniform in [low, high] (both included, like random.randint) from <stream>
+        """
+        return low + int(self.random(stream) * (high - low + 1))
+
+    def permutation(self, stream, n):
+        """
+        Returns:
+            list, random permutation of range(n) from <stream>
+        """
+        key = (stream, n)
+        permutations = self.permutations.get(key)
+        if not permutations:
+            count = max(1, self.block_size // max(1, n))
+            permutations = self.generators[stream].random((count, n)).argsort(axis=1).tolist()
+            self.permutations[key] = permutations
+        return permutations.pop()
+
+    def shuffle(self, stream, items, key=None):
+        """
+        Shuffle the list-like <items> in place with a permutation from <stream>, or from its substream of <key>
+        if the streams are keyed
+        """
+        if key is not None and self.keyed:
+            order = self.keyed_generator(stream, key).permutation(len(items)).tolist()
+        else:
+            order = self.permutation(stream, len(items))
+        shuffled = [items[i] for i in order]
+        if isinstance(items, list):
+            items[:] = shuffled
+        else:
+            for i, item in enumerate(shuffled):
+                items[i] = item
+
+
+def uniform(rng, stream):
+    """
+    Returns:
+        float uniform in [0, 1) from <stream> of <rng>, or from the random module if rng is None
+    """
+    if rng is None:
+        return random.random()
+    return rng.random(stream)
+
+
+def shuffle(rng, stream, items, key=None):
+    """
+    Shuffle <items> in place with <stream> of <rng> (its substream of <key> if keyed), or with the random module
+    if rng is None
+    """
+    if rng is None:
+        random.shuffle(items)
+    else:
+        rng.shuffle(stream, items, key)
+
+
+def schedule(rng, miners, clock):
+    """
+    Put the list <miners> in their running order at clock time <clock>: a shuffle of the scheduling stream of <rng>
+    (or of the random module if rng is None), or with keyed streams the order of their scheduling priorities,
+    where the order of two miners does not depend on the other miners of the list
+    """
+    if rng is None or not rng.keyed:
+        shuffle(rng, "scheduling", miners)
+        return
+    ids = np.array([miner.id for miner in miners], dtype=np.int64)
+    order = np.lexsort((ids, rng.priorities("scheduling", ids, clock)))
+    miners[:] = [miners[i] for i in order.tolist()]
+
+
+def new_rng(config):
+    """
+    Returns:
+        RandomStreams if config "rng" is "numpy", or "keyed" for keyed streams (see RandomStreams), seeded from
+        the random module so that the runs seeded with random.seed stay reproducible; None (use the random module)
+        if it is "python"
+    """
+    kind = config.get('rng', 'python')
+    if kind in ('numpy', 'keyed'):
+        return RandomStreams(random.getrandbits(64), keyed=kind == 'keyed')
+    if kind != 'python':
+        raise ValueError(f"Unknown rng: {kind}")
+    return None
@@ -0,0 +1,416 @@
+import heapq
+import multiprocessing
+import os
+from collections import deque
+
+from BlockFinder import BlockFinderSampler
+from Event import EventQueue, ReceiveNewBlockEvent, update_event
+from Log import logger
+from Miner import RemoteMiner, SelfishPropagator
+from Rng import schedule
+
+
+def relay_edges(miners):
+    """
+    Returns:
+        [(sender, receiver)] of every link a block can be sent over: the neighbours of each miner, and the link
+        of each selfish propagator to its selfish miner
+    """
+    edges = []
+    for miner in miners:
+        for neighbour in miner.neighbours:
+            edges.append((miner, neighbour))
+        if isinstance(miner, SelfishPropagator):
+            edges.append((miner, miner.selfish_miner))
+    return edges
+
+
+def partition(miner_ids, shard_count):
+    """
+    Returns:
+        dict{miner_id: shard index}, contiguous ranges of <miner_ids> of about the same size
+    """
+    ids = sorted(miner_ids)
+    return {miner_id: i * shard_count // len(ids) for i, miner_id in enumerate(ids)}
+
+
+def block_fields(block):
+    """
+    Returns:
+        tuple of the fields a block is rebuilt from in another process: the arguments of Block and the publish time
+    """
+    return block.id, block.miner_id, block.timestamp, block.parent_id, block.height, block.publish_timestamp
+
+
+class WindowPlanner:
+    def __init__(self, monitor, miners, time, lookahead):
+        """
+        Coordinator of a partitioned run. The blocks found in each window are drawn once for all miners by a
+        BlockFinderSampler over the mining stream, and get their ids in the scheduling order of their clock time
+        (see Rng.schedule), like run_ticks with keyed random streams, so that the shards only run their own
+        miners. When no miner has events queued at the end of a window, the next one starts at the clock time
+        of the next block.
+        Args:
+            monitor: MainMonitor at the start of the run
+            miners: every miner of the run, Miner objects or RemoteMiner proxies
+            time: number of blocks to simulate
+            lookahead: number of clock times per window
+        """
+        self.rng = monitor.pow.rng
+        self.sampler = BlockFinderSampler(monitor.pow, miners)
+        self.time = time
+        self.lookahead = lookahead
+        self.clock = monitor.clock
+        # first clock time of the next window
+        self.block_count = monitor.pow.block_count
+        # pow.block_count at the end of the planned windows
+        self.last_block_id = monitor.last_block_id
+        # first block of the last miner that found blocks, like run_ticks
+        self.windows = 0
+        # number of planned windows
+
+    def next_window(self, idle):
+        """
+        Plan the next window
+        Args:
+            idle: True if no miner has events queued, the window then starts at the clock time of the next block
+        Returns:
+            (start, end, found, block_count): the clock times [start, end) of the window,
+            [(clock, miner id, number of blocks, id of the first block)] of the blocks found in it in the order the
+            miners run, and pow.block_count at its end; None once <time> blocks are found
+        """
+        if self.block_count >= self.time:
+            return None
+        start = self.clock
+        if idle and self.sampler.next_clock(start) is not None:
+            start = self.sampler.next_clock(start)
+        end = start + self.lookahead
+        found = []
+        while self.block_count < self.time:
+            clock = self.sampler.next_clock(start)
+            if clock is None or clock >= end:
+                break
+            counts = self.sampler.found_at(clock)
+            for miner_id in sorted(counts, key=lambda miner_id: (self.rng.priority("scheduling", miner_id, clock),
+                                                                 miner_id)):
+                found.append((clock, miner_id, counts[miner_id], self.block_count))
+                self.last_block_id = self.block_count
+                self.block_count += counts[miner_id]
+            if self.block_count >= self.time:
+                # run_ticks stops after the clock time of the last block
+                end = clock + 1
+        self.clock = end
+        self.windows += 1
+        return start, end, found, self.block_count
+
+
+class ShardWorker:
+    def __init__(self, monitor, shard, owner, lookahead):
+        """
+        One shard of a partitioned run: runs the miners of this shard through the windows of a WindowPlanner.
+        Within a window a miner runs at the clock times it has events to process or finds a block, in the
+        scheduling order of the clock time; at the other clock times its run in run_ticks changes nothing. No
+        random number of the other shards' miners is drawn. Blocks sent to a miner of another shard accumulate
+        in that miner's receive queue, which serves as an outbox drained at the end of each window.
+        Args:
+            monitor: MainMonitor of the run, its miners of other shards are Miner objects or RemoteMiner proxies
+            shard: index of this shard
+            owner: dict{miner_id: shard index}
+            lookahead: number of clock times per window, at most the smallest link delay
+        """
+        self.monitor = monitor
+        self.shard = shard
+        self.owner = owner
+        self.lookahead = lookahead
+        self.miners = {miner.id: miner for miner in monitor.miners}
+        self.miners.update(monitor.remote_miners)
+        # dict{miner_id: Miner object or RemoteMiner} of every miner
+        self.local = [miner for miner in monitor.miners if owner[miner.id] == shard]
+        # Miner objects simulated by this shard
+        self.outboxes = sorted({receiver for sender, receiver in relay_edges(self.local)
+                                if owner[receiver.id] != shard}, key=lambda miner: miner.id)
+        # miners of other shards the miners of this shard send to
+        self.clock = monitor.clock - 1
+        # clock time being run
+        self.wakeups = {}
+        # dict{clock: set of ids of the miners of this shard to run at that clock time}
+        self.wakeup_clocks = []
+        # heap of the clock times of self.wakeups
+        self.mined = []
+        # [block] mined by the miners of this shard
+        for receiver in self.outboxes:
+            # the state of the other shards' miners is theirs
+            receiver.recv_events = EventQueue()
+        for miner in self.local:
+            miner.scheduler = self
+
+    def wake(self, miner, timestamp):
+        """
+        Run <miner> of this shard at <timestamp>, or at the next clock time if it is not after the current one
+        """
+        clock = max(timestamp, self.clock + 1)
+        miner_ids = self.wakeups.get(clock)
+        if miner_ids is None:
+            miner_ids = self.wakeups[clock] = set()
+            heapq.heappush(self.wakeup_clocks, clock)
+        miner_ids.add(miner.id)
+
+    def busy(self):
+        """
+        Returns:
+            Bool: True if a miner of this shard has events queued
+        """
+        return len(self.wakeup_clocks) > 0
+
+    def run_window(self, start, end, found, block_count):
+        """
+        Run the clock times [start, end) of a window planned by WindowPlanner.next_window
+        Args:
+            start: first clock time of the window
+            end: clock time after the window
+            found: [(clock, miner id, number of blocks, id of the first block)] of the blocks found in the window
+            block_count: pow.block_count at the end of the window
+        """
+        monitor = self.monitor
+        pow = monitor.pow
+        finders = {}
+        # dict{clock: dict{miner_id: (number of blocks, id of the first block)}} of the miners of this shard
+        for clock, miner_id, count, first_block_id in found:
+            if self.owner[miner_id] == self.shard:
+                finders.setdefault(clock, {})[miner_id] = (count, first_block_id)
+        finder_clocks = sorted(finders)
+        while True:
+            clock = min(self.wakeup_clocks[0] if self.wakeup_clocks else end,
+                        finder_clocks[0] if finder_clocks else end)
+            if clock >= end:
+                break
+            if self.wakeup_clocks and self.wakeup_clocks[0] == clock:
+                heapq.heappop(self.wakeup_clocks)
+            if finder_clocks and finder_clocks[0] == clock:
+                finder_clocks.pop(0)
+            found_now = finders.get(clock, {})
+            miners = [self.miners[miner_id] for miner_id in self.wakeups.pop(clock, set()) | found_now.keys()]
+            schedule(pow.rng, miners, clock)
+            self.clock = clock
+            for miner in miners:
+                miner.clock = clock
+                count, first_block_id = found_now.get(miner.id, (0, None))
+                if count > 0:
+                    # the ids of the blocks found before, by any shard, were given out by the planner
+                    pow.block_count = first_block_id
+                for new_block in miner.run(count):
+                    monitor.blocks[new_block.id] = new_block
+                    self.mined.append(new_block)
+                if miner.recv_events:
+                    self.wake(miner, miner.recv_events.peek_timestamp())
+                if miner.send_events:
+                    # upload bandwidth is used up, the rest is sent at the next clock time
+                    self.wake(miner, clock + 1)
+        self.clock = end - 1
+        monitor.clock = end
+        pow.block_count = block_count
+
+    def drain(self):
+        """
+        Empty the outboxes
+        Returns:
+            dict{shard index: [(receiver id, arrival clock, sender id, block fields)]}, in the order the blocks
+            were sent in
+        """
+        outgoing = {}
+        for receiver in self.outboxes:
+            events = receiver.recv_events
+            if not events:
+                continue
+            messages = outgoing.setdefault(self.owner[receiver.id], [])
+            while events:
+                event = events.pop()
+                messages.append((receiver.id, event.timestamp, event.sender.id, block_fields(event.block)))
+        return outgoing
+
+    def store_block(self, fields):
+        """
+        Returns:
+            block of <fields> (see block_fields), a replica is added to the monitor's blocks if it is not known yet
+        """
+        block = self.monitor.blocks.get(fields[0])
+        if block is None:
+            block = self.monitor.pow.new_block(*fields[:5])
+            block.publish_timestamp = fields[5]
+            self.monitor.blocks[block.id] = block
+        return block
+
+    def send_order(self, event, receiver):
+        """
+        Returns:
+            sort key of <event> in the receive queue of <receiver>: its send clock time, then the scheduling order
+            of its sender at that clock time
+        """
+        sent = event.timestamp - event.sender.link_delay(receiver)
+        return sent, self.monitor.pow.rng.priority("scheduling", event.sender.id, sent), event.sender.id
+
+    def deliver(self, messages):
+        """
+        Queue the blocks sent by the miners of other shards to the miners of this shard. In a single process the
+        receive queue of a clock time holds the blocks in the order they were sent: by send clock time, then by
+        the scheduling order of the senders at that time, so the queues they join are sorted back into that order.
+        Args:
+            messages: [(receiver id, arrival clock, sender id, block fields)], see drain
+        """
+        knowledge = self.monitor.pow.knowledge
+        touched = set()
+        for receiver_id, timestamp, sender_id, fields in messages:
+            block = self.store_block(fields)
+            receiver = self.miners[receiver_id]
+            update_event(ReceiveNewBlockEvent(timestamp, block, sender=self.miners[sender_id]), receiver.recv_events)
+            knowledge.mark_pending(receiver_id, block.id)
+            self.wake(receiver, timestamp)
+            touched.add((receiver, timestamp))
+        for receiver, timestamp in touched:
+            buckets = receiver.recv_events.buckets
+            buckets[timestamp] = deque(sorted(buckets[timestamp], key=lambda event: self.send_order(event, receiver)))
+
+    def result(self):
+        """
+        Returns:
+            dict of the state the coordinator needs for the report: the blocks mined by this shard's miners
+        """
+        for miner in self.local:
+            miner.scheduler = None
+            miner.clock = self.monitor.clock
+        return {
+            "blocks": [block_fields(block) for block in self.mined],
+            "processed": {miner.id: (miner.recv_events.processed, miner.send_events.processed)
+                          for miner in self.local},
+        }
+
+
+def shard_main(monitor, shard, owner, lookahead, time, conn):
+    """
+    Run shard <shard> through the windows received from the coordinator at <conn>, returning the blocks sent
+    across shards after each one, until it sends None
+    """
+    monitor.pow.profiler = None
+    monitor.pow.tracer = None
+    worker = ShardWorker(monitor, shard, owner, lookahead)
+    monitor.progress.start(monitor)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        window, incoming = message
+        worker.deliver(incoming)
+        worker.run_window(*window)
+        conn.send((worker.drain(), worker.busy()))
+        if shard == 0:
+            monitor.progress.update(monitor, time)
+    conn.send(worker.result())
+    conn.close()
+
+
+def check_shardable(monitor):
+    """
+    Check that the run of <monitor> can be split into shards
+    Returns:
+        lookahead of the shards: the smallest delay of the links of the miners of <monitor>
+    """
+    rng = monitor.pow.rng
+    if rng is None or not rng.keyed:
+        raise ValueError('A sharded run needs "rng": "keyed"')
+    if monitor.racing_test or monitor.chain_index is not None or monitor.checkpoint_file is not None:
+        raise ValueError("A sharded run supports neither racing tests, streaming rewards nor checkpoints")
+    lookahead = min(sender.link_delay(receiver) for sender, receiver in relay_edges(monitor.miners))
+    if lookahead <= 0:
+        raise ValueError("A sharded run needs positive link delays")
+    for miner in monitor.miners:
+        if miner.recv_events or miner.send_events or miner.propagation is not None:
+            raise ValueError("A sharded run starts from a monitor without queued events, with event propagation")
+    return lookahead
+
+
+def run_sharded(monitor, time, shard_count=0):
+    """
+    Simulate until <time> blocks are mined with the miners split across <shard_count> processes (0 for one per
+    core). Shards synchronize conservatively: within a window of lookahead clock times (the smallest link delay)
+    no block sent by one shard can reach another, so each window runs independently and the blocks sent across
+    shards are exchanged at its end. The coordinator draws the blocks found in each window (see WindowPlanner),
+    so no shard draws the random numbers of the others' miners. The blocks, block ids and rewards are those of
+    run_ticks with the same seed, which needs random numbers that do not depend on the order the shards draw in:
+    config "rng" "keyed".
+    Args:
+        monitor: MainMonitor at the start of a run
+        time: number of blocks to simulate
+        shard_count: number of shards
+    Returns:
+        blocks: dict{block_id: block object} of all mined blocks, last_block_id: id of the last mined block
+    """
+    lookahead = check_shardable(monitor)
+    shard_count = min(shard_count or os.cpu_count(), len(monitor.miners))
+    owner = partition([miner.id for miner in monitor.miners], shard_count)
+    context = multiprocessing.get_context("fork")
+    connections = []
+    processes = []
+    for shard in range(shard_count):
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=shard_main, args=(monitor, shard, owner, lookahead, time, child_conn),
+                                  daemon=True)
+        process.start()
+        child_conn.close()
+        connections.append(parent_conn)
+        processes.append(process)
+    planner = WindowPlanner(monitor, monitor.miners, time, lookahead)
+    incoming = [[] for _ in connections]
+    idle = True
+    while True:
+        window = planner.next_window(idle)
+        if window is None:
+            break
+        start, end, found, block_count = window
+        for shard, conn in enumerate(connections):
+            conn.send(((start, end, [block for block in found if owner[block[1]] == shard], block_count),
+                       incoming[shard]))
+        replies = [conn.recv() for conn in connections]
+        incoming = [[message for outgoing, _ in replies for message in outgoing.get(shard, [])]
+                    for shard in range(shard_count)]
+        idle = not any(busy for _, busy in replies) and not any(incoming)
+    for conn in connections:
+        conn.send(None)
+    results = [conn.recv() for conn in connections]
+    for process in processes:
+        process.join()
+    logger.info("Sharded run: %d shards, %d windows of %d clock times", shard_count, planner.windows, lookahead)
+    return collect(monitor, results, planner)
+
+
+def collect(monitor, results, planner):
+    """
+    Rebuild the block tree of the monitor from the blocks mined by the shards, replacing the blocks it knew
+    Args:
+        monitor: MainMonitor of the coordinator
+        results: ShardWorker.result of every shard
+        planner: WindowPlanner of the run
+    Returns:
+        blocks: dict{block_id: block object} of all mined blocks, last_block_id: id of the last mined block
+    """
+    pow = monitor.pow
+    monitor.blocks = {0: pow.prime_block}
+    if isinstance(pow.prime_block.children, list):
+        pow.prime_block.children.clear()
+    fields = sorted(block for result in results for block in result["blocks"])
+    for block_id, miner_id, timestamp, parent_id, height, publish_timestamp in fields:
+        block = pow.new_block(block_id, miner_id, timestamp, parent_id, height)
+        block.publish_timestamp = publish_timestamp
+        monitor.blocks[block_id] = block
+        monitor.blocks[parent_id].add_child(block_id)
+    monitor.last_block_id = planner.last_block_id
+    monitor.clock = planner.clock
+    pow.block_count = planner.block_count
+    miners = {miner.id: miner for miner in monitor.miners}
+    for result in results:
+        for miner_id, (recv_processed, send_processed) in result["processed"].items():
+            if miner_id in miners:
+                miners[miner_id].recv_events.processed = recv_processed
+                miners[miner_id].send_events.processed = send_processed
+    for miner in monitor.miners:
+        miner.clock = monitor.clock
+    return monitor.blocks, monitor.last_block_id
@@ -0,0 +1,344 @@
+import multiprocessing
+import os
+import queue
+import time
+
+import numpy as np
+
+from Log import logger
+
+FORMATS = ("txt", "dot", "png")
+# snapshot file formats: Block.subtree_str text, Graphviz source, and the rendered Graphviz image
+CLOSE_TIMEOUT = 60
+# seconds SnapshotRenderer.close waits for the rendering process before terminating it
+CAPTURE_SHARE = 0.1
+# largest share of the wall time spent capturing snapshots, slow captures are spaced out further
+
+
+class BlockTreeCapture:
+    FIELDS = ("ids", "parent_ids", "miner_ids", "notified", "pending")
+
+    def __init__(self, capacity=1024):
+        """
+        Arrays of the block tree kept up to date from capture to capture: each update appends the blocks mined
+        since the previous one and refreshes the counts of the blocks not yet received by every miner, so a
+        capture costs the new and propagating blocks rather than the whole tree.
+        Args:
+            capacity: initial number of blocks, the arrays double when full
+        """
+        self.size = 0
+        # number of captured blocks
+        self.ids = np.empty(capacity, dtype=np.int64)
+        # captured block ids, in increasing order
+        self.parent_ids = np.empty(capacity, dtype=np.int64)
+        self.miner_ids = np.empty(capacity, dtype=np.int64)
+        self.notified = np.empty(capacity, dtype=np.int64)
+        # notified_miner_count of each block
+        self.pending = np.empty(capacity, dtype=np.int64)
+        # pending_notified_miner_count of each block
+        self.open = []
+        # indices of the blocks some miner has not received yet, their counts are refreshed
+        self.next_id = 0
+        # id of the next block to capture
+
+    def grow(self, capacity):
+        for name in self.FIELDS:
+            array = getattr(self, name)
+            new_array = np.empty(capacity, dtype=array.dtype)
+            new_array[:self.size] = array[:self.size]
+            setattr(self, name, new_array)
+
+    def update(self, blocks, block_count, miner_count):
+        """
+        Bring the arrays up to date with <blocks>
+        Args:
+            blocks: dict{block_id: block object} of the mined blocks
+            block_count: pow.block_count, the ids of the mined blocks are below it
+            miner_count: number of miners, a block received by all of them keeps its counts
+        """
+        new_ids = []
+        block_id = self.next_id
+        while block_id < block_count and block_id in blocks:
+            new_ids.append(block_id)
+            block_id += 1
+        self.next_id = block_id
+        if self.size + len(new_ids) > len(blocks):
+            self.drop_pruned(blocks)
+        if self.size + len(new_ids) > len(self.ids):
+            self.grow(max(2 * len(self.ids), self.size + len(new_ids)))
+        for block_id in new_ids:
+            block = blocks[block_id]
+            i = self.size
+            self.ids[i] = block_id
+            self.parent_ids[i] = block.parent_id
+            self.miner_ids[i] = block.miner_id
+            self.open.append(i)
+            self.size += 1
+        still_open = []
+        for i in self.open:
+            block = blocks[int(self.ids[i])]
+            self.notified[i] = block.notified_miner_count
+            self.pending[i] = block.pending_notified_miner_count
+            if self.notified[i] < miner_count:
+                still_open.append(i)
+        self.open = still_open
+
+    def drop_pruned(self, blocks):
+        """
+        Drop the captured blocks a BlockPruner removed from <blocks>
+        """
+        keep = np.fromiter((block_id in blocks for block_id in self.ids[:self.size].tolist()), dtype=bool,
+                           count=self.size)
+        position = np.cumsum(keep) - 1
+        # new index of each kept block
+        open_blocks = [i for i in self.open if keep[i]]
+        for name in self.FIELDS:
+            array = getattr(self, name)
+            kept = array[:self.size][keep]
+            array[:len(kept)] = kept
+        self.size = int(np.count_nonzero(keep))
+        self.open = [int(position[i]) for i in open_blocks]
+
+    def snapshot(self, clock, block_count):
+        return BlockTreeSnapshot(*(getattr(self, name)[:self.size].copy() for name in self.FIELDS), clock,
+                                 block_count)
+
+
+class BlockTreeSnapshot:
+    def __init__(self, ids, parent_ids, miner_ids, notified, pending, clock, block_count):
+        """
+        Copy of the block tree at a clock time as compact arrays, cheap to send to the rendering process.
+        Blocks are in id order, so a parent always comes before its children. Blocks whose parent is not in
+        the tree (the prime block, or the lowest blocks left by a BlockPruner) are roots.
+        Args:
+            ids: int64 array of the block ids, increasing
+            parent_ids: parent id of each block
+            miner_ids: miner id of each block
+            notified: notified_miner_count of each block
+            pending: pending_notified_miner_count of each block
+            clock: clock time of the snapshot
+            block_count: pow.block_count at the clock time
+        """
+        self.clock = clock
+        self.block_count = block_count
+        self.ids = ids
+        self.miner_ids = miner_ids
+        self.notified = notified
+        self.pending = pending
+        position = np.minimum(np.searchsorted(ids, parent_ids), max(len(ids) - 1, 0))
+        self.parents = np.where(ids[position] == parent_ids, position, -1) if len(ids) > 0 else position
+        # index of the parent of each block, -1 for a root
+
+    def children(self):
+        """
+        Returns:
+            (indptr, indices): the children of block i are indices[indptr[i]:indptr[i+1]], in id order
+        """
+        parents = self.parents
+        has_parent = np.flatnonzero(parents >= 0)
+        indices = has_parent[np.argsort(parents[has_parent], kind="stable")]
+        indptr = np.zeros(len(parents) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(parents[has_parent], minlength=len(parents)), out=indptr[1:])
+        return indptr, indices
+
+    def label(self, i):
+        return f"<{self.ids[i]},{self.miner_ids[i]},{self.notified[i]},{self.pending[i]}>"
+
+    def to_text(self):
+        """
+        Returns:
+            str, the tree of each root as printed by Block.subtree_str, without recursion
+        """
+        count = len(self.ids)
+        depth = np.zeros(count, dtype=np.int64)
+        for i in range(count):
+            if self.parents[i] >= 0:
+                depth[i] = depth[self.parents[i]] + 1
+        labels = [self.label(i) for i in range(count)]
+        size = np.array([len(label) + 1 for label in labels], dtype=np.int64) + depth
+        # length of the text of each subtree, the children are ordered by it like Block.subtree_str
+        for i in range(count - 1, -1, -1):
+            if self.parents[i] >= 0:
+                size[self.parents[i]] += size[i]
+        indptr, indices = self.children()
+        lines = []
+        stack = np.flatnonzero(self.parents < 0)[::-1].tolist()
+        while len(stack) > 0:
+            i = stack.pop()
+            lines.append("\t" * int(depth[i]) + labels[i] + "\n")
+            children = indices[indptr[i]:indptr[i + 1]]
+            stack.extend(children[np.argsort(size[children], kind="stable")][::-1].tolist())
+        return "".join(lines)
+
+    def to_graph(self):
+        """
+        Returns:
+            graphviz.Digraph of the tree, unnotified blocks in grey
+        """
+        from graphviz import Digraph
+        graph = Digraph(comment="Blockchain state")
+        for i, block_id in enumerate(self.ids.tolist()):
+            label = f"ID:{block_id}\nMID:{self.miner_ids[i]}\nPR:{self.notified[i]}\nPPR:{self.pending[i]}\n"
+            graph.node(str(block_id), label=label, color="grey" if self.notified[i] == 0 else "black")
+            if self.parents[i] >= 0:
+                graph.edge(str(block_id), str(self.ids[self.parents[i]]))
+        return graph
+
+
+def render_snapshot(snapshot, directory, formats):
+    """
+    Write <snapshot> to <directory>/blockchain-clock-<clock>.<format> for each of <formats>
+    Returns:
+        [str], formats that could not be rendered
+    """
+    path = os.path.join(directory, f"blockchain-clock-{snapshot.clock}")
+    failed = []
+    if "txt" in formats:
+        with open(path + ".txt", "w") as f:
+            f.write(snapshot.to_text())
+    if "dot" in formats or "png" in formats:
+        graph = snapshot.to_graph()
+        if "dot" in formats:
+            with open(path + ".gv", "w") as f:
+                f.write(graph.source)
+        if "png" in formats:
+            from graphviz import ExecutableNotFound
+            try:
+                graph.render(outfile=path + ".png", format="png", cleanup=True)
+            except ExecutableNotFound:
+                failed.append("png")
+    return failed
+
+
+def render_worker(snapshots, directory, formats):
+    """
+    Render the snapshots of queue <snapshots> until it yields None, in the rendering process. A snapshot that
+    cannot be rendered is logged and skipped, so that the process keeps emptying the queue.
+    """
+    while True:
+        snapshot = snapshots.get()
+        if snapshot is None:
+            return
+        try:
+            failed = render_snapshot(snapshot, directory, formats)
+        except Exception:
+            logger.exception("Cannot render the snapshot at clock %d", snapshot.clock)
+            continue
+        if len(failed) > 0:
+            logger.warning("Cannot render %s snapshots, is Graphviz installed?", ", ".join(failed))
+            formats = [f for f in formats if f not in failed]
+
+
+class SnapshotRenderer:
+    def __init__(self, directory, formats=("txt",), interval=1.0, queue_size=2):
+        """
+        Capture the block tree at most once every <interval> seconds of wall time and render it in a separate
+        process, so the simulation loop only pays for the capture. When the renderer falls behind and
+        <queue_size> snapshots are waiting, new snapshots are dropped.
+        Args:
+            directory: directory the snapshots are written to, created if needed
+            formats: formats of FORMATS to write
+            interval: minimal wall time between two captures, in seconds
+            queue_size: number of snapshots waiting to be rendered
+        """
+        for f in formats:
+            if f not in FORMATS:
+                raise ValueError(f"Unknown snapshot format: {f}")
+        self.directory = directory
+        self.formats = list(formats)
+        self.interval = interval
+        self.queue_size = queue_size
+        self.next_time = 0
+        # wall time of the next capture
+        self.queue = None
+        # multiprocessing.Queue of the snapshots to render, None until the first capture
+        self.process = None
+        # rendering process, None until the first capture
+        self.captured = 0
+        # number of snapshots sent to the rendering process
+        self.capture = BlockTreeCapture()
+        # arrays of the block tree as of the last capture
+        self.dropped = 0
+        # number of snapshots dropped because the rendering process was behind or stopped
+        self.stopped = False
+        # True once the rendering process died, no more snapshots are captured
+
+    def __getstate__(self):
+        # a checkpointed renderer starts a new rendering process when restored
+        state = dict(self.__dict__)
+        state["queue"] = None
+        state["process"] = None
+        state["stopped"] = False
+        return state
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.queue = multiprocessing.Queue(self.queue_size)
+        self.process = multiprocessing.Process(target=render_worker, args=(self.queue, self.directory, self.formats),
+                                               daemon=True)
+        self.process.start()
+
+    def offer(self, monitor):
+        """
+        Capture the block tree of <monitor> if the interval has passed, called when new blocks were mined. The
+        interval runs from the end of the capture, and grows so that captures take at most CAPTURE_SHARE of
+        the wall time.
+        """
+        now = time.perf_counter()
+        if now < self.next_time:
+            return
+        self.next_time = now + self.interval
+        if self.stopped:
+            self.dropped += 1
+            return
+        if self.process is None:
+            self.start()
+        elif not self.process.is_alive():
+            logger.warning("The snapshot rendering process stopped (exit code %s), no more snapshots are rendered",
+                           self.process.exitcode)
+            self.stopped = True
+            self.dropped += 1
+            return
+        if self.queue.full():
+            self.dropped += 1
+            return
+        self.capture.update(monitor.blocks, monitor.pow.block_count, len(monitor.miners))
+        snapshot = self.capture.snapshot(monitor.clock, monitor.pow.block_count)
+        try:
+            self.queue.put_nowait(snapshot)
+            self.captured += 1
+        except queue.Full:
+            self.dropped += 1
+        end = time.perf_counter()
+        self.next_time = end + max(self.interval, (end - now) * (1 / CAPTURE_SHARE - 1))
+
+    def close(self):
+        """
+        Wait for the rendering process to render the queued snapshots, at most CLOSE_TIMEOUT seconds
+        """
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            try:
+                self.queue.put(None, timeout=CLOSE_TIMEOUT)
+            except queue.Full:
+                pass
+            self.process.join(CLOSE_TIMEOUT)
+        if self.process.is_alive():
+            logger.warning("The snapshot rendering process did not finish in %d s, terminating it", CLOSE_TIMEOUT)
+            self.process.terminate()
+            self.process.join()
+        self.queue = None
+        self.process = None
+        logger.info("Snapshots: %d captured, %d dropped", self.captured, self.dropped)
+
+
+def new_snapshot_renderer(config, suffix=""):
+    """
+    Returns:
+        SnapshotRenderer writing to config "snapshot_dir" + <suffix>, None if no snapshot directory is configured
+    """
+    if not config.get('snapshot_dir'):
+        return None
+    return SnapshotRenderer(config['snapshot_dir'] + suffix, config.get('snapshot_formats', ["txt"]),
+                            config.get('snapshot_interval', 1.0), config.get('snapshot_queue_size', 2))
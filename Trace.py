@@ -0,0 +1,129 @@
+import os
+from array import array
+from enum import IntEnum
+
+import numpy as np
+
+
+class TraceKind(IntEnum):
+    RUN = 0
+    MINE = 1
+    SEND = 2
+    RECEIVE = 3
+    PUBLISH = 4
+
+
+TRACE_RUN, TRACE_MINE, TRACE_SEND, TRACE_RECEIVE, TRACE_PUBLISH = (int(kind) for kind in TraceKind)
+# plain int kinds for the hooks, looking up an enum member costs about as much as recording
+
+
+COLUMNS = (("clock", "q", np.int64), ("miner", "i", np.int32), ("block", "i", np.int32), ("peer", "i", np.int32),
+           ("kind", "B", np.uint8))
+# (name, array typecode, numpy dtype) of the record fields, in file order: widest first keeps the columns aligned
+
+
+class TraceRecorder:
+    def __init__(self, path, capacity=65536, runs=False):
+        """
+        Record simulation events as fixed-width records (clock, kind, miner, block, peer). Records are written
+        into preallocated column buffers and flushed in bulk into a memory-mapped file, one chunk per flush:
+            int64 record count, then each column of COLUMNS, padded to 8 bytes.
+        Load a trace with load_trace.
+        Args:
+            path: trace file, overwritten
+            capacity: number of records buffered between flushes
+            runs: if True, also record a RUN record per miner and clock time it runs (large traces)
+        """
+        self.path = path
+        self.capacity = capacity
+        self.runs = runs
+        self.count = 0
+        # number of records in the buffers
+        self.buffers = [array(typecode, bytes(array(typecode).itemsize * capacity)) for _, typecode, _ in COLUMNS]
+        # preallocated column buffers, indexed like COLUMNS
+        self.clock, self.miner, self.block, self.peer, self.kind = self.buffers
+        self.size = 0
+        # bytes written to the file
+        open(path, "wb").close()
+
+    def record(self, clock, kind, miner, block, peer=-1):
+        """
+        Append a record
+        Args:
+            clock: clock time of the event
+            kind: TraceKind
+            miner: id of the miner the event happens at
+            block: id of the block (number of new blocks for RUN)
+            peer: id of the other miner involved, -1 if none
+        """
+        n = self.count
+        self.clock[n] = clock
+        self.kind[n] = kind
+        self.miner[n] = miner
+        self.block[n] = block
+        self.peer[n] = peer
+        n += 1
+        self.count = n
+        if n == self.capacity:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered records to the end of the file through a memory map
+        """
+        n = self.count
+        if n == 0:
+            return
+        sizes = [padded(n * buffer.itemsize) for buffer in self.buffers]
+        chunk = np.memmap(self.path, dtype=np.uint8, mode="r+", offset=self.size, shape=(8 + sum(sizes),))
+        chunk[:8] = np.array([n], dtype=np.int64).view(np.uint8)
+        start = 8
+        for buffer, size in zip(self.buffers, sizes):
+            data = np.frombuffer(buffer, dtype=np.uint8, count=n * buffer.itemsize)
+            chunk[start:start + len(data)] = data
+            start += size
+        chunk.flush()
+        del chunk
+        self.size += 8 + sum(sizes)
+        self.count = 0
+
+    def close(self):
+        self.flush()
+
+
+def padded(size):
+    return (size + 7) // 8 * 8
+
+
+def load_trace(path):
+    """
+    Load a trace written by TraceRecorder
+    Args:
+        path: trace file
+    Returns:
+        dict{column name: numpy array} with the columns of COLUMNS, single chunk traces are memory-mapped
+    """
+    file_size = os.path.getsize(path)
+    if file_size == 0:
+        return {name: np.zeros(0, dtype=dtype) for name, _, dtype in COLUMNS}
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    chunks = {name: [] for name, _, _ in COLUMNS}
+    offset = 0
+    while offset < file_size:
+        n = int(data[offset:offset + 8].view(np.int64)[0])
+        offset += 8
+        for name, _, dtype in COLUMNS:
+            size = n * np.dtype(dtype).itemsize
+            chunks[name].append(data[offset:offset + size].view(dtype))
+            offset += padded(size)
+    return {name: columns[0] if len(columns) == 1 else np.concatenate(columns) for name, columns in chunks.items()}
+
+
+def new_tracer(config, suffix=""):
+    """
+    Returns:
+        TraceRecorder writing to config "trace_file" + <suffix>, None if no trace file is configured
+    """
+    if not config.get('trace_file'):
+        return None
+    return TraceRecorder(config['trace_file'] + suffix, runs=bool(config.get('trace_runs', 0)))